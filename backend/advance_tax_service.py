@@ -0,0 +1,362 @@
+import logging
+import uuid
+from datetime import datetime, date, timezone
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from money import to_paise, to_paise_array, from_paise, apply_rate_array
+from tax_computation_service import tax_computation_service, INCOME_COLUMNS, DEDUCTION_COLUMNS
+from tax_rule_registry import tax_rule_registry, fy_start_year, fy_code
+
+logger = logging.getLogger(__name__)
+
+# Instalments: (month, day, cumulative share due, share below which 234C applies)
+INSTALMENTS = [
+    (6, 15, 0.15, 0.12),
+    (9, 15, 0.45, 0.36),
+    (12, 15, 0.75, 0.75),
+    (3, 15, 1.00, 1.00)
+]
+# Presumptive taxpayers (44AD/44ADA) pay everything in the last instalment
+PRESUMPTIVE_INSTALMENTS = [0.0, 0.0, 0.0, 1.00]
+# Months of 234C interest charged on each instalment's shortfall
+INSTALMENT_INTEREST_MONTHS = [3, 3, 3, 1]
+# No advance tax is due below this assessed tax (section 208)
+MIN_ADVANCE_TAX = 10000
+# 234B applies when advance tax paid is below this share of assessed tax
+SECTION_234B_SHARE = 0.90
+INTEREST_RATE_PER_MONTH = 0.01
+# Shortfalls are rounded down to a multiple of Rs 100 before interest (rule 119A), in paise
+INTEREST_ROUNDING = 100 * 100
+
+
+def instalment_dates(financial_year: str) -> List[date]:
+    """Due dates of the four instalments of a financial year."""
+    start_year = int(tax_rule_registry.get(financial_year).financial_year[2:6])
+    return [date(start_year + (month < 4), month, day) for month, day, _, _ in INSTALMENTS]
+
+
+def _months_from(start: date, end: date) -> int:
+    """Months from start to end, a part month counting as a full month; zero if end is before start."""
+    if end < start:
+        return 0
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def _parse_payment_dates(values: pd.Series) -> pd.Series:
+    # Challans print dates day first; OCR may give any of the extractor's formats
+    return pd.to_datetime(values, format="mixed", dayfirst=True, errors="coerce")
+
+
+class AdvanceTaxService:
+    """Advance tax instalments and 234B/234C interest for every client in one batch.
+
+    Each client's estimated income for the year is kept in
+    advance_tax_estimates. Tax on it comes from calculate_income_tax_batch,
+    and advance tax paid comes from challans read by extract_challan. The
+    whole firm is evaluated as numpy arrays, one row per client.
+    """
+
+    async def ensure_indexes(self, db):
+        """Create indexes used by estimate lookups and reports."""
+        await db.advance_tax_estimates.create_index(
+            [("client_id", 1), ("financial_year", 1)], unique=True
+        )
+        await db.advance_tax_estimates.create_index("financial_year")
+        await db.advance_tax_reports.create_index([("financial_year", 1), ("generated_at", -1)])
+
+    def validate_income_data(self, income_data: Dict[str, Any]) -> None:
+        """Raise ValueError for keys the tax computation would silently ignore."""
+        unknown = sorted(set(income_data) - set(INCOME_COLUMNS + DEDUCTION_COLUMNS))
+        if unknown:
+            raise ValueError(
+                f"Unknown income_data fields: {', '.join(unknown)}. "
+                f"Expected any of: {', '.join(INCOME_COLUMNS + DEDUCTION_COLUMNS)}"
+            )
+
+    async def save_estimate(self, db, client_id: str, estimate: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a client's estimated income for a financial year."""
+        self.validate_income_data(estimate.get("income_data", {}))
+        financial_year = tax_rule_registry.get(estimate.get("financial_year")).financial_year
+        record = {
+            "client_id": client_id,
+            "financial_year": financial_year,
+            "income_data": estimate.get("income_data", {}),
+            "regime": estimate.get("regime", "new"),
+            "tds_credit": estimate.get("tds_credit", 0),
+            "presumptive": estimate.get("presumptive", False),
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        await db.advance_tax_estimates.update_one(
+            {"client_id": client_id, "financial_year": financial_year},
+            {"$set": record},
+            upsert=True
+        )
+        return record
+
+    async def load_challans(self, db, financial_year: str, client_ids: Optional[List[str]] = None) -> pd.DataFrame:
+        """Advance tax challans of a year from extraction results, one row per distinct challan.
+
+        A challan belongs to the client of the uploaded document, or failing
+        that to the client whose PAN is printed on it.
+        """
+        start_year = int(financial_year[2:6])
+        assessment_year = f"{start_year + 1}-{str(start_year + 2)[2:]}"
+        rows = await db.extraction_results.aggregate([
+            {"$match": {
+                "document_type": "challan",
+                "success": True,
+                "data.tax_type": "Advance Tax",
+                "data.assessment_year": {"$regex": assessment_year}
+            }},
+            {"$lookup": {
+                "from": "documents",
+                "localField": "document_id",
+                "foreignField": "id",
+                "as": "document"
+            }},
+            {"$project": {
+                "_id": 0,
+                "client_id": {"$first": "$document.client_id"},
+                "pan": "$data.pan",
+                "challan_number": "$data.challan_number",
+                "payment_date": "$data.payment_date",
+                "amount_paid": "$data.amount_paid"
+            }}
+        ]).to_list(None)
+
+        challans = pd.DataFrame(rows, columns=["client_id", "pan", "challan_number", "payment_date", "amount_paid"])
+        if challans.empty:
+            return challans
+        if challans["client_id"].isna().any():
+            clients = await db.clients.find({"pan": {"$ne": None}}, {"_id": 0, "id": 1, "pan": 1}).to_list(None)
+            by_pan = {client["pan"].upper(): client["id"] for client in clients if client.get("pan")}
+            challans["client_id"] = challans["client_id"].fillna(challans["pan"].str.upper().map(by_pan))
+
+        challans["payment_date"] = _parse_payment_dates(challans["payment_date"])
+        challans = challans.dropna(subset=["client_id", "payment_date", "amount_paid"])
+        if client_ids is not None:
+            challans = challans[challans["client_id"].isin(client_ids)]
+        # The same challan uploaded or extracted twice counts once
+        return challans.drop_duplicates(subset=["client_id", "challan_number", "payment_date", "amount_paid"])
+
+    def compute(
+        self,
+        estimates: List[Dict[str, Any]],
+        challans: pd.DataFrame,
+        financial_year: str,
+        as_of: date
+    ) -> pd.DataFrame:
+        """Instalment position and interest of every estimate as of a date. Amounts in paise."""
+        financial_year = tax_rule_registry.get(financial_year).financial_year
+        size = len(estimates)
+        client_ids = [estimate["client_id"] for estimate in estimates]
+
+        # Tax on estimated income, both regimes computed in one pass each
+        income = pd.DataFrame([estimate.get("income_data", {}) for estimate in estimates], index=range(size)).fillna(0)
+        regime_old = np.array([estimate.get("regime") == "old" for estimate in estimates], dtype=bool)
+        tax_old = tax_computation_service.calculate_income_tax_batch(income, "old", financial_year)["total_tax_liability"]
+        tax_new = tax_computation_service.calculate_income_tax_batch(income, "new", financial_year)["total_tax_liability"]
+        tax = to_paise_array(np.where(regime_old, tax_old, tax_new))
+        tds_credit = to_paise_array(np.array([float(estimate.get("tds_credit") or 0) for estimate in estimates]))
+        assessed = np.maximum(tax - tds_credit, 0)
+        liable = assessed >= to_paise(MIN_ADVANCE_TAX)
+
+        # Cumulative advance tax paid by each due date and by the end of the year
+        due_dates = instalment_dates(financial_year)
+        year_end = date(due_dates[-1].year, 3, 31)
+        cutoffs = np.array(due_dates + [year_end], dtype="datetime64[D]")
+        paid = np.zeros((size, len(cutoffs)), dtype=np.int64)
+        paid_now = np.zeros(size, dtype=np.int64)
+        if len(challans):
+            row_of = {client_id: index for index, client_id in enumerate(client_ids)}
+            rows = challans["client_id"].map(row_of)
+            known = rows.notna().to_numpy()
+            days = challans["payment_date"].to_numpy().astype("datetime64[D]")[known]
+            column = np.searchsorted(cutoffs, days, side="left")
+            in_year = column < len(cutoffs)
+            row = rows.to_numpy()[known].astype(np.int64)
+            amount = to_paise_array(challans["amount_paid"].astype(float).to_numpy()[known])
+            np.add.at(paid, (row[in_year], column[in_year]), amount[in_year])
+            to_date = in_year & (days <= np.datetime64(as_of, "D"))
+            np.add.at(paid_now, row[to_date], amount[to_date])
+        paid = np.cumsum(paid, axis=1)
+        paid_by_due = paid[:, :len(due_dates)]
+        paid_by_year_end = paid[:, -1]
+
+        presumptive = np.array([bool(estimate.get("presumptive")) for estimate in estimates])
+        shares = np.where(
+            presumptive[:, None], np.array(PRESUMPTIVE_INSTALMENTS), np.array([share for _, _, share, _ in INSTALMENTS])
+        )
+        floors = np.where(
+            presumptive[:, None], np.array(PRESUMPTIVE_INSTALMENTS), np.array([floor for _, _, _, floor in INSTALMENTS])
+        )
+        required = apply_rate_array(assessed[:, None], shares)
+        # 234C: interest on an instalment's shortfall unless paid reached the floor share
+        below_floor = paid_by_due < apply_rate_array(assessed[:, None], floors)
+        shortfall = np.where(liable[:, None] & below_floor, np.maximum(required - paid_by_due, 0), 0)
+        shortfall = shortfall // INTEREST_ROUNDING * INTEREST_ROUNDING
+        passed = np.array([due < as_of for due in due_dates])
+        # Only instalments whose due date has passed carry a shortfall
+        shortfall = shortfall * passed
+        interest_234c = apply_rate_array(
+            shortfall * np.array(INSTALMENT_INTEREST_MONTHS), INTEREST_RATE_PER_MONTH
+        ).sum(axis=1)
+
+        # 234B: from 1 April after the year until the as-of date, if under 90% was paid
+        months_234b = _months_from(date(year_end.year, 4, 1), as_of)
+        short_234b = liable & (paid_by_year_end < apply_rate_array(assessed, SECTION_234B_SHARE))
+        unpaid = np.where(short_234b, np.maximum(assessed - paid_by_year_end, 0), 0)
+        interest_234b = apply_rate_array(unpaid // INTEREST_ROUNDING * INTEREST_ROUNDING * months_234b, INTEREST_RATE_PER_MONTH)
+
+        # The instalment due next (or the last one, once all have passed)
+        upcoming = int(np.argmax(~passed)) if not passed.all() else len(due_dates) - 1
+        amount_due = np.where(liable, np.maximum(required[:, upcoming] - paid_now, 0), 0)
+
+        return pd.DataFrame({
+            "client_id": client_ids,
+            "estimated_tax": tax,
+            "tds_credit": tds_credit,
+            "assessed_tax": assessed,
+            "advance_tax_liable": liable,
+            "paid_to_date": paid_now,
+            "paid_by_year_end": paid_by_year_end,
+            "next_instalment": due_dates[upcoming].isoformat(),
+            "next_instalment_required": np.where(liable, required[:, upcoming], 0),
+            "amount_due": amount_due,
+            "interest_234c": interest_234c,
+            "interest_234b": interest_234b,
+            **{f"shortfall_q{index + 1}": shortfall[:, index] for index in range(len(due_dates))}
+        })
+
+    def _rows(self, table: pd.DataFrame, names: Dict[str, str]) -> List[Dict[str, Any]]:
+        amount_columns = [column for column in table.columns if table[column].dtype == np.int64]
+        rows = []
+        for record in table.to_dict("records"):
+            for column in amount_columns:
+                record[column] = from_paise(int(record[column]))
+            record["advance_tax_liable"] = bool(record["advance_tax_liable"])
+            record["client_name"] = names.get(record["client_id"])
+            rows.append(record)
+        return rows
+
+    async def _evaluate(
+        self,
+        db,
+        financial_year: str,
+        as_of: date,
+        client_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        query = {"financial_year": financial_year}
+        if client_id:
+            query["client_id"] = client_id
+        estimates = await db.advance_tax_estimates.find(query, {"_id": 0}).to_list(None)
+        if not estimates:
+            return {"table": None, "names": {}}
+        client_ids = [estimate["client_id"] for estimate in estimates]
+        challans = await self.load_challans(db, financial_year, client_ids)
+        clients = await db.clients.find({"id": {"$in": client_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+        return {
+            "table": self.compute(estimates, challans, financial_year, as_of),
+            "names": {client["id"]: client["name"] for client in clients}
+        }
+
+    async def client_schedule(
+        self,
+        db,
+        client_id: str,
+        financial_year: Optional[str] = None,
+        as_of: Optional[date] = None
+    ) -> Dict[str, Any]:
+        """One client's instalment position and interest."""
+        try:
+            as_of = as_of or datetime.now(timezone.utc).date()
+            financial_year = tax_rule_registry.get(financial_year).financial_year
+            evaluated = await self._evaluate(db, financial_year, as_of, client_id)
+            if evaluated["table"] is None:
+                return {"success": False, "error": "No advance tax estimate for this year"}
+            return {
+                "success": True,
+                "financial_year": financial_year,
+                "as_of": as_of.isoformat(),
+                "instalment_dates": [due.isoformat() for due in instalment_dates(financial_year)],
+                **self._rows(evaluated["table"], evaluated["names"])[0]
+            }
+        except Exception as e:
+            logger.error(f"Error computing advance tax: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def shortfall_report(self, db, financial_year: Optional[str] = None, as_of: Optional[date] = None) -> Dict[str, Any]:
+        """Firm-wide report of clients short on the next instalment or owing interest; stored in advance_tax_reports."""
+        try:
+            as_of = as_of or datetime.now(timezone.utc).date()
+            financial_year = tax_rule_registry.get(
+                financial_year or fy_code(fy_start_year(as_of))
+            ).financial_year
+            started = datetime.now(timezone.utc)
+            evaluated = await self._evaluate(db, financial_year, as_of)
+            table = evaluated["table"]
+
+            report = {
+                "id": str(uuid.uuid4()),
+                "financial_year": financial_year,
+                "as_of": as_of.isoformat(),
+                "generated_at": started.isoformat(),
+                "clients_evaluated": 0,
+                "clients_with_shortfall": 0,
+                "total_amount_due": 0.0,
+                "total_interest_234b": 0.0,
+                "total_interest_234c": 0.0,
+                "rows": []
+            }
+            if table is not None:
+                flagged = table[(table["amount_due"] > 0) | (table["interest_234b"] > 0) | (table["interest_234c"] > 0)]
+                flagged = flagged.sort_values("amount_due", ascending=False)
+                report.update({
+                    "clients_evaluated": len(table),
+                    "clients_with_shortfall": len(flagged),
+                    "total_amount_due": from_paise(int(table["amount_due"].sum())),
+                    "total_interest_234b": from_paise(int(table["interest_234b"].sum())),
+                    "total_interest_234c": from_paise(int(table["interest_234c"].sum())),
+                    "rows": self._rows(flagged, evaluated["names"])
+                })
+            report["duration_seconds"] = round((datetime.now(timezone.utc) - started).total_seconds(), 3)
+
+            await db.advance_tax_reports.insert_one(report.copy())
+            logger.info(
+                f"Advance tax report {financial_year} as of {as_of}: "
+                f"{report['clients_with_shortfall']} of {report['clients_evaluated']} clients short"
+            )
+            return {"success": True, **report}
+        except Exception as e:
+            logger.error(f"Error building advance tax report: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def latest_report(self, db, financial_year: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        query = {"financial_year": tax_rule_registry.get(financial_year).financial_year} if financial_year else {}
+        return await db.advance_tax_reports.find_one(query, {"_id": 0}, sort=[("generated_at", -1)])
+
+    def report_email(self, report: Dict[str, Any]) -> Dict[str, str]:
+        """Subject and HTML body summarizing a shortfall report."""
+        rows = "".join(
+            f"<tr><td>{row['client_name'] or row['client_id']}</td><td>₹{row['amount_due']:,.2f}</td>"
+            f"<td>₹{row['interest_234c']:,.2f}</td><td>₹{row['interest_234b']:,.2f}</td></tr>"
+            for row in report["rows"]
+        )
+        return {
+            "subject": (
+                f"Advance tax shortfall {report['financial_year']}: "
+                f"{report['clients_with_shortfall']} clients, ₹{report['total_amount_due']:,.2f} due"
+            ),
+            "html": (
+                f"<h2>Advance tax position as of {report['as_of']}</h2>"
+                f"<p>{report['clients_with_shortfall']} of {report['clients_evaluated']} clients are short.</p>"
+                "<table><tr><th>Client</th><th>Due next instalment</th><th>234C</th><th>234B</th></tr>"
+                f"{rows}</table>"
+            )
+        }
+
+# Global advance tax service
+advance_tax_service = AdvanceTaxService()
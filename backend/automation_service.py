@@ -3,11 +3,18 @@ from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+import time
 import uuid
 from typing import List, Dict, Any
 from email_service import email_service
+from advance_tax_service import advance_tax_service
+from penalty_exposure_service import penalty_exposure_service
+from compliance_calendar_service import compliance_calendar_service, FORMS
+from tax_rule_registry import fy_start_year, fy_code
+from query_reminder_service import query_reminder_service
 from pathlib import Path
 from dotenv import load_dotenv
+from pymongo import UpdateOne
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +27,21 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Days before a deadline on which reminders go out
+REMINDER_DAYS_AHEAD = [1, 3, 7]
+# Reminder emails in flight at once, and sent per second overall
+REMINDER_CONCURRENCY = int(os.environ.get('REMINDER_CONCURRENCY', 4))
+REMINDER_RATE_PER_SECOND = float(os.environ.get('REMINDER_RATE_PER_SECOND', 2))
+# Clients per bulk upsert of recurring tasks
+RECURRING_CHUNK_SIZE = 5000
+# (period, label, due date) of the TDS returns of a financial year
+TDS_RETURN_DUES = dict(FORMS["TDS"])["TDS Return"]
+
+
+def recurring_task_key(client_id: str, return_type: str, period: str) -> str:
+    """Idempotency key of a generated task, e.g. "<client>:GSTR-3B:2025-05"."""
+    return f"{client_id}:{return_type}:{period}"
+
 class AutomationService:
     def __init__(self):
         self.scheduler = AsyncIOScheduler()
@@ -63,195 +85,326 @@ class AutomationService:
             id='auto_assign'
         )
         
+        # Advance tax shortfall report five days before each instalment date
+        self.scheduler.add_job(
+            self.send_advance_tax_report,
+            'cron',
+            month='3,6,9,12',
+            day=10,
+            hour=7,
+            minute=0,
+            id='advance_tax_report'
+        )
+        
+        # Recompute penalty exposure daily, as days overdue grow
+        self.scheduler.add_job(
+            penalty_exposure_service.refresh_all,
+            'cron',
+            args=[db],
+            hour=1,
+            minute=0,
+            id='penalty_exposure'
+        )
+        
+        # Rebuild changed compliance calendars; rolls into a new financial year on 1 April
+        self.scheduler.add_job(
+            compliance_calendar_service.refresh_all,
+            'cron',
+            args=[db],
+            hour=0,
+            minute=30,
+            id='compliance_calendar'
+        )
+        
+        # Follow up on queries clients have not answered
+        self.scheduler.add_job(
+            query_reminder_service.send_due_reminders,
+            'cron',
+            args=[db],
+            hour=10,
+            minute=0,
+            id='query_reminders'
+        )
+        
         logger.info("All automation jobs scheduled")
     
+    async def ensure_indexes(self, db):
+        """Create indexes for the deadline scan and run history."""
+        await db.tasks.create_index([("status", 1), ("due_date", 1)])
+        # Sparse, as tasks created by hand have no key
+        await db.tasks.create_index("idempotency_key", unique=True, sparse=True)
+        await db.automation_runs.create_index([("job", 1), ("started_at", -1)])
+    
     async def send_deadline_reminders(self):
-        """Send reminders for tasks due in 1, 3, and 7 days."""
+        """Send reminders for tasks due in 1, 3, and 7 days.
+        
+        One aggregation finds the due tasks of all three days with their
+        client's email; tasks sharing a recipient go out as one email.
+        """
+        started = datetime.now(timezone.utc)
+        clock = time.monotonic()
+        run = {"id": str(uuid.uuid4()), "job": "deadline_reminders", "started_at": started.isoformat()}
         try:
-            now = datetime.now(timezone.utc)
+            # Whole days, 1, 3 and 7 days from today
+            windows = {}
+            for days_ahead in REMINDER_DAYS_AHEAD:
+                day_start = (started + timedelta(days=days_ahead)).replace(hour=0, minute=0, second=0, microsecond=0)
+                windows[days_ahead] = (day_start.isoformat(), (day_start + timedelta(days=1)).isoformat())
             
-            # Tasks due in 1, 3, and 7 days
-            for days_ahead in [1, 3, 7]:
-                target_date = now + timedelta(days=days_ahead)
-                
-                # Find tasks due on target date
-                tasks = await db.tasks.find({
+            cursor = db.tasks.aggregate([
+                {"$match": {
                     "status": {"$in": ["PENDING", "IN_PROGRESS"]},
-                    "due_date": {
-                        "$gte": target_date.replace(hour=0, minute=0).isoformat(),
-                        "$lt": target_date.replace(hour=23, minute=59).isoformat()
-                    }
-                }, {"_id": 0}).to_list(100)
-                
-                for task in tasks:
-                    # Get client email
-                    client = await db.clients.find_one(
-                        {"id": task['client_id']},
-                        {"_id": 0}
-                    )
-                    
-                    if client and client.get('email'):
-                        # Send reminder
-                        due_date = datetime.fromisoformat(task['due_date'])
-                        email_service.send_deadline_reminder(
-                            to=client['email'],
-                            task_name=task['title'],
-                            deadline=due_date,
-                            priority=task['priority']
-                        )
-                        
-                        logger.info(
-                            f"Reminder sent for task {task['id']} "
-                            f"({days_ahead} days before deadline)"
-                        )
+                    "$or": [{"due_date": {"$gte": low, "$lt": high}} for low, high in windows.values()]
+                }},
+                {"$lookup": {"from": "clients", "localField": "client_id", "foreignField": "id", "as": "client"}},
+                {"$unwind": "$client"},
+                {"$match": {"client.email": {"$nin": [None, ""]}}},
+                {"$project": {"_id": 0, "id": 1, "title": 1, "due_date": 1, "priority": 1, "email": "$client.email"}}
+            ])
             
-            logger.info("Deadline reminders sent successfully")
+            by_recipient = {}
+            tasks_found = 0
+            async for task in cursor:
+                tasks_found += 1
+                by_recipient.setdefault(task["email"].strip().lower(), []).append({
+                    "id": task["id"],
+                    "title": task["title"],
+                    "deadline": datetime.fromisoformat(task["due_date"]),
+                    "priority": task.get("priority") or "MEDIUM"
+                })
+            query_seconds = time.monotonic() - clock
+            
+            recipients = list(by_recipient)
+            messages = [email_service.deadline_digest_message(to, by_recipient[to]) for to in recipients]
+            results = await email_service.send_many(
+                messages,
+                concurrency=REMINDER_CONCURRENCY,
+                rate_per_second=REMINDER_RATE_PER_SECOND
+            )
+            failed = [to for to, result in zip(recipients, results) if not result.get("success")]
+            
+            run.update({
+                "success": True,
+                "tasks": tasks_found,
+                "recipients": len(recipients),
+                "sent": len(recipients) - len(failed),
+                "failed": len(failed),
+                "failed_recipients": failed[:100],
+                "query_seconds": round(query_seconds, 3),
+                "send_seconds": round(time.monotonic() - clock - query_seconds, 3)
+            })
+            logger.info(
+                f"Deadline reminders: {run['sent']} of {len(recipients)} recipients "
+                f"covering {tasks_found} tasks"
+            )
         except Exception as e:
+            run.update({"success": False, "error": str(e)})
             logger.error(f"Error sending deadline reminders: {str(e)}")
+        
+        run["finished_at"] = datetime.now(timezone.utc).isoformat()
+        run["duration_seconds"] = round(time.monotonic() - clock, 3)
+        await db.automation_runs.insert_one(run)
+        run.pop("_id", None)
+        return run
     
-    async def generate_recurring_tasks(self):
-        """Auto-generate recurring compliance tasks."""
+    async def get_runs(self, db, job: str = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent recorded runs, optionally of one job."""
+        query = {"job": job} if job else {}
+        return await db.automation_runs.find(query, {"_id": 0}).sort("started_at", -1).to_list(limit)
+    
+    async def send_advance_tax_report(self):
+        """Evaluate every client's advance tax and email the shortfall report to the firm."""
         try:
-            now = datetime.now(timezone.utc)
-            clients = await db.clients.find(
-                {"status": "ACTIVE"},
-                {"_id": 0}
-            ).to_list(1000)
+            report = await advance_tax_service.shortfall_report(db)
+            if not report['success']:
+                return
             
-            for client in clients:
-                await self._generate_gst_tasks(client, now)
-                await self._generate_itr_tasks(client, now)
-                await self._generate_tds_tasks(client, now)
+            recipient = os.environ.get('ADVANCE_TAX_REPORT_EMAIL')
+            if recipient:
+                email = advance_tax_service.report_email(report)
+                email_service.send_email(to=recipient, subject=email['subject'], html=email['html'])
             
-            logger.info("Recurring tasks generated successfully")
+            logger.info(f"Advance tax report sent: {report['clients_with_shortfall']} clients short")
         except Exception as e:
-            logger.error(f"Error generating recurring tasks: {str(e)}")
+            logger.error(f"Error sending advance tax report: {str(e)}")
     
-    async def _generate_gst_tasks(self, client: Dict, now: datetime):
-        """Generate GST filing tasks."""
-        # Check if client has GSTIN
-        if not client.get('gstin'):
-            return
+    async def backfill_idempotency_keys(self, db) -> int:
+        """Key recurring tasks generated before idempotency keys, from their titles.
         
-        # GST monthly return - GSTR-3B due on 20th of next month
-        next_month = now.replace(day=1) + timedelta(days=32)
-        due_date = next_month.replace(day=20, hour=23, minute=59)
-        
-        # Check if task already exists
-        existing = await db.tasks.find_one({
-            "client_id": client['id'],
-            "task_type": "GST",
-            "title": {"$regex": f"GSTR-3B.*{next_month.strftime('%B %Y')}"}
-        })
+        Old TDS titles carry no year, and titles edited since no longer parse,
+        so those tasks are left unkeyed. Runs at startup, so it never raises.
+        """
+        try:
+            candidates = {}
+            cursor = db.tasks.find(
+                {"auto_generated": True, "idempotency_key": {"$exists": False}},
+                {"_id": 0, "id": 1, "client_id": 1, "task_type": 1, "title": 1}
+            )
+            async for task in cursor:
+                key = None
+                try:
+                    if task.get("task_type") == "GST" and task["title"].startswith("GSTR-3B Filing - "):
+                        period = datetime.strptime(task["title"].rsplit(" - ", 1)[1], "%B %Y")
+                        key = recurring_task_key(task["client_id"], "GSTR-3B", period.strftime("%Y-%m"))
+                    elif task.get("task_type") == "ITR" and task["title"].startswith("ITR Filing - FY "):
+                        key = recurring_task_key(task["client_id"], "ITR", task["title"].rsplit("FY ", 1)[1])
+                except (AttributeError, KeyError, ValueError) as e:
+                    logger.warning(f"Leaving task {task.get('id')} unkeyed: {str(e)}")
+                    continue
+                # Earlier duplicates of a key stay unkeyed, so the unique index can build
+                if key and key not in candidates:
+                    candidates[key] = task["id"]
+            
+            # Keys taken by tasks keyed earlier, including on a previous start
+            existing = await db.tasks.find(
+                {"idempotency_key": {"$in": list(candidates)}}, {"_id": 0, "idempotency_key": 1}
+            ).to_list(None)
+            for task in existing:
+                candidates.pop(task["idempotency_key"], None)
+            
+            updates = [
+                UpdateOne({"id": task_id}, {"$set": {"idempotency_key": key}})
+                for key, task_id in candidates.items()
+            ]
+            if updates:
+                await db.tasks.bulk_write(updates, ordered=False)
+                logger.info(f"Added idempotency keys to {len(updates)} recurring tasks")
+            return len(updates)
+        except Exception as e:
+            logger.error(f"Error backfilling idempotency keys: {str(e)}")
+            return 0
+    
+    def recurring_candidates(self, client: Dict, now: datetime) -> List[Dict[str, Any]]:
+        """Recurring tasks a client should have as of now, each with its idempotency key."""
+        candidates = []
         
-        if not existing:
-            task = {
-                "id": str(uuid.uuid4()),
+        # GST monthly return - GSTR-3B due on 20th of next month
+        if client.get('gstin'):
+            next_month = now.replace(day=1) + timedelta(days=32)
+            due_date = next_month.replace(day=20, hour=23, minute=59, second=0, microsecond=0)
+            candidates.append({
+                "idempotency_key": recurring_task_key(client['id'], "GSTR-3B", next_month.strftime("%Y-%m")),
                 "title": f"GSTR-3B Filing - {next_month.strftime('%B %Y')}",
                 "description": "Monthly GST return filing",
-                "client_id": client['id'],
-                "client_name": client['name'],
                 "task_type": "GST",
-                "due_date": due_date.isoformat(),
-                "status": "PENDING",
-                "priority": "HIGH",
-                "assigned_to": None,
-                "created_at": now.isoformat(),
-                "auto_generated": True
-            }
-            await db.tasks.insert_one(task)
-            logger.info(f"Generated GST task for client {client['name']}")
-    
-    async def _generate_itr_tasks(self, client: Dict, now: datetime):
-        """Generate ITR filing tasks."""
-        # Check if client has PAN
-        if not client.get('pan'):
-            return
-        
-        # ITR deadline - July 31st of each year (for previous FY)
-        if now.month <= 7:
-            # Current year deadline
-            due_date = datetime(now.year, 7, 31, 23, 59, tzinfo=timezone.utc)
-            fy = f"{now.year-1}-{str(now.year)[2:]}"
-        else:
-            # Next year deadline
-            due_date = datetime(now.year + 1, 7, 31, 23, 59, tzinfo=timezone.utc)
-            fy = f"{now.year}-{str(now.year + 1)[2:]}"
-        
-        # Only generate if we're within 3 months of deadline
-        if (due_date - now).days <= 90 and (due_date - now).days > 0:
-            existing = await db.tasks.find_one({
-                "client_id": client['id'],
-                "task_type": "ITR",
-                "title": {"$regex": f"ITR Filing.*FY {fy}"}
+                "due_date": due_date,
+                "priority": "HIGH"
             })
-            
-            if not existing:
-                task = {
-                    "id": str(uuid.uuid4()),
+        
+        # ITR deadline - July 31st of each year (for previous FY), from 3 months ahead
+        if client.get('pan'):
+            year = now.year if now.month <= 7 else now.year + 1
+            due_date = datetime(year, 7, 31, 23, 59, tzinfo=timezone.utc)
+            fy = f"{year - 1}-{str(year)[2:]}"
+            if 0 < (due_date - now).days <= 90:
+                candidates.append({
+                    "idempotency_key": recurring_task_key(client['id'], "ITR", fy),
                     "title": f"ITR Filing - FY {fy}",
                     "description": "Annual Income Tax Return filing",
-                    "client_id": client['id'],
-                    "client_name": client['name'],
                     "task_type": "ITR",
-                    "due_date": due_date.isoformat(),
+                    "due_date": due_date,
+                    "priority": "URGENT"
+                })
+        
+        # TDS quarterly returns, from 30 days ahead; Q4 of last year falls due in this one
+        if client.get('tan'):
+            start_year = fy_start_year(now)
+            for year in (start_year - 1, start_year):
+                for period, label, due in TDS_RETURN_DUES(year):
+                    due_date = datetime(due.year, due.month, due.day, 23, 59, tzinfo=timezone.utc)
+                    if 0 < (due_date - now).days <= 30:
+                        candidates.append({
+                            "idempotency_key": recurring_task_key(client['id'], "TDS", f"{fy_code(year)}-{period}"),
+                            "title": f"TDS Return Filing - {label}",
+                            "description": "Quarterly TDS return",
+                            "task_type": "GENERAL",
+                            "due_date": due_date,
+                            "priority": "HIGH"
+                        })
+        
+        for candidate in candidates:
+            candidate["client_id"] = client['id']
+            candidate["client_name"] = client.get('name')
+        return candidates
+    
+    async def _upsert_recurring(self, clients: List[Dict], tans: Dict[str, str], now: datetime) -> Dict[str, int]:
+        updates = []
+        task_ids = []
+        for client in clients:
+            if not client.get('tan') and client['id'] in tans:
+                client = {**client, 'tan': tans[client['id']]}
+            for candidate in self.recurring_candidates(client, now):
+                task = {
+                    "id": str(uuid.uuid4()),
+                    **candidate,
+                    "due_date": candidate["due_date"].isoformat(),
                     "status": "PENDING",
-                    "priority": "URGENT",
                     "assigned_to": None,
                     "created_at": now.isoformat(),
                     "auto_generated": True
                 }
-                await db.tasks.insert_one(task)
-                logger.info(f"Generated ITR task for client {client['name']}")
+                # Only inserts; a task that already exists is left as it is
+                updates.append(UpdateOne(
+                    {"idempotency_key": task["idempotency_key"]},
+                    {"$setOnInsert": task},
+                    upsert=True
+                ))
+                task_ids.append(task["id"])
+        if not updates:
+            return {"candidates": 0, "created": 0}
+        result = await db.tasks.bulk_write(updates, ordered=False)
+        # Tasks generated already overdue count toward exposure straight away
+        await penalty_exposure_service.refresh_tasks(db, [task_ids[index] for index in result.upserted_ids])
+        return {"candidates": len(updates), "created": result.upserted_count}
     
-    async def _generate_tds_tasks(self, client: Dict, now: datetime):
-        """Generate TDS return filing tasks."""
-        # Check if client has TAN (stored in additional fields)
-        client_meta = await db.client_metadata.find_one({"client_id": client['id']})
-        if not client_meta or not client_meta.get('tan'):
-            return
-        
-        # TDS quarterly return - due on 31st of month after quarter end
-        quarters = [
-            (1, 3, 31, 7),   # Q4 of previous FY
-            (4, 6, 31, 7),   # Q1
-            (7, 9, 31, 10),  # Q2
-            (10, 12, 31, 1)  # Q3
-        ]
+    async def generate_recurring_tasks(self):
+        """Auto-generate recurring compliance tasks.
         
-        for start_month, end_month, due_day, due_month_offset in quarters:
-            quarter_end = datetime(now.year, end_month, 30, tzinfo=timezone.utc)
-            due_month = end_month + due_month_offset
-            due_year = now.year if due_month <= 12 else now.year + 1
-            due_month = due_month if due_month <= 12 else due_month - 12
+        Every candidate task is keyed by client, return and period and
+        upserted in bulk, so a re-run creates nothing twice.
+        """
+        started = datetime.now(timezone.utc)
+        clock = time.monotonic()
+        run = {"id": str(uuid.uuid4()), "job": "recurring_tasks", "started_at": started.isoformat()}
+        try:
+            # TAN may live only in client_metadata
+            metadata = await db.client_metadata.find(
+                {"tan": {"$nin": [None, ""]}}, {"_id": 0, "client_id": 1, "tan": 1}
+            ).to_list(None)
+            tans = {meta['client_id']: meta['tan'] for meta in metadata}
             
-            due_date = datetime(due_year, due_month, due_day, 23, 59, tzinfo=timezone.utc)
+            totals = {"clients": 0, "candidates": 0, "created": 0}
+            cursor = db.clients.find(
+                {"status": "ACTIVE"},
+                {"_id": 0, "id": 1, "name": 1, "gstin": 1, "pan": 1, "tan": 1}
+            ).batch_size(RECURRING_CHUNK_SIZE)
+            chunk = []
+            async for client in cursor:
+                chunk.append(client)
+                if len(chunk) >= RECURRING_CHUNK_SIZE:
+                    for field, count in (await self._upsert_recurring(chunk, tans, started)).items():
+                        totals[field] += count
+                    totals["clients"] += len(chunk)
+                    chunk = []
+            if chunk:
+                for field, count in (await self._upsert_recurring(chunk, tans, started)).items():
+                    totals[field] += count
+                totals["clients"] += len(chunk)
             
-            # Only generate if deadline is within next 30 days
-            if 0 < (due_date - now).days <= 30:
-                existing = await db.tasks.find_one({
-                    "client_id": client['id'],
-                    "task_type": "GENERAL",
-                    "title": {"$regex": f"TDS Return.*Q{start_month//3 + 1}"}
-                })
-                
-                if not existing:
-                    task = {
-                        "id": str(uuid.uuid4()),
-                        "title": f"TDS Return Filing - Q{start_month//3 + 1}",
-                        "description": "Quarterly TDS return",
-                        "client_id": client['id'],
-                        "client_name": client['name'],
-                        "task_type": "GENERAL",
-                        "due_date": due_date.isoformat(),
-                        "status": "PENDING",
-                        "priority": "HIGH",
-                        "assigned_to": None,
-                        "created_at": now.isoformat(),
-                        "auto_generated": True
-                    }
-                    await db.tasks.insert_one(task)
-                    logger.info(f"Generated TDS task for client {client['name']}")
+            run.update({"success": True, **totals})
+            logger.info(
+                f"Recurring tasks: {totals['created']} created from {totals['candidates']} candidates "
+                f"for {totals['clients']} clients"
+            )
+        except Exception as e:
+            run.update({"success": False, "error": str(e)})
+            logger.error(f"Error generating recurring tasks: {str(e)}")
+        
+        run["finished_at"] = datetime.now(timezone.utc).isoformat()
+        run["duration_seconds"] = round(time.monotonic() - clock, 3)
+        await db.automation_runs.insert_one(run)
+        run.pop("_id", None)
+        return run
     
     async def update_overdue_tasks(self):
         """Mark tasks as overdue if past due date."""
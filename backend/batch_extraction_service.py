@@ -0,0 +1,267 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from ocr_service import ocr_service
+from file_service import file_service
+from image_ocr_service import image_ocr_service
+
+logger = logging.getLogger(__name__)
+
+# Document type -> OCRService extractor method
+EXTRACTORS = {
+    "form16": "extract_form16",
+    "invoice": "extract_invoice",
+    "bank_statement": "extract_bank_statement",
+    "challan": "extract_challan"
+}
+
+# Columns of the consolidated table for each document type. Form 16 columns
+# use the same keys as TaxComputationService.calculate_income_tax income_data.
+TABLE_COLUMNS = {
+    "form16": [
+        "employee_name", "employee_pan", "employer_name", "employer_pan",
+        "financial_year", "gross_salary", "total_deductions", "taxable_income",
+        "tax_deducted"
+    ],
+    "invoice": [
+        "invoice_number", "invoice_date", "vendor_name", "vendor_gstin",
+        "buyer_gstin", "subtotal", "cgst", "sgst", "igst", "total_amount"
+    ],
+    "bank_statement": [
+        "bank_name", "account_number", "statement_period",
+        "opening_balance", "closing_balance"
+    ],
+    "challan": [
+        "challan_number", "payment_date", "pan", "assessment_year",
+        "tax_type", "amount_paid", "bank_name"
+    ]
+}
+
+MAX_BATCH_FILES = 2000
+
+
+def _init_worker():
+    """Batch workers are already parallel; keep per-page OCR preprocessing in-process."""
+    image_ocr_service.parallel = False
+
+
+def _run_extractor(document_type: str, file_path: str) -> Dict[str, Any]:
+    """Run one extractor. Executed inside the worker processes."""
+    extractor = getattr(ocr_service, EXTRACTORS[document_type])
+    return extractor(file_path)
+
+
+class BatchExtractionService:
+    """Fan out OCR extraction over a process pool and track job progress."""
+
+    def __init__(self):
+        self.max_workers = int(os.environ.get('OCR_BATCH_WORKERS', os.cpu_count() or 2))
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Create the worker pool on first use."""
+        if self._pool is None:
+            # spawn keeps the workers free of the parent's Mongo/scheduler threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return self._pool
+
+    async def ensure_indexes(self, db):
+        """Create indexes used by job and result lookups."""
+        await db.extraction_jobs.create_index("id", unique=True)
+        await db.extraction_results.create_index([("job_id", 1), ("filename", 1)])
+
+    def check_document_type(self, document_type: str):
+        """Raise ValueError for a document type without an extractor."""
+        if document_type not in EXTRACTORS:
+            raise ValueError(f"Unsupported document type '{document_type}'")
+
+    def unpack_zip(self, zip_content: bytes, category: str = "ocr_batch") -> List[Dict[str, Any]]:
+        """Store every supported file of a zip archive and return batch items.
+
+        The archive is checked against MAX_BATCH_FILES before anything is
+        written, and files already saved are removed if a later one fails.
+        """
+        with zipfile.ZipFile(io.BytesIO(zip_content)) as archive:
+            members = []
+            for member in archive.infolist():
+                name = Path(member.filename).name
+                if member.is_dir() or name.startswith('.') or member.filename.startswith('__MACOSX'):
+                    continue
+                if Path(name).suffix.lower() not in ocr_service.supported_formats:
+                    continue
+                members.append((member, name))
+            if len(members) > MAX_BATCH_FILES:
+                raise ValueError(f"Batch limited to {MAX_BATCH_FILES} files")
+
+            items = []
+            try:
+                for member, name in members:
+                    saved = file_service.save_file(archive.read(member), name, category)
+                    if not saved["success"]:
+                        raise ValueError(saved["error"])
+                    items.append({
+                        "document_id": None,
+                        "filename": name,
+                        "file_url": saved["file_url"]
+                    })
+            except Exception:
+                for item in items:
+                    file_service.delete_file(item["file_url"])
+                raise
+        return items
+
+    async def items_from_documents(self, db, document_ids: List[str]) -> List[Dict[str, Any]]:
+        """Build batch items from stored document records."""
+        documents = await db.documents.find(
+            {"id": {"$in": document_ids}},
+            {"_id": 0, "id": 1, "filename": 1, "file_url": 1}
+        ).to_list(len(document_ids))
+        return [
+            {
+                "document_id": doc["id"],
+                "filename": doc["filename"],
+                "file_url": doc["file_url"]
+            }
+            for doc in documents
+        ]
+
+    async def create_job(
+        self,
+        db,
+        document_type: str,
+        items: List[Dict[str, Any]],
+        source: str,
+        client_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Register a new extraction job."""
+        self.check_document_type(document_type)
+
+        job = {
+            "id": str(uuid.uuid4()),
+            "document_type": document_type,
+            "source": source,
+            "client_id": client_id,
+            "status": "QUEUED",
+            "total": len(items),
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "started_at": None,
+            "completed_at": None
+        }
+        await db.extraction_jobs.insert_one(job.copy())
+        return job
+
+    async def run_job(self, db, job_id: str, document_type: str, items: List[Dict[str, Any]]):
+        """Extract every item with bounded concurrency, persisting each result."""
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        await db.extraction_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "RUNNING", "started_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
+        async def process(item: Dict[str, Any]):
+            async with semaphore:
+                file_path = file_service.get_file_path(item["file_url"])
+                if file_path is None:
+                    result = {"success": False, "error": "File not found"}
+                else:
+                    try:
+                        result = await loop.run_in_executor(
+                            pool, _run_extractor, document_type, str(file_path)
+                        )
+                    except Exception as e:
+                        logger.error(f"Extraction failed for {item['filename']}: {str(e)}")
+                        result = {"success": False, "error": str(e)}
+
+            await db.extraction_results.insert_one({
+                "id": str(uuid.uuid4()),
+                "job_id": job_id,
+                "document_id": item["document_id"],
+                "filename": item["filename"],
+                "file_url": item["file_url"],
+                "document_type": document_type,
+                "success": result.get("success", False),
+                "data": result.get("data"),
+                "confidence": result.get("confidence"),
+                "error": result.get("error"),
+                "processed_at": datetime.now(timezone.utc).isoformat()
+            })
+            await db.extraction_jobs.update_one(
+                {"id": job_id},
+                {"$inc": {"processed": 1, "succeeded" if result.get("success") else "failed": 1}}
+            )
+
+        try:
+            await asyncio.gather(*(process(item) for item in items))
+            status = "COMPLETED"
+        except Exception as e:
+            logger.error(f"Batch extraction job {job_id} failed: {str(e)}")
+            status = "FAILED"
+
+        await db.extraction_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": status, "completed_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        logger.info(f"Batch extraction job {job_id} finished with status {status}")
+
+    async def get_job(self, db, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get job progress."""
+        job = await db.extraction_jobs.find_one({"id": job_id}, {"_id": 0})
+        if job and job["total"]:
+            job["progress_percentage"] = round(job["processed"] / job["total"] * 100, 2)
+        return job
+
+    async def get_consolidated_table(self, db, job_id: str) -> Dict[str, Any]:
+        """Flatten the per-file results of a job into one table."""
+        job = await db.extraction_jobs.find_one({"id": job_id}, {"_id": 0})
+        if not job:
+            return {"success": False, "error": "Job not found"}
+
+        columns = TABLE_COLUMNS[job["document_type"]]
+        rows = []
+        errors = []
+        cursor = db.extraction_results.find({"job_id": job_id}, {"_id": 0}).sort("filename", 1)
+        async for result in cursor:
+            if not result["success"]:
+                errors.append({"filename": result["filename"], "error": result["error"]})
+                continue
+            data = result["data"] or {}
+            row = {"filename": result["filename"], "document_id": result["document_id"]}
+            row.update({column: data.get(column) for column in columns})
+            row["confidence"] = result["confidence"]
+            rows.append(row)
+
+        return {
+            "success": True,
+            "job": job,
+            "columns": ["filename", "document_id"] + columns + ["confidence"],
+            "rows": rows,
+            "errors": errors
+        }
+
+    def shutdown(self):
+        """Stop the worker pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Global batch extraction service
+batch_extraction_service = BatchExtractionService()
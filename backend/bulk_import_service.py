@@ -5,6 +5,9 @@ from typing import List, Dict, Any
 import logging
 from io import BytesIO
 
+from identifier_validator import validate_gstin_series, validate_pan_series
+from penalty_exposure_service import penalty_exposure_service
+
 logger = logging.getLogger(__name__)
 
 class BulkImportService:
@@ -27,12 +30,19 @@ class BulkImportService:
                     "error": f"Missing required columns: {', '.join(missing)}"
                 }
             
+            # Validate every GSTIN and PAN up front
+            identifier_errors = self._identifier_errors(df)
+            
             # Process each row
             imported = 0
             errors = []
             
             for index, row in df.iterrows():
                 try:
+                    if index in identifier_errors:
+                        errors.append(f"Row {index + 2}: {identifier_errors[index]}")
+                        continue
+                    
                     # Check if client already exists
                     existing = await db.clients.find_one({"email": row['email']})
                     if existing:
@@ -72,6 +82,23 @@ class BulkImportService:
                 "error": str(e)
             }
     
+    def _identifier_errors(self, df: pd.DataFrame) -> Dict[int, str]:
+        """Row index -> first GSTIN or PAN problem, for rows that have one."""
+        errors = {}
+        pans = df['pan'] if 'pan' in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if 'gstin' in df.columns:
+            present = df['gstin'].notna()
+            checked = validate_gstin_series(df.loc[present, 'gstin'], pans[present])
+            for index, valid, error in zip(df.index[present], checked['valid'], checked['error']):
+                if not valid:
+                    errors[index] = f"{error} ({df.at[index, 'gstin']})"
+        present = pans.notna()
+        checked = validate_pan_series(pans[present])
+        for index, valid, error in zip(df.index[present], checked['valid'], checked['error']):
+            if not valid and index not in errors:
+                errors[index] = f"{error} ({pans[index]})"
+        return errors
+    
     async def import_tasks_from_csv(self, file_content: bytes, db) -> Dict[str, Any]:
         """Import tasks from CSV file."""
         try:
@@ -86,6 +113,7 @@ class BulkImportService:
                 }
             
             imported = 0
+            imported_ids = []
             errors = []
             
             for index, row in df.iterrows():
@@ -119,11 +147,15 @@ class BulkImportService:
                     }
                     
                     await db.tasks.insert_one(task)
+                    imported_ids.append(task["id"])
                     imported += 1
                     
                 except Exception as e:
                     errors.append(f"Row {index + 2}: {str(e)}")
             
+            # Imported tasks may already be overdue
+            await penalty_exposure_service.refresh_tasks(db, imported_ids)
+            
             return {
                 "success": True,
                 "imported": imported,
@@ -144,7 +176,7 @@ class BulkImportService:
             'name': ['ABC Enterprises', 'XYZ Ltd'],
             'email': ['abc@example.com', 'xyz@example.com'],
             'phone': ['9876543210', '9876543211'],
-            'gstin': ['29ABCDE1234F1Z5', '27XYZAB5678G2H9'],
+            'gstin': ['29ABCDE1234F1ZW', '27XYZAB5678G1ZY'],
             'pan': ['ABCDE1234F', 'XYZAB5678G'],
             'address': ['123 Street, Mumbai', '456 Road, Delhi'],
             'status': ['ACTIVE', 'ACTIVE']
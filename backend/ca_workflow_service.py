@@ -6,9 +6,42 @@ from ca_workflow_models import (
     COMPLIANCE_MATRIX, SERVICE_CHECKLISTS,
     FinancialYear
 )
+from money import to_paise, from_paise, rate_to_ppm, prorate, RATE_SCALE
+from identifier_validator import GSTIN_ALPHABET, GSTIN_STATE_CODES, PAN_ENTITY_TYPES, gstin_check_character
 
 logger = logging.getLogger(__name__)
 
+# Days after a query is raised on which reminders go out
+QUERY_REMINDER_DAYS = [3, 7, 14]
+
+# Late fee and interest per task type
+LATE_FEES = {
+    "GST": {
+        "daily_fee": 50,  # ₹50 per day (₹25 CGST + ₹25 SGST)
+        "max_fee": 5000,
+        "interest_rate": 0.18  # 18% per annum
+    },
+    "ITR": {
+        "flat_fee": 5000,
+        "flat_fee_after_year": 10000,
+        "interest_rate": 0.01  # 1% per month
+    },
+    "TDS": {
+        "daily_fee": 200,  # ₹200 per day
+        "interest_rate": 0.015  # 1.5% per month
+    },
+    "ROC": {
+        "daily_fee": 100,  # ₹100 per day
+        "max_fee": 200000
+    },
+    "AUDIT": {
+        "flat_fee": 0,  # No late fee, but ITR filing delayed
+        "interest_rate": 0
+    }
+}
+# Tax liability assumed for interest when a task has none recorded
+ASSUMED_LIABILITY = 10000
+
 class CAWorkflowService:
     """Service for CA-specific workflow management."""
     
@@ -89,9 +122,13 @@ class CAWorkflowService:
         self,
         task_type: str,
         due_date: datetime,
-        current_date: datetime = None
+        current_date: datetime = None,
+        liability: Optional[float] = None
     ) -> Dict[str, Any]:
-        """Calculate late fee for missed compliance deadlines."""
+        """Calculate late fee for missed compliance deadlines.
+        
+        Interest is charged on liability; without one, ASSUMED_LIABILITY is used.
+        """
         
         if not current_date:
             current_date = datetime.now(timezone.utc)
@@ -107,60 +144,40 @@ class CAWorkflowService:
         
         days_overdue = (current_date - due_date).days
         
-        # Late fee calculation based on task type
-        late_fees = {
-            "GST": {
-                "daily_fee": 50,  # ₹50 per day (₹25 CGST + ₹25 SGST)
-                "max_fee": 5000,
-                "interest_rate": 0.18  # 18% per annum
-            },
-            "ITR": {
-                "flat_fee": 5000 if days_overdue <= 365 else 10000,
-                "interest_rate": 0.01  # 1% per month
-            },
-            "TDS": {
-                "daily_fee": 200,  # ₹200 per day
-                "interest_rate": 0.015  # 1.5% per month
-            },
-            "ROC": {
-                "daily_fee": 100,  # ₹100 per day
-                "max_fee": 200000
-            },
-            "AUDIT": {
-                "flat_fee": 0,  # No late fee, but ITR filing delayed
-                "interest_rate": 0
-            }
-        }
-        
-        fee_structure = late_fees.get(task_type, {"daily_fee": 0, "interest_rate": 0})
+        fee_structure = LATE_FEES.get(task_type, {"daily_fee": 0, "interest_rate": 0})
         
-        # Calculate late fee
+        # Calculate late fee, in paise
         if "daily_fee" in fee_structure:
-            late_fee = min(
-                days_overdue * fee_structure["daily_fee"],
-                fee_structure.get("max_fee", float('inf'))
-            )
+            late_fee = to_paise(days_overdue * fee_structure["daily_fee"])
+            if "max_fee" in fee_structure:
+                late_fee = min(late_fee, to_paise(fee_structure["max_fee"]))
         elif "flat_fee" in fee_structure:
-            late_fee = fee_structure["flat_fee"]
+            flat_fee = fee_structure["flat_fee"]
+            if days_overdue > 365:
+                flat_fee = fee_structure.get("flat_fee_after_year", flat_fee)
+            late_fee = to_paise(flat_fee)
         else:
             late_fee = 0
         
-        # Calculate interest (simplified calculation)
+        # Calculate interest (simple interest for the days overdue)
         interest_rate = fee_structure.get("interest_rate", 0)
-        # Assuming average tax liability of ₹10,000 for interest calculation
-        assumed_liability = 10000
-        interest = (assumed_liability * interest_rate * days_overdue) / 365
+        liability_known = liability is not None
+        tax_liability = liability if liability_known else ASSUMED_LIABILITY
+        interest = prorate(
+            to_paise(tax_liability) * rate_to_ppm(interest_rate), days_overdue, 365 * RATE_SCALE
+        )
         
         return {
-            "late_fee": round(late_fee, 2),
-            "interest": round(interest, 2),
-            "total_penalty": round(late_fee + interest, 2),
+            "late_fee": from_paise(late_fee),
+            "interest": from_paise(interest),
+            "total_penalty": from_paise(late_fee + interest),
             "days_overdue": days_overdue,
             "overdue": True,
             "penalty_breakdown": {
                 "late_fee_per_day": fee_structure.get("daily_fee", 0),
                 "interest_rate_pa": interest_rate * 100,
-                "assumed_tax_liability": assumed_liability
+                "tax_liability": tax_liability,
+                "liability_assumed": not liability_known
             }
         }
     
@@ -197,10 +214,7 @@ class CAWorkflowService:
         days_pending = query.get('days_pending', 0)
         reminders_sent = query.get('reminders_sent', 0)
         
-        # Send reminder after 3, 7, 14 days
-        reminder_days = [3, 7, 14]
-        
-        if reminders_sent < len(reminder_days) and days_pending >= reminder_days[reminders_sent]:
+        if reminders_sent < len(QUERY_REMINDER_DAYS) and days_pending >= QUERY_REMINDER_DAYS[reminders_sent]:
             return True
         
         return False
@@ -210,59 +224,66 @@ class CAWorkflowService:
         requirements = self.determine_compliance_requirements(business_type, turnover)
         return requirements.get('applicable_returns', [])
     
-    def validate_gstin(self, gstin: str) -> Dict[str, Any]:
-        """Validate GSTIN format and extract information."""
-        if not gstin or len(gstin) != 15:
+    def validate_gstin(self, gstin: str, pan: Optional[str] = None) -> Dict[str, Any]:
+        """Validate GSTIN format and check digit, and that it embeds the client's PAN if given."""
+        gstin = (gstin or "").strip().upper()
+        if len(gstin) != 15:
             return {"valid": False, "error": "GSTIN must be 15 characters"}
         
         # GSTIN format: 2 digits state code + 10 chars PAN + 1 entity code + Z + 1 checksum
         state_code = gstin[:2]
-        pan = gstin[2:12]
+        embedded_pan = gstin[2:12]
         entity_code = gstin[12]
         
         if not state_code.isdigit():
             return {"valid": False, "error": "Invalid state code"}
         
+        if state_code not in GSTIN_STATE_CODES:
+            return {"valid": False, "error": "Unknown state code"}
+        
+        if not self.validate_pan(embedded_pan)["valid"]:
+            return {"valid": False, "error": "Invalid PAN in GSTIN"}
+        
+        if entity_code not in GSTIN_ALPHABET[1:]:
+            return {"valid": False, "error": "Invalid entity code"}
+        
         if gstin[13] != 'Z':
             return {"valid": False, "error": "13th character must be Z"}
         
-        return {
+        if gstin[14] != gstin_check_character(gstin[:14]):
+            return {"valid": False, "error": "Checksum digit does not match"}
+        
+        result = {
             "valid": True,
             "state_code": state_code,
-            "pan": pan,
+            "pan": embedded_pan,
             "entity_code": entity_code,
             "checksum": gstin[14]
         }
+        if pan:
+            if embedded_pan != pan.strip().upper():
+                return {"valid": False, "error": "PAN in GSTIN does not match client PAN"}
+            result["pan_matches"] = True
+        return result
     
     def validate_pan(self, pan: str) -> Dict[str, Any]:
         """Validate PAN format."""
-        if not pan or len(pan) != 10:
+        pan = (pan or "").strip().upper()
+        if len(pan) != 10:
             return {"valid": False, "error": "PAN must be 10 characters"}
         
         # PAN format: 5 letters + 4 digits + 1 letter
-        if not pan[:5].isalpha() or not pan[5:9].isdigit() or not pan[9].isalpha():
+        if (not pan.isascii() or not pan[:5].isalpha() or not pan[5:9].isdigit()
+                or not pan[9].isalpha()):
             return {"valid": False, "error": "Invalid PAN format"}
         
         # 4th character indicates entity type
-        entity_type_map = {
-            'P': 'Individual',
-            'C': 'Company',
-            'H': 'HUF',
-            'F': 'Firm',
-            'A': 'AOP',
-            'T': 'Trust',
-            'B': 'BOI',
-            'L': 'Local Authority',
-            'J': 'Artificial Juridical Person',
-            'G': 'Government'
-        }
-        
-        entity_type = entity_type_map.get(pan[3], 'Unknown')
+        entity_type = PAN_ENTITY_TYPES.get(pan[3], 'Unknown')
         
         return {
             "valid": True,
             "entity_type": entity_type,
-            "pan": pan.upper()
+            "pan": pan
         }
 
 # Global service instance
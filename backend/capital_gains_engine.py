@@ -0,0 +1,217 @@
+import logging
+import os
+from collections import deque
+from typing import Dict, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from money import to_paise_array, from_paise
+from tax_computation_service import tax_computation_service
+
+logger = logging.getLogger(__name__)
+
+# Broker file headers mapped to the engine's column names
+COLUMN_ALIASES = {
+    "date": "trade_date",
+    "trade date": "trade_date",
+    "isin code": "isin",
+    "type": "side",
+    "buy/sell": "side",
+    "buy_sell": "side",
+    "transaction_type": "side",
+    "qty": "quantity",
+    "rate": "price",
+    "trade_price": "price",
+    "brokerage": "charges"
+}
+REQUIRED_COLUMNS = ["trade_date", "isin", "side", "quantity", "price"]
+# Quantities below this are treated as fully matched
+QUANTITY_EPSILON = 1e-9
+# Unmatched sells listed individually in the result
+MAX_UNMATCHED_SAMPLES = 100
+
+
+def _map_distinct(column: pd.Series, function) -> np.ndarray:
+    """Apply function once per distinct value; trade files repeat a few ISINs and sides."""
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+    return np.array([function(value) for value in uniques])[codes]
+
+
+def _new_totals() -> Dict[str, Any]:
+    return {
+        "short_term_gain": 0,
+        "long_term_gain": 0,
+        "sale_consideration": 0,
+        "cost_of_acquisition": 0,
+        "matched_quantity": 0.0,
+        "sell_trades": 0
+    }
+
+
+class CapitalGainsEngine:
+    """FIFO lot matching over broker trade files, streamed in chunks.
+
+    Only open buy lots are kept in memory (one deque per ISIN), so memory
+    follows open positions rather than file size. Trades are expected in
+    date order, as brokers export them; each chunk is sorted by date.
+    """
+
+    def __init__(self):
+        self.chunk_size = int(os.environ.get('TRADE_CHUNK_SIZE', 50000))
+
+    def _prepare_chunk(self, chunk: pd.DataFrame, default_asset_type: str) -> pd.DataFrame:
+        chunk = chunk.rename(columns=lambda name: COLUMN_ALIASES.get(name.strip().lower(), name.strip().lower()))
+        missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Trade file is missing columns: {', '.join(missing)}")
+
+        try:
+            dates = pd.to_datetime(chunk["trade_date"], format="ISO8601")
+        except ValueError:
+            # Indian contract notes write dates day first
+            dates = pd.to_datetime(chunk["trade_date"], dayfirst=True)
+        prepared = pd.DataFrame({
+            "day": dates.values.astype("datetime64[D]").astype(np.int64),
+            "fy_start": dates.dt.year - (dates.dt.month < 4),
+            "isin": _map_distinct(chunk["isin"], lambda isin: str(isin).strip().upper()),
+            "is_buy": _map_distinct(chunk["side"], lambda side: str(side).strip().upper().startswith("B")),
+            "quantity": chunk["quantity"].astype(float).abs(),
+            "value": to_paise_array(chunk["quantity"].astype(float).abs() * chunk["price"].astype(float)),
+            "charges": to_paise_array(chunk["charges"].fillna(0).astype(float))
+            if "charges" in chunk.columns else 0,
+            "asset_type": chunk["asset_type"].fillna(default_asset_type).astype(str)
+            if "asset_type" in chunk.columns else default_asset_type
+        })
+        return prepared.sort_values("day", kind="stable")
+
+    def process(
+        self,
+        source,
+        default_asset_type: str = "equity",
+        chunk_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Match sells to buys FIFO per ISIN and total STCG/LTCG per financial year.
+
+        source is a CSV path or file object with trade_date, isin, side,
+        quantity and price columns (charges and asset_type optional). Buy
+        charges add to cost; sell charges reduce the sale consideration.
+        """
+        try:
+            lots: Dict[str, deque] = {}
+            totals: Dict[int, Dict[str, Any]] = {}
+            unmatched = []
+            unmatched_count = 0
+            rows = 0
+            open_lots = 0
+            peak_open_lots = 0
+            last_day = None
+            out_of_order_chunks = 0
+
+            for chunk in pd.read_csv(source, chunksize=chunk_size or self.chunk_size):
+                prepared = self._prepare_chunk(chunk, default_asset_type)
+                if last_day is not None and len(prepared) and prepared["day"].iloc[0] < last_day:
+                    out_of_order_chunks += 1
+                rows += len(prepared)
+
+                for day, fy_start, isin, is_buy, quantity, value, charges, asset_type in zip(
+                    prepared["day"].tolist(), prepared["fy_start"].tolist(), prepared["isin"].tolist(),
+                    prepared["is_buy"].tolist(), prepared["quantity"].tolist(), prepared["value"].tolist(),
+                    prepared["charges"].tolist(), prepared["asset_type"].tolist()
+                ):
+                    if quantity <= QUANTITY_EPSILON:
+                        continue
+                    if is_buy:
+                        # Lot: [trade day, open quantity, remaining cost in paise]
+                        lots.setdefault(isin, deque()).append([day, quantity, value + charges])
+                        open_lots += 1
+                        peak_open_lots = max(peak_open_lots, open_lots)
+                        continue
+
+                    bucket = totals.get(fy_start)
+                    if bucket is None:
+                        bucket = totals[fy_start] = _new_totals()
+                    bucket["sell_trades"] += 1
+
+                    proceeds = value - charges
+                    remaining = quantity
+                    queue = lots.get(isin)
+                    while remaining > QUANTITY_EPSILON and queue:
+                        lot = queue[0]
+                        taken = min(remaining, lot[1])
+                        if lot[1] - taken <= QUANTITY_EPSILON:
+                            cost = lot[2]
+                            queue.popleft()
+                            open_lots -= 1
+                        else:
+                            cost = round(lot[2] * taken / lot[1])
+                            lot[1] -= taken
+                            lot[2] -= cost
+                        # The last matched piece takes whatever consideration is left, so pieces sum exactly
+                        if remaining - taken <= QUANTITY_EPSILON:
+                            consideration = proceeds
+                        else:
+                            consideration = round(proceeds * taken / remaining)
+                        proceeds -= consideration
+                        remaining -= taken
+
+                        gain = consideration - cost
+                        if tax_computation_service.is_long_term(asset_type, day - lot[0]):
+                            bucket["long_term_gain"] += gain
+                        else:
+                            bucket["short_term_gain"] += gain
+                        bucket["sale_consideration"] += consideration
+                        bucket["cost_of_acquisition"] += cost
+                        bucket["matched_quantity"] += taken
+
+                    if remaining > QUANTITY_EPSILON:
+                        # Sold more than the buys on file, e.g. holdings bought before the file starts
+                        unmatched_count += 1
+                        if len(unmatched) < MAX_UNMATCHED_SAMPLES:
+                            unmatched.append({
+                                "isin": isin,
+                                "trade_date": str(np.datetime64(day, "D")),
+                                "unmatched_quantity": remaining,
+                                "unmatched_consideration": from_paise(proceeds)
+                            })
+                if len(prepared):
+                    last_day = prepared["day"].iloc[-1]
+
+            if out_of_order_chunks:
+                logger.warning(f"Trade file had {out_of_order_chunks} chunks out of date order; FIFO follows file order")
+
+            return {
+                "success": True,
+                "rows_processed": rows,
+                "financial_years": [
+                    {
+                        "financial_year": f"FY{start}-{str(start + 1)[2:]}",
+                        "short_term_capital_gain": from_paise(bucket["short_term_gain"]),
+                        "long_term_capital_gain": from_paise(bucket["long_term_gain"]),
+                        "sale_consideration": from_paise(bucket["sale_consideration"]),
+                        "cost_of_acquisition": from_paise(bucket["cost_of_acquisition"]),
+                        "matched_quantity": bucket["matched_quantity"],
+                        "sell_trades": bucket["sell_trades"]
+                    }
+                    for start, bucket in sorted(totals.items())
+                ],
+                "open_positions": [
+                    {
+                        "isin": isin,
+                        "quantity": sum(lot[1] for lot in queue),
+                        "cost": from_paise(sum(lot[2] for lot in queue)),
+                        "lots": len(queue)
+                    }
+                    for isin, queue in sorted(lots.items()) if queue
+                ],
+                "unmatched_sells": unmatched_count,
+                "unmatched_samples": unmatched,
+                "peak_open_lots": peak_open_lots,
+                "out_of_order_chunks": out_of_order_chunks
+            }
+        except Exception as e:
+            logger.error(f"Error computing capital gains from trades: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+# Global capital gains engine
+capital_gains_engine = CapitalGainsEngine()
@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from calendar import month_abbr
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from ca_workflow_models import BusinessType
+from ca_workflow_service import ca_workflow_service
+from advance_tax_service import INSTALMENTS
+from tax_rule_registry import fy_start_year, fy_code, fy_code_start_year
+
+logger = logging.getLogger(__name__)
+
+# Bump when the due date rules below change, so every calendar is rebuilt
+CALENDAR_VERSION = 2
+# Clients read per batch during a full refresh
+CALENDAR_CHUNK_SIZE = 1000
+# Return types due whenever their requires_* flag is set, whether or not the matrix lists them
+FLAG_ONLY_RETURNS = {"AUDIT", "ROC"}
+# Annual GST return is mandatory above this turnover
+GSTR9_TURNOVER = 20000000
+PROFILE_FIELDS = ["business_type", "turnover", "gstin", "pan", "tan", "cin"]
+RETURN_TYPES = ["ITR", "GST", "TDS", "AUDIT", "ROC"]
+OVERRIDE_KINDS = ["extension", "holiday"]
+
+
+def _next_month(year: int, month: int) -> Tuple[int, int]:
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _monthly(start_year: int, day: int, march_due: Optional[Tuple[int, int]] = None):
+    """(period, label, due) for each month of the year, due on a day of the following month."""
+    for offset in range(12):
+        year, month = start_year + (offset + 3) // 12, (offset + 3) % 12 + 1
+        due_year, due_month = _next_month(year, month)
+        due = date(due_year, due_month, day)
+        if month == 3 and march_due:
+            due = date(due_year, *march_due)
+        yield f"{year}-{month:02d}", f"{month_abbr[month]} {year}", due
+
+
+def _tds_returns(start_year: int):
+    dues = [date(start_year, 7, 31), date(start_year, 10, 31), date(start_year + 1, 1, 31), date(start_year + 1, 5, 31)]
+    for quarter, due in enumerate(dues, start=1):
+        yield f"Q{quarter}", f"Q{quarter} {fy_code(start_year)}", due
+
+
+def _advance_tax(start_year: int):
+    for number, (month, day, _, _) in enumerate(INSTALMENTS, start=1):
+        yield f"I{number}", f"Instalment {number} {fy_code(start_year)}", date(start_year + (month < 4), month, day)
+
+
+def _annual(month: int, day: int, years_after: int = 1):
+    def dues(start_year: int):
+        yield "FY", fy_code(start_year), date(start_year + years_after, month, day)
+    return dues
+
+
+# Return type -> forms filed for it, each with its due date rule
+FORMS = {
+    "GST": [
+        ("GSTR-1", lambda y: _monthly(y, 11)),
+        ("GSTR-3B", lambda y: _monthly(y, 20)),
+        ("GSTR-9", _annual(12, 31)),
+    ],
+    "TDS": [
+        ("TDS Payment", lambda y: _monthly(y, 7, march_due=(4, 30))),
+        ("TDS Return", _tds_returns),
+    ],
+    "ITR": [
+        ("ITR", _annual(7, 31)),
+        ("Advance Tax", _advance_tax),
+    ],
+    "AUDIT": [
+        ("Tax Audit Report", _annual(9, 30)),
+    ],
+    "ROC": [
+        ("AOC-4", _annual(10, 30)),
+        ("MGT-7", _annual(11, 29)),
+    ],
+}
+LLP_ROC_FORMS = [("LLP Form 11", _annual(5, 30)), ("LLP Form 8", _annual(10, 30))]
+
+
+class ComplianceCalendarService:
+    """Dated statutory obligations for every client and financial year.
+
+    A client's applicable returns come from determine_compliance_requirements
+    and its registrations; each is expanded into the concrete due dates of
+    the year, then moved by any extension or holiday override, and stored in
+    compliance_calendar. Each client-year is fingerprinted from the profile,
+    the rules and only the overrides that can move its dates, so a refresh
+    rebuilds only the client-years whose inputs changed, and "what is due
+    between two dates" is a range scan on the due_date index.
+    """
+
+    def __init__(self):
+        # Refreshes delete and re-insert obligations, so they run one at a time
+        self._refresh_lock = asyncio.Lock()
+
+    async def ensure_indexes(self, db):
+        """Create indexes for due date range and per-client lookups."""
+        await db.compliance_calendar.create_index([("due_date", 1), ("client_id", 1)])
+        await db.compliance_calendar.create_index([("client_id", 1), ("financial_year", 1)])
+        await db.compliance_calendar_state.create_index([("client_id", 1), ("financial_year", 1)], unique=True)
+        await db.compliance_calendar_overrides.create_index("kind")
+
+    def applicable_returns(self, client: Dict[str, Any]) -> List[str]:
+        """Return types a client files, from its business type, turnover and registrations."""
+        registered = {"ITR": client.get("pan"), "GST": client.get("gstin"), "TDS": client.get("tan")}
+        try:
+            business_type = BusinessType(client.get("business_type"))
+        except ValueError:
+            # Without a business type only the registrations tell
+            return [return_type for return_type, number in registered.items() if number]
+
+        requirements = ca_workflow_service.determine_compliance_requirements(business_type, client.get("turnover"))
+        required = {
+            "ITR": True,
+            "GST": requirements["requires_gst"] is True or bool(registered["GST"]),
+            "TDS": requirements["requires_tds"] is True or bool(registered["TDS"]),
+            "AUDIT": requirements["requires_audit"] is True,
+            "ROC": requirements["requires_roc_filing"] is True,
+        }
+        # A registration means returns are due even where the matrix does not list them
+        return [
+            return_type for return_type in RETURN_TYPES
+            if required[return_type] and (
+                return_type in FLAG_ONLY_RETURNS
+                or return_type in requirements["applicable_returns"]
+                or registered.get(return_type)
+            )
+        ]
+
+    def _forms(self, client: Dict[str, Any], return_type: str):
+        forms = FORMS[return_type]
+        if return_type == "ROC" and client.get("business_type") == BusinessType.LLP.value:
+            return LLP_ROC_FORMS
+        if return_type == "GST" and (client.get("turnover") or 0) and client["turnover"] <= GSTR9_TURNOVER:
+            return [form for form in forms if form[0] != "GSTR-9"]
+        return forms
+
+    def _apply_overrides(self, obligation: Dict[str, Any], client: Dict[str, Any], overrides: Dict[str, Any]) -> None:
+        state_code = (client.get("gstin") or "")[:2]
+        for extension in overrides["extensions"].get((obligation["form"], obligation["period"]), []):
+            # State-specific extensions only apply to clients registered there
+            if extension.get("state_codes") and state_code not in extension["state_codes"]:
+                continue
+            obligation["due_date"] = extension["due_date"]
+            obligation["override"] = extension.get("reason") or "Extended"
+        due = date.fromisoformat(obligation["due_date"])
+        while due.isoformat() in overrides["holidays"]:
+            due += timedelta(days=1)
+        if due.isoformat() != obligation["due_date"]:
+            obligation["due_date"] = due.isoformat()
+            obligation["override"] = obligation["override"] or "Holiday"
+
+    def expand(
+        self,
+        client: Dict[str, Any],
+        financial_year: str,
+        overrides: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """Obligations of a client for a financial year, with overrides applied."""
+        overrides = overrides or {"extensions": {}, "holidays": set()}
+        start_year = fy_code_start_year(financial_year)
+        returns = self.applicable_returns(client)
+        audited = "AUDIT" in returns
+
+        obligations = []
+        for return_type in returns:
+            for form, dues in self._forms(client, return_type):
+                for period, label, due in dues(start_year):
+                    if form == "ITR" and audited:
+                        due = date(start_year + 1, 10, 31)
+                    obligation = {
+                        "id": f"{client['id']}:{form}:{financial_year}:{period}",
+                        "client_id": client["id"],
+                        "client_name": client.get("name"),
+                        "financial_year": financial_year,
+                        "return_type": return_type,
+                        "form": form,
+                        "period": period,
+                        "title": f"{form} - {label}",
+                        "statutory_due_date": due.isoformat(),
+                        "due_date": due.isoformat(),
+                        "override": None
+                    }
+                    self._apply_overrides(obligation, client, overrides)
+                    obligations.append(obligation)
+        return obligations
+
+    def relevant_overrides(self, client: Dict[str, Any], financial_year: str, overrides: Dict[str, Any]) -> List[str]:
+        """Ids of the extensions and dates of the holidays that can move a client's dates in a year."""
+        start_year = fy_code_start_year(financial_year)
+        state_code = (client.get("gstin") or "")[:2]
+        relevant = []
+        due_dates = []
+        for return_type in self.applicable_returns(client):
+            for form, dues in self._forms(client, return_type):
+                for period, _, due in dues(start_year):
+                    due_dates.append(due.isoformat())
+                    for extension in overrides["extensions"].get((form, period), []):
+                        if not extension.get("state_codes") or state_code in extension["state_codes"]:
+                            relevant.append(extension["id"])
+                            due_dates.append(extension["due_date"])
+        if due_dates and overrides["holidays"]:
+            # Consecutive holidays can push a date past the last due date by at most their count
+            last = date.fromisoformat(max(due_dates)) + timedelta(days=len(overrides["holidays"]))
+            first = min(due_dates)
+            relevant += sorted(day for day in overrides["holidays"] if first <= day <= last.isoformat())
+        return relevant
+
+    def fingerprint(self, client: Dict[str, Any], financial_year: str, overrides: Dict[str, Any]) -> str:
+        """Hash of everything a client's calendar for a year is derived from."""
+        payload = json.dumps({
+            "profile": {field: client.get(field) for field in PROFILE_FIELDS},
+            "name": client.get("name"),
+            "version": CALENDAR_VERSION,
+            "overrides": self.relevant_overrides(client, financial_year, overrides)
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def load_overrides(self, db) -> Dict[str, Any]:
+        """Extensions keyed by (form, period) and holiday dates."""
+        docs = await db.compliance_calendar_overrides.find({}, {"_id": 0}).sort("id", 1).to_list(None)
+        overrides = {"extensions": {}, "holidays": set()}
+        for doc in docs:
+            if doc["kind"] == "holiday":
+                overrides["holidays"].add(doc["holiday_date"])
+            else:
+                overrides["extensions"].setdefault((doc["form"], doc["period"]), []).append(doc)
+        return overrides
+
+    def default_years(self, today: Optional[date] = None) -> List[str]:
+        # Last year's annual returns fall due during this one
+        start_year = fy_start_year(today or datetime.now(timezone.utc).date())
+        return [fy_code(start_year - 1), fy_code(start_year)]
+
+    async def _with_tan(self, db, clients: List[Dict[str, Any]]) -> None:
+        # TAN may still live only in client_metadata
+        missing = [client["id"] for client in clients if not client.get("tan")]
+        if not missing:
+            return
+        metadata = await db.client_metadata.find(
+            {"client_id": {"$in": missing}, "tan": {"$nin": [None, ""]}}, {"_id": 0, "client_id": 1, "tan": 1}
+        ).to_list(None)
+        tans = {meta["client_id"]: meta["tan"] for meta in metadata}
+        for client in clients:
+            if not client.get("tan") and client["id"] in tans:
+                client["tan"] = tans[client["id"]]
+
+    async def _rebuild(self, db, clients, financial_years, overrides, force) -> int:
+        """Rebuild the calendars of clients whose fingerprint changed; returns how many were rebuilt."""
+        await self._with_tan(db, clients)
+        rebuilt = 0
+        for financial_year in financial_years:
+            fingerprints = {
+                client["id"]: self.fingerprint(client, financial_year, overrides) for client in clients
+            }
+            states = await db.compliance_calendar_state.find(
+                {"client_id": {"$in": list(fingerprints)}, "financial_year": financial_year},
+                {"_id": 0, "client_id": 1, "fingerprint": 1}
+            ).to_list(None)
+            current = {state["client_id"]: state["fingerprint"] for state in states}
+            changed = [client for client in clients if force or current.get(client["id"]) != fingerprints[client["id"]]]
+            if not changed:
+                continue
+
+            changed_ids = [client["id"] for client in changed]
+            obligations = [
+                {**obligation, "fingerprint": fingerprints[client["id"]]}
+                for client in changed for obligation in self.expand(client, financial_year, overrides)
+            ]
+            await db.compliance_calendar.delete_many({"client_id": {"$in": changed_ids}, "financial_year": financial_year})
+            if obligations:
+                await db.compliance_calendar.insert_many(obligations, ordered=False)
+            built_at = datetime.now(timezone.utc).isoformat()
+            await db.compliance_calendar_state.bulk_write([
+                UpdateOne(
+                    {"client_id": client_id, "financial_year": financial_year},
+                    {"$set": {"fingerprint": fingerprints[client_id], "built_at": built_at}},
+                    upsert=True
+                )
+                for client_id in changed_ids
+            ], ordered=False)
+            rebuilt += len(changed)
+        return rebuilt
+
+    async def refresh_all(
+        self,
+        db,
+        financial_years: Optional[List[str]] = None,
+        force: bool = False
+    ) -> Dict[str, Any]:
+        """Bring every client's calendar up to date, rebuilding only what changed."""
+        try:
+            async with self._refresh_lock:
+                financial_years = financial_years or self.default_years()
+                overrides = await self.load_overrides(db)
+                clients_seen = 0
+                rebuilt = 0
+
+                cursor = db.clients.find({}, {"_id": 0, "id": 1, "name": 1, **{field: 1 for field in PROFILE_FIELDS}})
+                chunk = []
+                async for client in cursor.batch_size(CALENDAR_CHUNK_SIZE):
+                    chunk.append(client)
+                    if len(chunk) >= CALENDAR_CHUNK_SIZE:
+                        rebuilt += await self._rebuild(db, chunk, financial_years, overrides, force)
+                        clients_seen += len(chunk)
+                        chunk = []
+                if chunk:
+                    rebuilt += await self._rebuild(db, chunk, financial_years, overrides, force)
+                    clients_seen += len(chunk)
+
+            logger.info(f"Compliance calendar refreshed: {rebuilt} client-years rebuilt for {clients_seen} clients")
+            return {
+                "success": True,
+                "clients": clients_seen,
+                "financial_years": financial_years,
+                "rebuilt": rebuilt
+            }
+        except Exception as e:
+            logger.error(f"Error refreshing compliance calendar: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def refresh_client(self, db, client_id: str, financial_years: Optional[List[str]] = None):
+        """Rebuild one client's calendar if its profile changed."""
+        try:
+            client = await db.clients.find_one({"id": client_id}, {"_id": 0})
+            if not client:
+                await self.remove_client(db, client_id)
+                return
+            overrides = await self.load_overrides(db)
+            async with self._refresh_lock:
+                await self._rebuild(db, [client], financial_years or self.default_years(), overrides, False)
+        except Exception as e:
+            logger.error(f"Error refreshing compliance calendar for client {client_id}: {str(e)}")
+
+    async def remove_client(self, db, client_id: str):
+        await db.compliance_calendar.delete_many({"client_id": client_id})
+        await db.compliance_calendar_state.delete_many({"client_id": client_id})
+
+    async def due_between(
+        self,
+        db,
+        start: date,
+        end: date,
+        client_id: Optional[str] = None,
+        return_type: Optional[str] = None,
+        limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """Obligations falling due from start to end, inclusive, earliest first."""
+        query = {"due_date": {"$gte": start.isoformat(), "$lte": end.isoformat()}}
+        if client_id:
+            query["client_id"] = client_id
+        if return_type:
+            query["return_type"] = return_type
+        return await db.compliance_calendar.find(
+            query, {"_id": 0, "fingerprint": 0}
+        ).sort([("due_date", 1), ("client_id", 1)]).to_list(limit)
+
+    async def client_calendar(self, db, client_id: str, financial_year: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A client's obligations, for one financial year or the default ones."""
+        years = [financial_year] if financial_year else self.default_years()
+        return await db.compliance_calendar.find(
+            {"client_id": client_id, "financial_year": {"$in": years}}, {"_id": 0, "fingerprint": 0}
+        ).sort("due_date", 1).to_list(None)
+
+    async def add_override(self, db, override: Dict[str, Any]) -> Dict[str, Any]:
+        """Store an extension or holiday; refresh_all then rebuilds the calendars it moves."""
+        if override["kind"] not in OVERRIDE_KINDS:
+            raise ValueError(f"Override kind must be one of {', '.join(OVERRIDE_KINDS)}")
+        if override["kind"] == "holiday":
+            if not override.get("holiday_date"):
+                raise ValueError("A holiday needs holiday_date")
+        elif not (override.get("form") and override.get("period") and override.get("due_date")):
+            raise ValueError("An extension needs form, period and due_date")
+        doc = {"id": str(uuid.uuid4()), **override, "created_at": datetime.now(timezone.utc).isoformat()}
+        await db.compliance_calendar_overrides.insert_one(doc)
+        doc.pop("_id", None)
+        return doc
+
+    async def list_overrides(self, db) -> List[Dict[str, Any]]:
+        return await db.compliance_calendar_overrides.find({}, {"_id": 0}).sort("created_at", -1).to_list(None)
+
+    async def delete_override(self, db, override_id: str) -> bool:
+        """Remove an override; refresh_all then restores the dates it moved."""
+        result = await db.compliance_calendar_overrides.delete_one({"id": override_id})
+        return result.deleted_count > 0
+
+# Global compliance calendar service
+compliance_calendar_service = ComplianceCalendarService()
@@ -0,0 +1,279 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from pymongo import UpdateOne
+
+from money import to_paise, from_paise, apply_rate_array
+from tax_rule_registry import tax_rule_registry, fy_start_year, fy_code, fy_code_start_year
+
+logger = logging.getLogger(__name__)
+
+# Assets put to use for less than this many days in a year get half the rate
+HALF_RATE_DAYS = 180
+# Rate for asset types missing from the rule set, as in calculate_depreciation
+DEFAULT_RATE = 0.15
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+class DepreciationLedgerService:
+    """Block-of-assets WDV ledger projected over many years, cached per client and FY.
+
+    Assets of the same type form one block. Each year, additions used for
+    fewer than 180 days get half the block rate, sale proceeds reduce the
+    block, and a negative block (or a block left with no assets) gives a
+    short-term capital gain (or loss) under section 50.
+    """
+
+    async def ensure_indexes(self, db):
+        """Create indexes used by asset and ledger lookups."""
+        await db.fixed_assets.create_index("id", unique=True)
+        await db.fixed_assets.create_index("client_id")
+        await db.depreciation_ledgers.create_index(
+            [("client_id", 1), ("financial_year", 1)], unique=True
+        )
+
+    # Asset register
+    async def list_assets(self, db, client_id: str) -> List[Dict[str, Any]]:
+        return await db.fixed_assets.find({"client_id": client_id}, {"_id": 0}).to_list(None)
+
+    async def create_asset(self, db, client_id: str, asset: Dict[str, Any]) -> Dict[str, Any]:
+        record = self._asset_record(asset)
+        record.update({
+            "id": str(uuid.uuid4()),
+            "client_id": client_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        await db.fixed_assets.insert_one(record.copy())
+        await self._invalidate(db, client_id, self._first_affected_year(record))
+        return record
+
+    async def update_asset(self, db, client_id: str, asset_id: str, asset: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        previous = await db.fixed_assets.find_one({"id": asset_id, "client_id": client_id}, {"_id": 0})
+        if not previous:
+            return None
+        record = self._asset_record(asset)
+        await db.fixed_assets.update_one({"id": asset_id}, {"$set": record})
+        # Years before both the old and the new dates are unaffected
+        first_year = min(self._first_affected_year(previous), self._first_affected_year(record))
+        await self._invalidate(db, client_id, first_year)
+        return {**previous, **record}
+
+    async def delete_asset(self, db, client_id: str, asset_id: str) -> bool:
+        previous = await db.fixed_assets.find_one_and_delete({"id": asset_id, "client_id": client_id})
+        if not previous:
+            return False
+        await self._invalidate(db, client_id, self._first_affected_year(previous))
+        return True
+
+    def _asset_record(self, asset: Dict[str, Any]) -> Dict[str, Any]:
+        record = {
+            "name": asset["name"],
+            "asset_type": asset["asset_type"],
+            "cost": asset["cost"],
+            "cost_paise": to_paise(asset["cost"]),
+            "put_to_use_date": _as_datetime(asset["put_to_use_date"]).isoformat(),
+            "is_opening_balance": asset.get("is_opening_balance", False),
+            "sale_date": None,
+            "sale_value": asset.get("sale_value"),
+            "sale_value_paise": None
+        }
+        if asset.get("sale_date"):
+            record["sale_date"] = _as_datetime(asset["sale_date"]).isoformat()
+            record["sale_value_paise"] = to_paise(asset.get("sale_value") or 0)
+        return record
+
+    def _first_affected_year(self, asset: Dict[str, Any]) -> int:
+        years = [fy_start_year(_as_datetime(asset["put_to_use_date"]))]
+        if asset.get("sale_date"):
+            years.append(fy_start_year(_as_datetime(asset["sale_date"])))
+        return min(years)
+
+    async def _invalidate(self, db, client_id: str, first_year: int):
+        """Drop cached ledger years from first_year onwards."""
+        await db.depreciation_ledgers.delete_many({
+            "client_id": client_id,
+            "financial_year": {"$gte": fy_code(first_year)}
+        })
+
+    # Ledger
+    def _rates(self, start_year: int, asset_types: List[str]) -> np.ndarray:
+        """Block rates for a year, from its rule set or the nearest earlier one."""
+        years = tax_rule_registry.financial_years()
+        earlier = [year for year in years if fy_code_start_year(year) <= start_year]
+        rules = tax_rule_registry.get(earlier[-1] if earlier else years[0])
+        return np.array([rules.depreciation_rates.get(asset_type, DEFAULT_RATE) for asset_type in asset_types])
+
+    def project(
+        self,
+        assets: List[Dict[str, Any]],
+        first_year: int,
+        last_year: int,
+        opening: Optional[Dict[str, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """Roll every block forward from first_year to last_year (FY start years).
+
+        opening gives each block's WDV in paise at the start of first_year;
+        without it, every block starts at zero.
+        """
+        opening = opening or {}
+        asset_types = sorted({asset["asset_type"] for asset in assets} | set(opening))
+        block_index = {asset_type: index for index, asset_type in enumerate(asset_types)}
+        years = last_year - first_year + 1
+        shape = (len(asset_types), years)
+
+        opening_balances = np.zeros(shape, dtype=np.int64)
+        additions_full = np.zeros(shape, dtype=np.int64)
+        additions_half = np.zeros(shape, dtype=np.int64)
+        sales = np.zeros(shape, dtype=np.int64)
+        assets_added = np.zeros(shape, dtype=np.int64)
+        assets_sold = np.zeros(shape, dtype=np.int64)
+        # Assets already in the block before first_year and not yet sold
+        assets_held = np.zeros(len(asset_types), dtype=np.int64)
+
+        if assets:
+            blocks = np.array([block_index[asset["asset_type"]] for asset in assets])
+            put_to_use = [_as_datetime(asset["put_to_use_date"]) for asset in assets]
+            added_year = np.array([fy_start_year(date) for date in put_to_use])
+            cost = np.array([asset["cost_paise"] for asset in assets], dtype=np.int64)
+            is_opening = np.array([asset.get("is_opening_balance", False) for asset in assets])
+            days_used = np.array([
+                (datetime(fy_start_year(date) + 1, 3, 31).date() - date.date()).days + 1
+                for date in put_to_use
+            ])
+            sold = np.array([bool(asset.get("sale_date")) for asset in assets])
+            sale_year = np.array([
+                fy_start_year(_as_datetime(asset["sale_date"])) if asset.get("sale_date") else last_year + 1
+                for asset in assets
+            ])
+            sale_value = np.array([asset.get("sale_value_paise") or 0 for asset in assets], dtype=np.int64)
+
+            # Balances already reflected in `opening` are not added again
+            in_range = (added_year >= first_year) & (added_year <= last_year)
+            column = added_year - first_year
+            half = days_used < HALF_RATE_DAYS
+            for target, mask in (
+                (opening_balances, in_range & is_opening),
+                (additions_full, in_range & ~is_opening & ~half),
+                (additions_half, in_range & ~is_opening & half)
+            ):
+                np.add.at(target, (blocks[mask], column[mask]), cost[mask])
+            np.add.at(assets_added, (blocks[in_range], column[in_range]), 1)
+
+            sold_in_range = sold & (sale_year >= first_year) & (sale_year <= last_year)
+            sale_column = sale_year - first_year
+            np.add.at(sales, (blocks[sold_in_range], sale_column[sold_in_range]), sale_value[sold_in_range])
+            np.add.at(assets_sold, (blocks[sold_in_range], sale_column[sold_in_range]), 1)
+
+            held_before = (added_year < first_year) & (sale_year >= first_year)
+            np.add.at(assets_held, blocks[held_before], 1)
+
+        assets_remaining = assets_held[:, None] + np.cumsum(assets_added - assets_sold, axis=1)
+        wdv = np.array([opening.get(asset_type, 0) for asset_type in asset_types], dtype=np.int64)
+
+        ledger = []
+        for offset in range(years):
+            start_year = first_year + offset
+            rates = self._rates(start_year, asset_types)
+            opening_wdv = wdv + opening_balances[:, offset]
+
+            block_value = opening_wdv + additions_full[:, offset] + additions_half[:, offset] - sales[:, offset]
+            # Sale proceeds beyond the block are a short-term capital gain (section 50)
+            stcg = np.maximum(-block_value, 0)
+            block_value = np.maximum(block_value, 0)
+            # A block with no assets left ends; its remaining value is a short-term capital loss
+            ceased = assets_remaining[:, offset] <= 0
+            stcl = np.where(ceased, block_value, 0)
+            depreciable = np.where(ceased, 0, block_value)
+
+            # Sales are taken against the full-rate part first
+            half_part = np.minimum(additions_half[:, offset], depreciable)
+            full_part = depreciable - half_part
+            depreciation = apply_rate_array(full_part, rates) + apply_rate_array(half_part, rates / 2)
+            wdv = depreciable - depreciation
+
+            ledger.append({
+                "financial_year": fy_code(start_year),
+                "blocks": [
+                    {
+                        "asset_type": asset_type,
+                        "rate": float(rates[index]) * 100,
+                        "opening_wdv": from_paise(int(opening_wdv[index])),
+                        "additions_full_rate": from_paise(int(additions_full[index, offset])),
+                        "additions_half_rate": from_paise(int(additions_half[index, offset])),
+                        "sales": from_paise(int(sales[index, offset])),
+                        "depreciation": from_paise(int(depreciation[index])),
+                        "closing_wdv": from_paise(int(wdv[index])),
+                        "closing_wdv_paise": int(wdv[index]),
+                        "short_term_capital_gain": from_paise(int(stcg[index])),
+                        "short_term_capital_loss": from_paise(int(stcl[index])),
+                        "assets_in_block": int(assets_remaining[index, offset])
+                    }
+                    for index, asset_type in enumerate(asset_types)
+                ],
+                "total_depreciation": from_paise(int(depreciation.sum()))
+            })
+        return ledger
+
+    async def get_ledger(self, db, client_id: str, to_year: Optional[int] = None) -> Dict[str, Any]:
+        """Ledger from the client's first asset year to to_year, recomputing only uncached years."""
+        try:
+            assets = await self.list_assets(db, client_id)
+            if not assets:
+                return {"success": True, "client_id": client_id, "years": []}
+
+            first_year = min(self._first_affected_year(asset) for asset in assets)
+            if to_year is None:
+                to_year = fy_start_year(datetime.now(timezone.utc))
+
+            cached = await db.depreciation_ledgers.find(
+                {"client_id": client_id, "financial_year": {"$gte": fy_code(first_year), "$lte": fy_code(to_year)}},
+                {"_id": 0}
+            ).sort("financial_year", 1).to_list(None)
+
+            # Keep the cached years that run unbroken from the first year
+            years = []
+            for entry in cached:
+                if entry["financial_year"] != fy_code(first_year + len(years)):
+                    break
+                years.append(entry)
+
+            resume_year = first_year + len(years)
+            if resume_year <= to_year:
+                opening = {}
+                if years:
+                    opening = {block["asset_type"]: block["closing_wdv_paise"] for block in years[-1]["blocks"]}
+                computed = self.project(assets, resume_year, to_year, opening)
+                now = datetime.now(timezone.utc).isoformat()
+                await db.depreciation_ledgers.bulk_write([
+                    UpdateOne(
+                        {"client_id": client_id, "financial_year": entry["financial_year"]},
+                        {"$set": {**entry, "client_id": client_id, "computed_at": now}},
+                        upsert=True
+                    )
+                    for entry in computed
+                ], ordered=False)
+                years.extend(computed)
+                logger.info(f"Depreciation ledger for {client_id}: recomputed {len(computed)} of {len(years)} years")
+
+            return {
+                "success": True,
+                "client_id": client_id,
+                "years": [
+                    {key: value for key, value in entry.items() if key not in ("client_id", "computed_at")}
+                    for entry in years
+                ]
+            }
+        except Exception as e:
+            logger.error(f"Error building depreciation ledger: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+# Global depreciation ledger service
+depreciation_ledger_service = DepreciationLedgerService()
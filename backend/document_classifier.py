@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import re
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from document_text_service import document_text_service
+
+logger = logging.getLogger(__name__)
+
+# Hashed unigram + bigram feature space
+FEATURE_BITS = 18
+N_FEATURES = 1 << FEATURE_BITS
+# Tokens read per document; the first pages carry the discriminating headings
+MAX_TOKENS = 5000
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Additive smoothing of the Naive Bayes feature likelihoods
+ALPHA = 0.1
+# Below this probability a prediction is reported as "General"
+MIN_CONFIDENCE = 0.6
+# Fewest labelled documents needed per category to train
+MIN_SAMPLES_PER_CLASS = 3
+
+
+def hash_features(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Hashed unigram/bigram term counts of a text as (indices, counts)."""
+    tokens = TOKEN_PATTERN.findall(text.lower())[:MAX_TOKENS]
+    grams = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    hashes = np.fromiter(
+        (zlib.crc32(gram.encode()) for gram in grams), dtype=np.int64, count=len(grams)
+    ) & (N_FEATURES - 1)
+    indices, counts = np.unique(hashes, return_counts=True)
+    return indices, counts.astype(np.float64)
+
+
+class DocumentClassifier:
+    """Multinomial Naive Bayes over TF-IDF weighted hashed n-grams of document text."""
+
+    def __init__(self):
+        self.model_path = Path(os.environ.get(
+            'DOCUMENT_CLASSIFIER_PATH', '/app/backend/models/document_classifier.npz'
+        ))
+        self._model: Optional[Dict[str, Any]] = None
+        self._model_mtime: Optional[float] = None
+
+    def _get_model(self) -> Optional[Dict[str, Any]]:
+        """Load the model on first use and reload it when the file changes."""
+        try:
+            mtime = self.model_path.stat().st_mtime
+        except FileNotFoundError:
+            return self._model
+        if self._model is None or mtime != self._model_mtime:
+            with np.load(self.model_path, allow_pickle=False) as data:
+                self._model = {
+                    "classes": [str(label) for label in data["classes"]],
+                    "idf": data["idf"],
+                    "log_likelihood": data["log_likelihood"],
+                    "log_prior": data["log_prior"]
+                }
+            self._model_mtime = mtime
+            logger.info(f"Document classifier loaded from {self.model_path}")
+        return self._model
+
+    @property
+    def available(self) -> bool:
+        return self._get_model() is not None
+
+    def _weighted_batch(self, texts: List[str], idf: np.ndarray):
+        """Flatten a batch into (doc_ids, feature indices, L2-normalized TF-IDF weights)."""
+        doc_ids, indices, weights = [], [], []
+        for doc_id, text in enumerate(texts):
+            idx, counts = hash_features(text)
+            if not len(idx):
+                continue
+            weight = (1 + np.log(counts)) * idf[idx]
+            weight /= np.linalg.norm(weight)
+            doc_ids.append(np.full(len(idx), doc_id, dtype=np.int64))
+            indices.append(idx)
+            weights.append(weight)
+        if not indices:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float64)
+        return np.concatenate(doc_ids), np.concatenate(indices), np.concatenate(weights)
+
+    def train(self, texts: List[str], labels: List[str]) -> Dict[str, Any]:
+        """Fit the model and write it to disk."""
+        classes = sorted(set(labels))
+        if len(classes) < 2:
+            raise ValueError("Need documents from at least two categories to train")
+
+        features = [hash_features(text) for text in texts]
+        document_frequency = np.zeros(N_FEATURES, dtype=np.float64)
+        for idx, _ in features:
+            document_frequency[idx] += 1
+        idf = np.log((1 + len(texts)) / (1 + document_frequency)) + 1
+
+        label_ids = np.array([classes.index(label) for label in labels], dtype=np.int64)
+        doc_ids, indices, weights = self._weighted_batch(texts, idf)
+        feature_totals = np.zeros((len(classes), N_FEATURES), dtype=np.float64)
+        np.add.at(feature_totals, (label_ids[doc_ids], indices), weights)
+
+        smoothed = feature_totals + ALPHA
+        log_likelihood = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        log_prior = np.log(np.bincount(label_ids, minlength=len(classes)) / len(labels))
+
+        self.model_path.parent.mkdir(parents=True, exist_ok=True)
+        # np.savez appends .npz to names without it, so write through a file handle
+        temp_path = self.model_path.with_name(self.model_path.name + ".tmp")
+        with open(temp_path, "wb") as handle:
+            np.savez_compressed(
+                handle,
+                classes=np.array(classes),
+                idf=idf.astype(np.float32),
+                # Stored feature-major so inference gathers contiguous rows
+                log_likelihood=np.ascontiguousarray(log_likelihood.T, dtype=np.float32),
+                log_prior=log_prior
+            )
+        os.replace(temp_path, self.model_path)
+        self._model = None
+
+        logger.info(f"Document classifier trained on {len(texts)} documents, {len(classes)} categories")
+        return {
+            "classes": classes,
+            "samples": len(texts),
+            "samples_per_class": {label: labels.count(label) for label in classes},
+            "trained_at": datetime.now(timezone.utc).isoformat()
+        }
+
+    def predict(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """Classify a batch of texts in one vectorized pass. Returns (category, probability)."""
+        model = self._get_model()
+        if model is None:
+            return [("General", 0.0)] * len(texts)
+
+        doc_ids, indices, weights = self._weighted_batch(texts, model["idf"])
+        contributions = model["log_likelihood"][indices] * weights[:, None]
+        scores = np.tile(model["log_prior"], (len(texts), 1))
+        for class_id in range(len(model["classes"])):
+            scores[:, class_id] += np.bincount(
+                doc_ids, weights=contributions[:, class_id], minlength=len(texts)
+            )
+
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+
+        results = []
+        for row, class_id in enumerate(best):
+            confidence = float(probabilities[row, class_id])
+            has_text = bool(texts[row].strip())
+            if has_text and confidence >= MIN_CONFIDENCE:
+                results.append((model["classes"][class_id], round(confidence, 4)))
+            else:
+                results.append(("General", round(confidence, 4)))
+        return results
+
+    async def train_from_db(self, db) -> Dict[str, Any]:
+        """Train on every document whose category is already known, fitting in a worker thread."""
+        documents = await db.documents.find(
+            {"category": {"$nin": ["General", "general", None]}},
+            {"_id": 0, "id": 1, "file_url": 1, "category": 1}
+        ).to_list(None)
+
+        texts = await document_text_service.get_texts(db, documents)
+        samples = [(texts[doc["id"]], doc["category"]) for doc in documents if texts.get(doc["id"])]
+        counts: Dict[str, int] = {}
+        for _, label in samples:
+            counts[label] = counts.get(label, 0) + 1
+        samples = [(text, label) for text, label in samples if counts[label] >= MIN_SAMPLES_PER_CLASS]
+        if not samples:
+            raise ValueError("No categorized documents with extractable text")
+
+        # Fitting is dense numpy work over every class and feature; keep it off the event loop
+        return await asyncio.to_thread(
+            self.train, [text for text, _ in samples], [label for _, label in samples]
+        )
+
+# Global document classifier
+document_classifier = DocumentClassifier()
@@ -1,7 +1,11 @@
 import logging
 import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from pathlib import Path
+from pymongo import UpdateOne
+from keyword_automaton import KeywordAutomaton
+from document_classifier import document_classifier
+from document_text_service import document_text_service
 
 logger = logging.getLogger(__name__)
 
@@ -19,26 +23,162 @@ class DocumentIntelligence:
             "Legal": ["agreement", "contract", "mou", "legal", "court"],
             "General": []
         }
+        
+        # Detected document types, in priority order
+        self.document_types = [
+            ("invoice", "Invoice"),
+            ("receipt", "Receipt"),
+            ("statement", "Statement"),
+            ("return", "Return")
+        ]
+        
+        self.months = [
+            "jan", "feb", "mar", "apr", "may", "jun",
+            "jul", "aug", "sep", "oct", "nov", "dec"
+        ]
+        
+        # Status tags, in the order they are added
+        self.status_tags = [("draft", "Draft"), ("final", "Final"), ("revised", "Revised")]
+        
+        self.automaton = self._build_automaton()
+    
+    def _build_automaton(self) -> KeywordAutomaton:
+        """Compile every keyword list into one automaton."""
+        automaton = KeywordAutomaton()
+        for category, keywords in self.category_keywords.items():
+            for keyword in keywords:
+                # Multi-word keywords are more specific, so they weigh more
+                automaton.add(keyword, ("category", category, len(keyword.split())))
+        for priority, (keyword, label) in enumerate(self.document_types):
+            automaton.add(keyword, ("type", priority, label))
+        for index, month in enumerate(self.months):
+            automaton.add(month, ("month", index, month.capitalize()))
+        for quarter in range(1, 5):
+            automaton.add(f"q{quarter}", ("quarter", quarter, f"Q{quarter}"))
+            automaton.add(f"quarter {quarter}", ("quarter", quarter, f"Q{quarter}"))
+        for order, (keyword, label) in enumerate(self.status_tags):
+            automaton.add(keyword, ("status", order, label))
+        automaton.compile()
+        return automaton
+    
+    def _scan(self, text: str) -> Dict[str, Any]:
+        """Run the automaton once over lower-cased text and summarize the hits."""
+        hits = {
+            "category_scores": {},
+            "type": None,
+            "month": None,
+            "quarter": None,
+            "status": {}
+        }
+        for _, _, (kind, key, value) in self.automaton.iter_matches(text.lower()):
+            if kind == "category":
+                hits["category_scores"][key] = hits["category_scores"].get(key, 0) + value
+            elif kind == "status":
+                hits["status"][key] = value
+            elif hits[kind] is None or key < hits[kind][0]:
+                # Lowest priority index wins, as with the ordered keyword lists
+                hits[kind] = (key, value)
+        return hits
+    
+    def score_categories(self, text: str) -> Dict[str, float]:
+        """Weighted keyword scores per category for a filename or document text."""
+        return self._scan(text)["category_scores"]
+    
+    def categorize_text(self, text: str) -> str:
+        """Categorize by highest weighted keyword score, e.g. on extracted document text."""
+        scores = self.score_categories(text)
+        if not scores:
+            return "General"
+        return max(scores, key=scores.get)
     
-    def auto_categorize(self, filename: str, content: Optional[bytes] = None) -> str:
-        """Auto-categorize document based on filename and content."""
+    def bulk_categorize(self, filenames: List[str], texts: Optional[List[str]] = None) -> List[str]:
+        """Categorize many documents, e.g. a whole archive, classifying their text in one batch."""
+        if texts is None:
+            return [self.auto_categorize(filename) for filename in filenames]
+        
+        categories = [self._categorize_filename(filename) for filename in filenames]
+        pending = [index for index, category in enumerate(categories) if category == "General"]
+        predictions = self._classify_texts([texts[index] for index in pending])
+        for index, category in zip(pending, predictions):
+            categories[index] = category
+        return categories
+    
+    def _categorize_filename(self, filename: str) -> str:
+        scores = self.score_categories(filename)
+        # Filenames keep the category precedence of category_keywords
+        for category in self.category_keywords:
+            if category in scores:
+                return category
+        return "General"
+    
+    def _classify_texts(self, texts: List[str]) -> List[str]:
+        """Trained classifier first, keyword scores on the text when it is unsure."""
+        if not texts:
+            return []
+        predictions = document_classifier.predict(texts)
+        return [
+            category if category != "General" else self.categorize_text(text)
+            for text, (category, _) in zip(texts, predictions)
+        ]
+    
+    def auto_categorize(self, filename: str, content: Optional[bytes] = None, text: Optional[str] = None) -> str:
+        """Auto-categorize document based on filename and, failing that, its extracted text."""
         try:
-            filename_lower = filename.lower()
-            
-            # Check filename against keywords
-            for category, keywords in self.category_keywords.items():
-                for keyword in keywords:
-                    if keyword in filename_lower:
-                        logger.info(f"Auto-categorized '{filename}' as {category}")
-                        return category
+            category = self._categorize_filename(filename)
+            if category == "General" and text:
+                category = self._classify_texts([text])[0]
             
-            # Default category
-            return "General"
+            if category != "General":
+                logger.info(f"Auto-categorized '{filename}' as {category}")
+            return category
             
         except Exception as e:
             logger.error(f"Error in auto-categorization: {str(e)}")
             return "General"
     
+    async def reclassify_archive(self, db, batch_size: int = 500, only_general: bool = True) -> Dict[str, Any]:
+        """Re-run categorization over stored documents, writing changes in bulk.
+        
+        Categories set by hand are never touched: beyond "General" documents,
+        only those categorized automatically are revisited, and none is ever
+        moved back to "General".
+        """
+        query = {"category": "General"}
+        if not only_general:
+            query = {"$or": [query, {"category_source": "auto"}]}
+        cursor = db.documents.find(query, {"_id": 0, "id": 1, "filename": 1, "file_url": 1, "category": 1})
+        stats = {"scanned": 0, "updated": 0, "changes": {}}
+        
+        async def flush(batch: List[Dict[str, Any]]):
+            texts = await document_text_service.get_texts(db, batch)
+            categories = self.bulk_categorize(
+                [doc["filename"] for doc in batch],
+                [texts.get(doc["id"], "") for doc in batch]
+            )
+            operations = []
+            for doc, category in zip(batch, categories):
+                if category not in ("General", doc.get("category")):
+                    operations.append(UpdateOne(
+                        {"id": doc["id"]}, {"$set": {"category": category, "category_source": "auto"}}
+                    ))
+                    stats["changes"][category] = stats["changes"].get(category, 0) + 1
+            if operations:
+                await db.documents.bulk_write(operations, ordered=False)
+            stats["scanned"] += len(batch)
+            stats["updated"] += len(operations)
+        
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+        
+        logger.info(f"Reclassified {stats['updated']} of {stats['scanned']} documents")
+        return stats
+    
     def extract_metadata(self, filename: str) -> Dict[str, Any]:
         """Extract metadata from filename."""
         try:
@@ -49,17 +189,11 @@ class DocumentIntelligence:
                 "detected_period": None
             }
             
-            filename_lower = filename.lower()
+            hits = self._scan(filename)
             
             # Detect document type
-            if "invoice" in filename_lower:
-                metadata["detected_type"] = "Invoice"
-            elif "receipt" in filename_lower:
-                metadata["detected_type"] = "Receipt"
-            elif "statement" in filename_lower:
-                metadata["detected_type"] = "Statement"
-            elif "return" in filename_lower:
-                metadata["detected_type"] = "Return"
+            if hits["type"]:
+                metadata["detected_type"] = hits["type"][1]
             
             # Extract year/month patterns
             year_match = re.search(r'20\d{2}', filename)
@@ -67,14 +201,8 @@ class DocumentIntelligence:
                 metadata["detected_period"] = year_match.group(0)
             
             # Extract month
-            months = [
-                "jan", "feb", "mar", "apr", "may", "jun",
-                "jul", "aug", "sep", "oct", "nov", "dec"
-            ]
-            for month in months:
-                if month in filename_lower:
-                    metadata["detected_month"] = month.capitalize()
-                    break
+            if hits["month"]:
+                metadata["detected_month"] = hits["month"][1]
             
             return metadata
             
@@ -85,7 +213,7 @@ class DocumentIntelligence:
     def suggest_tags(self, filename: str, category: str) -> list:
         """Suggest tags based on filename and category."""
         tags = [category]
-        filename_lower = filename.lower()
+        hits = self._scan(filename)
         
         # Add year as tag if found
         year_match = re.search(r'20\d{2}', filename)
@@ -93,18 +221,12 @@ class DocumentIntelligence:
             tags.append(f"FY{year_match.group(0)}")
         
         # Add quarter if detected
-        for i in range(1, 5):
-            if f"q{i}" in filename_lower or f"quarter {i}" in filename_lower:
-                tags.append(f"Q{i}")
-                break
+        if hits["quarter"]:
+            tags.append(hits["quarter"][1])
         
         # Add document type tags
-        if "draft" in filename_lower:
-            tags.append("Draft")
-        if "final" in filename_lower:
-            tags.append("Final")
-        if "revised" in filename_lower:
-            tags.append("Revised")
+        for order in sorted(hits["status"]):
+            tags.append(hits["status"][order])
         
         return tags
     
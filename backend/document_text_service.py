@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, List
+
+from ocr_service import ocr_service
+from file_service import file_service
+
+logger = logging.getLogger(__name__)
+
+# Longest text kept per document; enough for classification and fingerprinting
+MAX_TEXT_CHARS = 50000
+
+
+class DocumentTextService:
+    """Extracted document text, stored once so batch jobs do not re-run OCR."""
+
+    async def ensure_indexes(self, db):
+        """Create indexes used by text lookups."""
+        await db.document_texts.create_index("document_id", unique=True)
+
+    async def save_text(self, db, document_id: str, text: str):
+        """Store the extracted text of a document."""
+        await db.document_texts.update_one(
+            {"document_id": document_id},
+            {"$set": {
+                "text": text[:MAX_TEXT_CHARS],
+                "extracted_at": datetime.now(timezone.utc).isoformat()
+            }},
+            upsert=True
+        )
+
+    async def delete_text(self, db, document_id: str):
+        """Remove the stored text of a deleted document."""
+        await db.document_texts.delete_one({"document_id": document_id})
+
+    def _extract(self, file_url: str) -> str:
+        file_path = file_service.get_file_path(file_url)
+        if file_path is None or file_path.suffix.lower() not in ocr_service.supported_formats:
+            return ""
+        try:
+            return ocr_service.extract_text(str(file_path))[:MAX_TEXT_CHARS]
+        except Exception as e:
+            logger.error(f"Error extracting text from {file_url}: {str(e)}")
+            return ""
+
+    async def get_texts(self, db, documents: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Get text for document records, extracting and storing whatever is missing."""
+        ids = [doc["id"] for doc in documents]
+        texts = {
+            row["document_id"]: row["text"]
+            async for row in db.document_texts.find(
+                {"document_id": {"$in": ids}}, {"_id": 0, "document_id": 1, "text": 1}
+            )
+        }
+
+        missing = [doc for doc in documents if doc["id"] not in texts and doc.get("file_url")]
+        if missing:
+            loop = asyncio.get_running_loop()
+            extracted = await asyncio.gather(*(
+                loop.run_in_executor(None, self._extract, doc["file_url"]) for doc in missing
+            ))
+            for doc, text in zip(missing, extracted):
+                texts[doc["id"]] = text
+                await self.save_text(db, doc["id"], text)
+
+        return texts
+
+# Global document text service
+document_text_service = DocumentTextService()
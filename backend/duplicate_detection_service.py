@@ -0,0 +1,233 @@
+import logging
+import re
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Set
+
+import numpy as np
+from pymongo import UpdateOne
+
+from document_text_service import document_text_service
+
+logger = logging.getLogger(__name__)
+
+NUM_PERMUTATIONS = 128
+# 32 bands of 4 rows: documents sharing a band are candidates; ~0.8 Jaccard
+# pairs collide with probability > 0.99, ~0.3 pairs with probability < 0.25
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 3
+# Estimated Jaccard similarity at which two documents count as duplicates
+DUPLICATE_THRESHOLD = 0.8
+# Texts shorter than this (in words) are too thin to fingerprint
+MIN_WORDS = 20
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed seed so signatures stay comparable across restarts
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, _MAX_HASH, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _MAX_HASH, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature over word shingles, or None when the text is too short."""
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < MIN_WORDS:
+        return None
+    shingles = {
+        " ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    # (a * x + b) mod p for every permutation and shingle; a, x < 2^32 so no overflow before mod
+    permuted = (np.outer(hashes, _PERM_A) % _MERSENNE_PRIME + _PERM_B) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def lsh_band_keys(signature: np.ndarray) -> List[str]:
+    """One key per band; equal keys mean identical rows in that band."""
+    bands = signature.reshape(LSH_BANDS, LSH_ROWS)
+    return [f"{band}:{zlib.crc32(rows.tobytes()):08x}" for band, rows in enumerate(bands)]
+
+
+def estimate_similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(first == second))
+
+
+class DuplicateDetectionService:
+    """Near-duplicate detection with MinHash signatures and an in-memory LSH index."""
+
+    def __init__(self):
+        self._buckets: Dict[str, Set[str]] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._loaded = False
+
+    def _index(self, document_id: str, signature: np.ndarray, band_keys: List[str]):
+        self._signatures[document_id] = signature
+        for key in band_keys:
+            self._buckets.setdefault(key, set()).add(document_id)
+
+    async def _ensure_loaded(self, db):
+        """Load stored signatures into memory on first use."""
+        if self._loaded:
+            return
+        cursor = db.documents.find(
+            {"minhash": {"$exists": True}}, {"_id": 0, "id": 1, "minhash": 1, "lsh_bands": 1}
+        )
+        async for doc in cursor:
+            self._index(doc["id"], np.array(doc["minhash"], dtype=np.uint32), doc["lsh_bands"])
+        self._loaded = True
+        logger.info(f"Duplicate index loaded with {len(self._signatures)} documents")
+
+    def find_similar(self, signature: np.ndarray, exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Indexed documents whose estimated similarity reaches the duplicate threshold."""
+        candidates: Set[str] = set()
+        for key in lsh_band_keys(signature):
+            candidates |= self._buckets.get(key, set())
+        candidates.discard(exclude)
+
+        matches = []
+        for document_id in candidates:
+            similarity = estimate_similarity(signature, self._signatures[document_id])
+            if similarity >= DUPLICATE_THRESHOLD:
+                matches.append({"document_id": document_id, "similarity": round(similarity, 3)})
+        return sorted(matches, key=lambda match: match["similarity"], reverse=True)
+
+    async def check_and_index(self, db, document_id: str, text: str) -> List[Dict[str, Any]]:
+        """Find likely duplicates of a new document, then add it to the index."""
+        signature = minhash_signature(text)
+        if signature is None:
+            return []
+        await self._ensure_loaded(db)
+
+        band_keys = lsh_band_keys(signature)
+        matches = self.find_similar(signature, exclude=document_id)
+        await db.documents.update_one(
+            {"id": document_id},
+            {"$set": {
+                "minhash": signature.tolist(),
+                "lsh_bands": band_keys,
+                "possible_duplicates": [match["document_id"] for match in matches]
+            }}
+        )
+        self._index(document_id, signature, band_keys)
+        return matches
+
+    async def remove(self, db, document_id: str):
+        """Forget a deleted document: its index entry, stored text and duplicate links."""
+        signature = self._signatures.pop(document_id, None)
+        if signature is not None:
+            for key in lsh_band_keys(signature):
+                bucket = self._buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(document_id)
+                    if not bucket:
+                        del self._buckets[key]
+        await document_text_service.delete_text(db, document_id)
+        await db.documents.update_many(
+            {"possible_duplicates": document_id}, {"$pull": {"possible_duplicates": document_id}}
+        )
+
+    async def backfill_signatures(self, db, batch_size: int = 500) -> int:
+        """Compute signatures for documents stored before fingerprinting existed."""
+        await self._ensure_loaded(db)
+        cursor = db.documents.find(
+            {"minhash": {"$exists": False}}, {"_id": 0, "id": 1, "file_url": 1}
+        )
+        indexed = 0
+        batch = []
+
+        async def flush(batch: List[Dict[str, Any]]) -> int:
+            texts = await document_text_service.get_texts(db, batch)
+            operations = []
+            for doc in batch:
+                signature = minhash_signature(texts.get(doc["id"], ""))
+                if signature is None:
+                    continue
+                band_keys = lsh_band_keys(signature)
+                operations.append(UpdateOne(
+                    {"id": doc["id"]},
+                    {"$set": {"minhash": signature.tolist(), "lsh_bands": band_keys}}
+                ))
+                self._index(doc["id"], signature, band_keys)
+            if operations:
+                await db.documents.bulk_write(operations, ordered=False)
+            return len(operations)
+
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                indexed += await flush(batch)
+                batch = []
+        if batch:
+            indexed += await flush(batch)
+        return indexed
+
+    def cluster(self) -> List[List[str]]:
+        """Group indexed documents into duplicate clusters with union-find."""
+        parent = {document_id: document_id for document_id in self._signatures}
+
+        def find(document_id: str) -> str:
+            while parent[document_id] != document_id:
+                parent[document_id] = parent[parent[document_id]]
+                document_id = parent[document_id]
+            return document_id
+
+        checked = set()
+        for bucket in self._buckets.values():
+            if len(bucket) < 2:
+                continue
+            members = sorted(bucket)
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    if (first, second) in checked:
+                        continue
+                    checked.add((first, second))
+                    if find(first) == find(second):
+                        continue
+                    similarity = estimate_similarity(self._signatures[first], self._signatures[second])
+                    if similarity >= DUPLICATE_THRESHOLD:
+                        parent[find(first)] = find(second)
+
+        groups: Dict[str, List[str]] = {}
+        for document_id in parent:
+            groups.setdefault(find(document_id), []).append(document_id)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    async def scan_archive(self, db) -> Dict[str, Any]:
+        """Fingerprint the archive and store the duplicate clusters found."""
+        try:
+            indexed = await self.backfill_signatures(db)
+            clusters = self.cluster()
+
+            names = {}
+            member_ids = [document_id for cluster in clusters for document_id in cluster]
+            async for doc in db.documents.find(
+                {"id": {"$in": member_ids}}, {"_id": 0, "id": 1, "filename": 1, "client_id": 1}
+            ):
+                names[doc["id"]] = doc
+
+            scan = {
+                "id": str(uuid.uuid4()),
+                "documents_indexed": len(self._signatures),
+                "newly_indexed": indexed,
+                "clusters": [
+                    [names.get(document_id, {"id": document_id}) for document_id in cluster]
+                    for cluster in clusters
+                ],
+                "scanned_at": datetime.now(timezone.utc).isoformat()
+            }
+            await db.duplicate_scans.insert_one(scan.copy())
+            logger.info(f"Duplicate scan found {len(clusters)} clusters")
+            return {"success": True, "scan": scan}
+        except Exception as e:
+            logger.error(f"Duplicate scan failed: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+# Global duplicate detection service
+duplicate_detection_service = DuplicateDetectionService()
@@ -1,7 +1,9 @@
 import resend
 import os
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -74,14 +76,14 @@ class EmailService:
                 "recipient": to
             }
     
-    def send_deadline_reminder(
+    def deadline_reminder_message(
         self,
         to: str,
         task_name: str,
         deadline: datetime,
         priority: str
     ) -> Dict[str, Any]:
-        """Send deadline reminder email."""
+        """Deadline reminder email as send_email arguments."""
         priority_colors = {
             "LOW": "#4CAF50",
             "MEDIUM": "#2196F3",
@@ -117,11 +119,96 @@ class EmailService:
         </html>
         """
         
-        return self.send_email(
-            to=to,
-            subject=f"[{priority}] Deadline Reminder: {task_name}",
-            html=html
+        return {
+            "to": to,
+            "subject": f"[{priority}] Deadline Reminder: {task_name}",
+            "html": html
+        }
+    
+    def send_deadline_reminder(
+        self,
+        to: str,
+        task_name: str,
+        deadline: datetime,
+        priority: str
+    ) -> Dict[str, Any]:
+        """Send deadline reminder email."""
+        return self.send_email(**self.deadline_reminder_message(to, task_name, deadline, priority))
+    
+    def deadline_digest_message(self, to: str, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """One reminder covering several upcoming deadlines of a recipient.
+        
+        Each task needs title, deadline (datetime) and priority.
+        """
+        if len(tasks) == 1:
+            task = tasks[0]
+            return self.deadline_reminder_message(to, task["title"], task["deadline"], task["priority"])
+        
+        rows = "".join(
+            f"""
+                            <tr>
+                                <td style="padding: 8px; border-bottom: 1px solid #eee;">{task['title']}</td>
+                                <td style="padding: 8px; border-bottom: 1px solid #eee;">{task['deadline'].strftime("%B %d, %Y")}</td>
+                                <td style="padding: 8px; border-bottom: 1px solid #eee;">{task['priority']}</td>
+                            </tr>"""
+            for task in sorted(tasks, key=lambda task: task["deadline"])
         )
+        html = f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                    <div style="background-color: #f5f5f5; padding: 20px; border-radius: 5px;">
+                        <h1 style="color: #0f172a; margin: 0;">Upcoming Deadlines</h1>
+                    </div>
+                    <div style="margin: 20px 0;">
+                        <p>Hello,</p>
+                        <p>The following {len(tasks)} deadlines are coming up:</p>
+                        <table style="width: 100%; border-collapse: collapse;">
+                            <tr>
+                                <th style="text-align: left; padding: 8px;">Task</th>
+                                <th style="text-align: left; padding: 8px;">Deadline</th>
+                                <th style="text-align: left; padding: 8px;">Priority</th>
+                            </tr>{rows}
+                        </table>
+                        <p>Please ensure these tasks are completed by their deadlines.</p>
+                    </div>
+                    <div style="border-top: 1px solid #ddd; padding-top: 20px; font-size: 12px; color: #666;">
+                        <p>This is an automated message from CA Practice Pro.</p>
+                    </div>
+                </div>
+            </body>
+        </html>
+        """
+        
+        return {
+            "to": to,
+            "subject": f"Deadline Reminder: {len(tasks)} upcoming deadlines",
+            "html": html
+        }
+    
+    async def send_many(
+        self,
+        messages: List[Dict[str, Any]],
+        concurrency: int = 4,
+        rate_per_second: float = 2.0
+    ) -> List[Dict[str, Any]]:
+        """Send emails off the event loop, at most concurrency at a time and rate_per_second overall."""
+        semaphore = asyncio.Semaphore(concurrency)
+        lock = asyncio.Lock()
+        interval = 1 / rate_per_second if rate_per_second > 0 else 0
+        next_slot = [time.monotonic()]
+        
+        async def send(message):
+            async with semaphore:
+                # Each send claims the next free slot on the rate schedule
+                async with lock:
+                    wait = next_slot[0] - time.monotonic()
+                    next_slot[0] = max(next_slot[0], time.monotonic()) + interval
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                return await asyncio.to_thread(self.send_email, **message)
+        
+        return await asyncio.gather(*(send(message) for message in messages))
     
     def send_task_assignment(
         self,
@@ -157,6 +244,55 @@ class EmailService:
             subject=f"New Task: {task_title}",
             html=html
         )
+    
+    def send_query_reminder(
+        self,
+        to: str,
+        client_name: str,
+        query_text: str,
+        days_pending: int,
+        reminder_number: int
+    ) -> Dict[str, Any]:
+        """Send a follow-up reminder for an unanswered query."""
+        return self.send_email(**self.query_reminder_message(to, client_name, query_text, days_pending, reminder_number))
+    
+    def query_reminder_message(
+        self,
+        to: str,
+        client_name: str,
+        query_text: str,
+        days_pending: int,
+        reminder_number: int
+    ) -> Dict[str, Any]:
+        """Build a follow-up reminder for an unanswered query."""
+        html = f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                    <div style="background-color: #f5f5f5; padding: 20px; border-radius: 5px;">
+                        <h1 style="color: #0f172a; margin: 0;">Reminder: Information Pending</h1>
+                    </div>
+                    <div style="margin: 20px 0;">
+                        <p>Dear {client_name},</p>
+                        <p>We are still waiting for your response to the query below, raised {days_pending} days ago:</p>
+                        <div style="background: #f5f5f5; padding: 15px; border-left: 4px solid #10b981;">
+                            <strong>Query:</strong> {query_text}
+                        </div>
+                        <p>Please respond at your earliest convenience so we can complete your work on time.</p>
+                    </div>
+                    <div style="border-top: 1px solid #ddd; padding-top: 20px; font-size: 12px; color: #666;">
+                        <p>This is an automated message from CA Practice Pro.</p>
+                    </div>
+                </div>
+            </body>
+        </html>
+        """
+        
+        return {
+            "to": to,
+            "subject": f"Reminder {reminder_number}: Query Pending - {query_text[:50]}",
+            "html": html
+        }
 
 # Global email service instance
 email_service = EmailService()
\ No newline at end of file
@@ -0,0 +1,239 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from money import to_paise_array, apply_rate_array, from_paise
+
+logger = logging.getLogger(__name__)
+
+# Register headers mapped to the engine's column names
+COLUMN_ALIASES = {
+    "taxable value": "taxable_value",
+    "taxable_amount": "taxable_value",
+    "amount": "taxable_value",
+    "rate": "gst_rate",
+    "gst rate": "gst_rate",
+    "hsn/sac": "hsn",
+    "hsn_sac": "hsn",
+    "sac": "hsn",
+    "pos": "place_of_supply",
+    "place of supply": "place_of_supply",
+    "supplier gstin": "supplier_gstin",
+    "gstin of supplier": "supplier_gstin"
+}
+# Columns read as text so codes keep their leading zeros ("0401", "07")
+TEXT_COLUMNS = {"hsn", "place_of_supply", "supplier_gstin", "supplier_state"}
+GROUP_COLUMNS = ["gst_rate", "hsn", "supply_type"]
+TAX_HEADS = ["igst", "cgst", "sgst"]
+# Notified GST rates, in percent
+GST_RATE_SLABS = [0, 0.1, 0.25, 1, 1.5, 3, 5, 6, 7.5, 12, 18, 28, 40]
+# gst_rate column unit -> multiplier to percent
+RATE_UNITS = {"percent": 1, "fraction": 100}
+
+
+def _canonical(name) -> str:
+    """Engine column name of a register header."""
+    name = str(name).strip().lower()
+    return COLUMN_ALIASES.get(name, name)
+
+
+def _state_code(value) -> str:
+    """Two-digit state code from a code, "27-Maharashtra" or a GSTIN."""
+    text = str(value).strip()
+    return text[:2] if text[:2].isdigit() else ""
+
+
+def _map_distinct(column: pd.Series, function) -> np.ndarray:
+    """Apply function once per distinct value of a column."""
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+    return np.array([function(value) for value in uniques], dtype=object)[codes]
+
+
+def utilize_credit(liability: Dict[str, int], credit: Dict[str, int]) -> Dict[str, Any]:
+    """Set input tax credit off against output tax in the section 49 order.
+
+    IGST credit goes to IGST, then CGST, then SGST; CGST and SGST credit go
+    to their own head, then IGST. All amounts are paise.
+    """
+    payable = dict(liability)
+    remaining = dict(credit)
+    order = {"igst": ["igst", "cgst", "sgst"], "cgst": ["cgst", "igst"], "sgst": ["sgst", "igst"]}
+    for source in TAX_HEADS:
+        for target in order[source]:
+            used = min(remaining[source], payable[target])
+            payable[target] -= used
+            remaining[source] -= used
+    return {"cash_payable": payable, "credit_carried_forward": remaining}
+
+
+class GSTRegisterEngine:
+    """Columnar GST computation over sales and purchase registers, read in chunks."""
+
+    def __init__(self):
+        self.chunk_size = int(os.environ.get('GST_REGISTER_CHUNK_SIZE', 200000))
+
+    def _iter_chunks(self, source, file_format: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """Yield DataFrame chunks from a CSV or Parquet path or file object."""
+        if file_format is None:
+            name = source if isinstance(source, (str, Path)) else getattr(source, "name", "") or ""
+            file_format = "parquet" if str(name).lower().endswith(".parquet") else "csv"
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(source).iter_batches(batch_size=self.chunk_size):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(source, chunksize=self.chunk_size, dtype=self._text_dtypes(source))
+
+    def _text_dtypes(self, source) -> Dict[str, type]:
+        """str dtypes for the CSV headers that resolve to TEXT_COLUMNS, whatever their spelling."""
+        position = source.tell() if hasattr(source, "tell") else None
+        header = pd.read_csv(source, nrows=0).columns
+        if position is not None:
+            source.seek(position)
+        return {name: str for name in header if _canonical(name) in TEXT_COLUMNS}
+
+    def _rates(self, column: pd.Series, rate_unit: str) -> np.ndarray:
+        """GST rates of a chunk as fractions; any rate off the notified slabs is an error."""
+        if rate_unit not in RATE_UNITS:
+            raise ValueError(f"rate_unit must be one of {', '.join(RATE_UNITS)}")
+        percent = np.round(column.astype(float).fillna(0).to_numpy() * RATE_UNITS[rate_unit], 4)
+        unknown = ~np.isin(percent, GST_RATE_SLABS)
+        if unknown.any():
+            bad = sorted(set((percent[unknown] / RATE_UNITS[rate_unit]).tolist()))[:5]
+            raise ValueError(
+                f"{int(unknown.sum())} line(s) have a gst_rate that is not a GST rate "
+                f"(in {rate_unit}): {', '.join(f'{value:g}' for value in bad)}"
+            )
+        return percent / 100
+
+    def _tax_chunk(self, chunk: pd.DataFrame, home_state: str, register_type: str, rate_unit: str) -> pd.DataFrame:
+        """Per-line tax split into IGST/CGST/SGST, aggregated by rate, HSN and supply type."""
+        chunk = chunk.rename(columns=_canonical)
+        if "taxable_value" not in chunk.columns or "gst_rate" not in chunk.columns:
+            raise ValueError("Register needs taxable_value and gst_rate columns")
+
+        rate = self._rates(chunk["gst_rate"], rate_unit)
+        taxable = to_paise_array(chunk["taxable_value"].astype(float).fillna(0).to_numpy())
+        tax = apply_rate_array(taxable, rate)
+
+        place_of_supply = (
+            _map_distinct(chunk["place_of_supply"], _state_code)
+            if "place_of_supply" in chunk.columns else np.full(len(chunk), home_state, dtype=object)
+        )
+        place_of_supply = np.where(place_of_supply == "", home_state, place_of_supply)
+        if register_type == "purchases" and "supplier_gstin" in chunk.columns:
+            supplier_state = _map_distinct(chunk["supplier_gstin"], _state_code)
+        elif register_type == "purchases" and "supplier_state" in chunk.columns:
+            supplier_state = _map_distinct(chunk["supplier_state"], _state_code)
+        else:
+            supplier_state = np.full(len(chunk), home_state, dtype=object)
+        intra_state = supplier_state == place_of_supply
+
+        # Intra-state tax splits into CGST and SGST, the odd paisa to CGST
+        cgst = np.where(intra_state, (tax + 1) // 2, 0)
+        sgst = np.where(intra_state, tax - cgst, 0)
+        igst = np.where(intra_state, 0, tax)
+
+        # Lines without an HSN are kept, grouped under a missing HSN
+        hsn = chunk["hsn"].astype("string").str.strip() if "hsn" in chunk.columns else None
+        lines = pd.DataFrame({
+            "gst_rate": np.round(rate * 100, 3),
+            "hsn": hsn,
+            "supply_type": np.where(intra_state, "intra_state", "inter_state"),
+            "taxable_value": taxable,
+            "igst": igst,
+            "cgst": cgst,
+            "sgst": sgst,
+            "lines": 1
+        })
+        return lines.groupby(GROUP_COLUMNS, sort=False, dropna=False).sum()
+
+    def aggregate_register(
+        self,
+        source,
+        home_state: str,
+        register_type: str = "sales",
+        file_format: Optional[str] = None,
+        rate_unit: str = "percent"
+    ) -> pd.DataFrame:
+        """Totals in paise by rate, HSN and supply type for a whole register.
+
+        gst_rate is read in rate_unit: "percent" (18) or "fraction" (0.18).
+        """
+        partials = [
+            self._tax_chunk(chunk, home_state, register_type, rate_unit)
+            for chunk in self._iter_chunks(source, file_format)
+        ]
+        if not partials:
+            return pd.DataFrame(columns=GROUP_COLUMNS + ["taxable_value"] + TAX_HEADS + ["lines"]).set_index(GROUP_COLUMNS)
+        return pd.concat(partials).groupby(level=GROUP_COLUMNS, dropna=False).sum().sort_index(na_position="first")
+
+    def _summary_rows(self, table: pd.DataFrame) -> list:
+        return [
+            {
+                "gst_rate": rate,
+                "hsn": None if pd.isna(hsn) else hsn,
+                "supply_type": supply_type,
+                "taxable_value": from_paise(int(row["taxable_value"])),
+                "igst": from_paise(int(row["igst"])),
+                "cgst": from_paise(int(row["cgst"])),
+                "sgst": from_paise(int(row["sgst"])),
+                "lines": int(row["lines"])
+            }
+            for (rate, hsn, supply_type), row in table.iterrows()
+        ]
+
+    def compute_liability(
+        self,
+        home_state: str,
+        sales_source=None,
+        purchases_source=None,
+        sales_format: Optional[str] = None,
+        purchases_format: Optional[str] = None,
+        rate_unit: str = "percent"
+    ) -> Dict[str, Any]:
+        """Output tax, ITC and cash payable per tax head for a period's registers."""
+        try:
+            home_state = _state_code(home_state)
+            if not home_state:
+                raise ValueError("A two-digit home state code (or GSTIN) is required")
+
+            totals = {}
+            breakdown = {}
+            for register_type, source, file_format in (
+                ("sales", sales_source, sales_format),
+                ("purchases", purchases_source, purchases_format)
+            ):
+                table = (
+                    self.aggregate_register(source, home_state, register_type, file_format, rate_unit)
+                    if source is not None else None
+                )
+                totals[register_type] = {
+                    head: int(table[head].sum()) if table is not None else 0 for head in TAX_HEADS
+                }
+                breakdown[register_type] = self._summary_rows(table) if table is not None else []
+
+            settlement = utilize_credit(totals["sales"], totals["purchases"])
+            return {
+                "success": True,
+                "home_state": home_state,
+                "output_tax": {head: from_paise(value) for head, value in totals["sales"].items()},
+                "input_tax_credit": {head: from_paise(value) for head, value in totals["purchases"].items()},
+                "cash_payable": {head: from_paise(value) for head, value in settlement["cash_payable"].items()},
+                "credit_carried_forward": {
+                    head: from_paise(value) for head, value in settlement["credit_carried_forward"].items()
+                },
+                "total_cash_payable": from_paise(sum(settlement["cash_payable"].values())),
+                "sales_breakdown": breakdown["sales"],
+                "purchases_breakdown": breakdown["purchases"]
+            }
+        except Exception as e:
+            logger.error(f"Error computing GST from registers: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+# Global GST register engine
+gst_register_engine = GSTRegisterEngine()
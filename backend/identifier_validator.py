@@ -0,0 +1,204 @@
+import logging
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Clients read per batch during an audit
+AUDIT_CHUNK_SIZE = 50000
+GSTIN_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# Weights of the first 14 GSTIN characters in the mod-36 check character
+GSTIN_WEIGHTS = np.array([1, 2] * 7, dtype=np.int64)
+# 01-38 are states and union territories, 97 other territory, 99 centre jurisdiction
+GSTIN_STATE_CODES = {f"{code:02d}" for code in range(1, 39)} | {"97", "99"}
+PAN_ENTITY_TYPES = {
+    'P': 'Individual',
+    'C': 'Company',
+    'H': 'HUF',
+    'F': 'Firm',
+    'A': 'AOP',
+    'T': 'Trust',
+    'B': 'BOI',
+    'L': 'Local Authority',
+    'J': 'Artificial Juridical Person',
+    'G': 'Government'
+}
+
+# Byte -> base-36 value, -1 outside 0-9/A-Z
+_CHAR_VALUES = np.full(256, -1, dtype=np.int64)
+for _value, _char in enumerate(GSTIN_ALPHABET):
+    _CHAR_VALUES[ord(_char)] = _value
+
+
+def gstin_check_character(first14: str) -> str:
+    """Check character of a GSTIN from its first 14 characters."""
+    total = 0
+    for char, weight in zip(first14.upper(), GSTIN_WEIGHTS):
+        product = GSTIN_ALPHABET.index(char) * int(weight)
+        total += product // 36 + product % 36
+    return GSTIN_ALPHABET[(36 - total % 36) % 36]
+
+
+def _normalize(values) -> pd.Series:
+    return pd.Series(values, dtype=object).where(lambda s: s.notna(), "").astype(str).str.strip().str.upper()
+
+
+def _char_values(values: pd.Series, width: int) -> np.ndarray:
+    """(n, width) base-36 values of strings, -1 for other characters or padding."""
+    encoded = values.str.encode("ascii", errors="replace").to_numpy().astype(f"S{width}")
+    return _CHAR_VALUES[encoded.view(np.uint8).reshape(len(values), width)]
+
+
+def _pan_format(values: np.ndarray) -> np.ndarray:
+    """5 letters, 4 digits and a letter, on (n, 10) character values."""
+    letters = values >= 10
+    digits = (values >= 0) & (values < 10)
+    return letters[:, :5].all(axis=1) & digits[:, 5:9].all(axis=1) & letters[:, 9]
+
+
+def _first_error(checks: List[tuple], size: int) -> np.ndarray:
+    """The message of the first failing check per row, None where all pass."""
+    errors = np.full(size, None, dtype=object)
+    for passed, message in reversed(checks):
+        errors[~passed] = message
+    return errors
+
+
+def _records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Rows as dicts, with missing values as None."""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def validate_pan_series(pans) -> pd.DataFrame:
+    """Vectorized validate_pan over a column of PANs."""
+    pans = _normalize(pans)
+    values = _char_values(pans, 10)
+    lengths = pans.str.len().to_numpy()
+    errors = _first_error([
+        (lengths == 10, "PAN must be 10 characters"),
+        (_pan_format(values) | (lengths != 10), "Invalid PAN format"),
+    ], len(pans))
+    valid = pd.isna(errors)
+    entity_type = pans.str[3].map(PAN_ENTITY_TYPES).fillna("Unknown").where(valid, None)
+    return pd.DataFrame({"pan": pans.to_numpy(), "valid": valid, "error": errors, "entity_type": entity_type.to_numpy()})
+
+
+def validate_gstin_series(gstins, pans=None) -> pd.DataFrame:
+    """Vectorized validate_gstin over a column of GSTINs.
+
+    The mod-36 check character is verified for every row at once; when a
+    column of PANs is given, the PAN embedded in each GSTIN must match it.
+    """
+    gstins = _normalize(gstins)
+    values = _char_values(gstins, 15)
+    lengths = gstins.str.len().to_numpy()
+    well_formed = lengths == 15
+
+    state_code = gstins.str[:2]
+    weighted = np.where(values[:, :14] >= 0, values[:, :14], 0) * GSTIN_WEIGHTS
+    expected = (36 - (weighted // 36 + weighted % 36).sum(axis=1) % 36) % 36
+    checks = [
+        (well_formed, "GSTIN must be 15 characters"),
+        (state_code.str.isdigit().to_numpy() | ~well_formed, "Invalid state code"),
+        (state_code.isin(GSTIN_STATE_CODES).to_numpy() | ~well_formed, "Unknown state code"),
+        (_pan_format(values[:, 2:12]) | ~well_formed, "Invalid PAN in GSTIN"),
+        ((values[:, 12] > 0) | ~well_formed, "Invalid entity code"),
+        ((gstins.str[13] == "Z").to_numpy() | ~well_formed, "13th character must be Z"),
+        ((values[:, 14] == expected) | ~well_formed, "Checksum digit does not match"),
+    ]
+
+    embedded_pan = gstins.str[2:12]
+    pan_matches = None
+    if pans is not None:
+        pans = _normalize(pans).to_numpy()
+        has_pan = pans != ""
+        pan_matches = np.where(has_pan, embedded_pan.to_numpy() == pans, None)
+        checks.append((~has_pan | (embedded_pan.to_numpy() == pans) | ~well_formed, "PAN in GSTIN does not match client PAN"))
+
+    errors = _first_error(checks, len(gstins))
+    result = pd.DataFrame({
+        "gstin": gstins.to_numpy(),
+        "valid": pd.isna(errors),
+        "error": errors,
+        "state_code": state_code.where(well_formed, None).to_numpy(),
+        "pan": embedded_pan.where(well_formed, None).to_numpy(),
+        "expected_checksum": np.array(list(GSTIN_ALPHABET))[expected]
+    })
+    if pan_matches is not None:
+        result["pan_matches"] = pan_matches
+    return result
+
+
+class IdentifierValidator:
+    """Batch PAN and GSTIN checks for imports and the client master."""
+
+    def validate_batch(self, records: List[Dict[str, Optional[str]]]) -> List[Dict[str, Any]]:
+        """Validate the gstin and/or pan of each record."""
+        frame = pd.DataFrame(records, columns=["gstin", "pan"])
+        results = [{} for _ in records]
+        has_gstin = frame["gstin"].notna().to_numpy()
+        has_pan = frame["pan"].notna().to_numpy()
+        if has_gstin.any():
+            rows = np.flatnonzero(has_gstin)
+            gstin = validate_gstin_series(frame["gstin"].iloc[rows], frame["pan"].iloc[rows])
+            for row, result in zip(rows, _records(gstin)):
+                results[row]["gstin"] = result
+        if has_pan.any():
+            rows = np.flatnonzero(has_pan)
+            pan = validate_pan_series(frame["pan"].iloc[rows])
+            for row, result in zip(rows, _records(pan)):
+                results[row]["pan"] = result
+        return results
+
+    def _audit_chunk(self, clients: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        frame = pd.DataFrame(clients, columns=["id", "name", "gstin", "pan"])
+        issues = []
+        for field, rows in (("gstin", frame["gstin"].notna()), ("pan", frame["pan"].notna())):
+            subset = frame[rows & (frame[field] != "")]
+            if subset.empty:
+                continue
+            if field == "gstin":
+                checked = validate_gstin_series(subset["gstin"], subset["pan"])
+            else:
+                checked = validate_pan_series(subset["pan"])
+            invalid = ~checked["valid"].to_numpy()
+            for client_id, name, value, error in zip(
+                subset["id"].to_numpy()[invalid], subset["name"].to_numpy()[invalid],
+                subset[field].to_numpy()[invalid], checked["error"].to_numpy()[invalid]
+            ):
+                issues.append({"client_id": client_id, "client_name": name, "field": field, "value": value, "error": error})
+        return issues
+
+    async def audit_clients(self, db) -> Dict[str, Any]:
+        """Check every client's GSTIN and PAN and list the ones that fail."""
+        try:
+            issues = []
+            checked = 0
+            cursor = db.clients.find({}, {"_id": 0, "id": 1, "name": 1, "gstin": 1, "pan": 1})
+            chunk = []
+            async for client in cursor.batch_size(AUDIT_CHUNK_SIZE):
+                chunk.append(client)
+                if len(chunk) >= AUDIT_CHUNK_SIZE:
+                    issues.extend(self._audit_chunk(chunk))
+                    checked += len(chunk)
+                    chunk = []
+            if chunk:
+                issues.extend(self._audit_chunk(chunk))
+                checked += len(chunk)
+
+            by_error = pd.Series([issue["error"] for issue in issues], dtype=object).value_counts()
+            return {
+                "success": True,
+                "clients_checked": checked,
+                "invalid": len(issues),
+                "by_error": {error: int(count) for error, count in by_error.items()},
+                "issues": issues
+            }
+        except Exception as e:
+            logger.error(f"Error auditing client identifiers: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+# Global identifier validator
+identifier_validator = IdentifierValidator()
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest side after downscaling; ~300 DPI for an A4 page
+MAX_DIMENSION = 3500
+# Longest side of the thumbnail used to estimate skew
+DESKEW_SAMPLE_DIMENSION = 800
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.5
+
+
+def _otsu_threshold(pixels: np.ndarray) -> int:
+    """Compute Otsu's threshold for an 8-bit grayscale image."""
+    hist = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    probabilities = hist / pixels.size
+    omega = np.cumsum(probabilities)
+    mu = np.cumsum(probabilities * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between_class = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    return int(np.nanargmax(np.nan_to_num(between_class)))
+
+
+def _estimate_skew(image: Image.Image) -> float:
+    """Find the rotation that makes text lines horizontal (projection profile)."""
+    sample = image.copy()
+    sample.thumbnail((DESKEW_SAMPLE_DIMENSION, DESKEW_SAMPLE_DIMENSION))
+    pixels = np.asarray(sample)
+    ink = Image.fromarray(((pixels < _otsu_threshold(pixels)) * 255).astype(np.uint8))
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + DESKEW_STEP, DESKEW_STEP):
+        rows = np.asarray(ink.rotate(float(angle), fillcolor=0)).sum(axis=1, dtype=np.float64)
+        score = float(np.var(rows))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_image(image_bytes: bytes) -> bytes:
+    """Downscale, deskew and binarize a scanned page. Returns PNG bytes."""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes))).convert('L')
+
+    if max(image.size) > MAX_DIMENSION:
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+
+    angle = _estimate_skew(image)
+    if angle:
+        image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    pixels = np.asarray(image)
+    binary = np.where(pixels > _otsu_threshold(pixels), 255, 0).astype(np.uint8)
+
+    output = io.BytesIO()
+    Image.fromarray(binary).save(output, format='PNG')
+    return output.getvalue()
+
+
+class ImageOCRService:
+    """Local Tesseract OCR for images and image-only PDF pages."""
+
+    def __init__(self):
+        self.lang = os.environ.get('OCR_LANG', 'eng')
+        self.max_workers = int(os.environ.get('OCR_PREPROCESS_WORKERS', os.cpu_count() or 2))
+        self.parallel = True
+        self.cache_dir = Path(os.environ.get('OCR_CACHE_DIR', '/app/backend/ocr_cache'))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_cache_size = int(os.environ.get('OCR_MEMORY_CACHE_SIZE', 512))
+        self._memory_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def available(self) -> bool:
+        """Whether the tesseract binary can be found."""
+        return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Create the preprocessing pool on first use."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def _cache_key(self, image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes + self.lang.encode()).hexdigest()
+
+    def _remember(self, key: str, text: str):
+        """Keep a text in the in-memory LRU; older entries remain on disk."""
+        self._memory_cache[key] = text
+        self._memory_cache.move_to_end(key)
+        if len(self._memory_cache) > self.memory_cache_size:
+            self._memory_cache.popitem(last=False)
+
+    def _get_cached(self, key: str) -> Optional[str]:
+        if key in self._memory_cache:
+            self._memory_cache.move_to_end(key)
+            return self._memory_cache[key]
+        cache_file = self.cache_dir / f"{key}.txt"
+        if cache_file.exists():
+            text = cache_file.read_text(encoding='utf-8')
+            self._remember(key, text)
+            return text
+        return None
+
+    def _set_cached(self, key: str, text: str):
+        self._remember(key, text)
+        (self.cache_dir / f"{key}.txt").write_text(text, encoding='utf-8')
+
+    def _recognize(self, processed_bytes: bytes) -> str:
+        return pytesseract.image_to_string(Image.open(io.BytesIO(processed_bytes)), lang=self.lang)
+
+    def ocr_images(self, images: List[bytes]) -> List[str]:
+        """OCR a batch of page images, preprocessing cache misses in parallel."""
+        keys = [self._cache_key(image) for image in images]
+        texts = [self._get_cached(key) for key in keys]
+        misses = [i for i, text in enumerate(texts) if text is None]
+        if not misses:
+            return texts
+
+        if not self.available:
+            raise RuntimeError("Tesseract is not installed")
+
+        miss_images = [images[i] for i in misses]
+        if self.parallel and len(miss_images) > 1:
+            processed = list(self._get_pool().map(preprocess_image, miss_images))
+        else:
+            processed = [preprocess_image(image) for image in miss_images]
+
+        # tesseract runs as a subprocess, so threads are enough here
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            recognized = list(executor.map(self._recognize, processed))
+
+        for i, text in zip(misses, recognized):
+            self._set_cached(keys[i], text)
+            texts[i] = text
+
+        logger.info(f"OCR completed for {len(misses)} page(s), {len(images) - len(misses)} served from cache")
+        return texts
+
+    def ocr_image(self, image_bytes: bytes) -> str:
+        """OCR a single image."""
+        return self.ocr_images([image_bytes])[0]
+
+    def shutdown(self):
+        """Stop the preprocessing pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Global image OCR service
+image_ocr_service = ImageOCRService()
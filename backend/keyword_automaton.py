@@ -0,0 +1,60 @@
+from collections import deque
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton that finds every keyword occurrence in one pass over the text."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[str, Any]]] = [[]]
+        self._delta: List[Dict[str, int]] = []
+        self._compiled = False
+
+    def add(self, keyword: str, payload: Any):
+        """Register a keyword with the payload returned when it matches."""
+        if not keyword:
+            raise ValueError("Keyword must not be empty")
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((keyword, payload))
+        self._compiled = False
+
+    def compile(self):
+        """Build failure links breadth-first, then fold them into a full transition table."""
+        delta: List[Dict[str, int]] = [dict() for _ in self._goto]
+        delta[0] = dict(self._goto[0])
+        queue = deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            # Transitions of the failure state, overridden by the node's own edges
+            delta[node] = {**delta[self._fail[node]], **self._goto[node]}
+            for char, child in self._goto[node].items():
+                self._fail[child] = delta[self._fail[node]].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+        self._delta = delta
+        self._compiled = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, Any]]:
+        """Yield (start, keyword, payload) for every occurrence, overlapping ones included."""
+        if not self._compiled:
+            self.compile()
+        delta, output = self._delta, self._output
+        node = 0
+        for index, char in enumerate(text):
+            node = delta[node].get(char, 0)
+            if output[node]:
+                for keyword, payload in output[node]:
+                    yield index - len(keyword) + 1, keyword, payload
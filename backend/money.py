@@ -0,0 +1,102 @@
+from typing import Union
+
+import numpy as np
+
+# Money is held as integer paise; arrays of amounts as int64 paise
+PAISE_PER_RUPEE = 100
+# Rates are applied as integer parts-per-million
+RATE_SCALE = 1_000_000
+
+Number = Union[int, float]
+
+
+def to_paise(amount: Number) -> int:
+    """Rupees to integer paise, rounding half away from zero.
+
+    The amount is first resolved to 1/1000 rupee, so 1.005 becomes 101 paise
+    even though the float is a hair below it. to_paise_array rounds identically.
+    """
+    if isinstance(amount, int):
+        return amount * PAISE_PER_RUPEE
+    mills = round(amount * 1000)
+    paise = (abs(mills) + 5) // 10
+    return paise if mills >= 0 else -paise
+
+
+def to_paise_array(amounts) -> np.ndarray:
+    """Element-wise to_paise, as int64."""
+    amounts = np.asarray(amounts)
+    if np.issubdtype(amounts.dtype, np.integer):
+        return amounts.astype(np.int64) * PAISE_PER_RUPEE
+    mills = np.rint(np.asarray(amounts, dtype=np.float64) * 1000).astype(np.int64)
+    paise = (np.abs(mills) + 5) // 10
+    return np.where(mills >= 0, paise, -paise)
+
+
+def from_paise(paise: int) -> float:
+    """Integer paise to rupees."""
+    return paise / PAISE_PER_RUPEE
+
+
+def from_paise_array(paise: np.ndarray) -> np.ndarray:
+    return np.asarray(paise, dtype=np.int64) / PAISE_PER_RUPEE
+
+
+def rate_to_ppm(rate: float) -> int:
+    """A fractional rate such as 0.18 as integer parts-per-million."""
+    return round(rate * RATE_SCALE)
+
+
+def _divide_half_up(numerator: int, denominator: int) -> int:
+    quotient = (abs(numerator) + denominator // 2) // denominator
+    return quotient if numerator >= 0 else -quotient
+
+
+def apply_rate(paise: int, rate: float) -> int:
+    """paise * rate, rounded half-up to whole paise."""
+    return _divide_half_up(paise * rate_to_ppm(rate), RATE_SCALE)
+
+
+def apply_rate_array(paise: np.ndarray, rates) -> np.ndarray:
+    """Element-wise apply_rate; rates may be a scalar or an array."""
+    paise = np.asarray(paise, dtype=np.int64)
+    ppm = np.rint(np.asarray(rates, dtype=np.float64) * RATE_SCALE).astype(np.int64)
+    product = paise * ppm
+    quotient = (np.abs(product) + RATE_SCALE // 2) // RATE_SCALE
+    return np.where(product >= 0, quotient, -quotient)
+
+
+def prorate(paise: int, numerator: int, denominator: int) -> int:
+    """paise * numerator / denominator, rounded half-up, e.g. interest for days/365."""
+    return _divide_half_up(paise * numerator, denominator)
+
+
+def prorate_array(paise: np.ndarray, numerators, denominator: int) -> np.ndarray:
+    """Element-wise prorate for non-negative numerators.
+
+    paise is split into multiples of denominator and a remainder first, so
+    large products do not overflow int64.
+    """
+    paise = np.asarray(paise, dtype=np.int64)
+    numerators = np.asarray(numerators, dtype=np.int64)
+    whole, remainder = np.divmod(np.abs(paise), denominator)
+    quotient = whole * numerators + (remainder * numerators + denominator // 2) // denominator
+    return np.where(paise >= 0, quotient, -quotient)
+
+
+def round_to_rupee(paise: int) -> int:
+    """Paise rounded half-up to whole rupees, returned in rupees."""
+    return _divide_half_up(paise, PAISE_PER_RUPEE)
+
+
+def round_to_rupee_array(paise: np.ndarray) -> np.ndarray:
+    paise = np.asarray(paise, dtype=np.int64)
+    rupees = (np.abs(paise) + PAISE_PER_RUPEE // 2) // PAISE_PER_RUPEE
+    return np.where(paise >= 0, rupees, -rupees)
+
+
+def format_inr(paise: int) -> str:
+    """Paise as a rupee string, e.g. 123456 -> '₹1,234.56'."""
+    sign = "-" if paise < 0 else ""
+    rupees, remainder = divmod(abs(paise), PAISE_PER_RUPEE)
+    return f"{sign}₹{rupees:,}.{remainder:02d}"
@@ -0,0 +1,416 @@
+"""OCR throughput benchmark.
+
+Generates a synthetic corpus of Form 16s, invoices, bank statements and
+challans with known ground-truth fields, then measures pages per second,
+per-extractor latency, peak RSS and field accuracy of ``ocr_service`` in
+serial and parallel modes. Each mode runs in a fresh interpreter so its
+peak RSS is not the high-water mark left by corpus generation or an
+earlier mode. Results are written as JSON so they can be compared across
+releases.
+
+Usage:
+    python ocr_benchmark.py --output bench.json
+    python ocr_benchmark.py --count 50 --bank-pages 10 500 2000 --workers 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from ocr_service import ocr_service
+
+EXTRACTORS = {
+    "form16": "extract_form16",
+    "invoice": "extract_invoice",
+    "bank_statement": "extract_bank_statement",
+    "challan": "extract_challan"
+}
+
+BANKS = ['HDFC', 'ICICI', 'SBI', 'Axis', 'Kotak']
+FIRST_NAMES = ['Ravi', 'Priya', 'Amit', 'Sneha', 'Karan', 'Neha', 'Vikram', 'Anita']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Gupta', 'Nair', 'Joshi', 'Mehta']
+COMPANIES = ['Acme Technologies', 'Zenith Industries', 'Orbit Solutions', 'Lotus Traders']
+
+LINE_HEIGHT = 14
+TOP_MARGIN = 800
+BOTTOM_MARGIN = 40
+
+
+class _PageWriter:
+    """Write lines of text onto A4 pages, breaking pages as needed."""
+
+    def __init__(self, path: Path):
+        self.canvas = canvas.Canvas(str(path), pagesize=A4)
+        self.y = TOP_MARGIN
+        self.pages = 1
+
+    def line(self, text: str = ""):
+        if self.y < BOTTOM_MARGIN:
+            self.new_page()
+        self.canvas.drawString(40, self.y, text)
+        self.y -= LINE_HEIGHT
+
+    def new_page(self):
+        self.canvas.showPage()
+        self.y = TOP_MARGIN
+        self.pages += 1
+
+    def save(self) -> int:
+        self.canvas.save()
+        return self.pages
+
+
+def _pan(rng: random.Random, entity: str = 'P') -> str:
+    letters = ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3))
+    return f"{letters}{entity}{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}{rng.randint(1000, 9999)}{rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')}"
+
+
+def _gstin(rng: random.Random) -> str:
+    return f"{rng.randint(10, 37)}{_pan(rng, 'C')}{rng.randint(1, 9)}Z{rng.randint(1, 9)}"
+
+
+def _name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def generate_form16(path: Path, rng: random.Random, annexure_pages: int = 1) -> Tuple[int, Dict[str, Any]]:
+    """Form 16 with Part A on page 1 and a Part B annexure."""
+    gross_salary = rng.randint(40, 400) * 10000.0
+    total_deductions = rng.randint(5, 25) * 10000.0
+    taxable_income = gross_salary - total_deductions
+    tax_deducted = round(taxable_income * 0.1, 2)
+    quarter_tds = round(tax_deducted / 4, 2)
+    truth = {
+        'employer_name': rng.choice(COMPANIES) + ' Pvt Ltd',
+        'employer_pan': _pan(rng, 'C'),
+        'employee_name': _name(rng),
+        'employee_pan': _pan(rng, 'P'),
+        'financial_year': 'FY 2024-25',
+        'gross_salary': gross_salary,
+        'total_deductions': total_deductions,
+        'taxable_income': taxable_income,
+        'tax_deducted': tax_deducted
+    }
+
+    writer = _PageWriter(path)
+    writer.line("FORM NO. 16 - PART A")
+    writer.line("Certificate under section 203 of the Income-tax Act, 1961")
+    writer.line("Name and address of the Employer")
+    writer.line(truth['employer_name'])
+    writer.line(f"PAN of the Deductor {truth['employer_pan']}")
+    writer.line("Employee Name")
+    writer.line(truth['employee_name'])
+    writer.line(f"PAN of the Employee {truth['employee_pan']}")
+    writer.line(truth['financial_year'])
+    for quarter in range(1, 5):
+        writer.line(f"Q{quarter} {quarter_tds:,.2f}")
+    writer.new_page()
+    writer.line("PART B - Details of Salary Paid")
+    writer.line(f"Gross Salary: {gross_salary:,.2f}")
+    writer.line(f"Total Deductions: {total_deductions:,.2f}")
+    writer.line(f"Taxable Income: {taxable_income:,.2f}")
+    writer.line(f"Tax Deducted: {tax_deducted:,.2f}")
+    for page in range(annexure_pages):
+        writer.new_page()
+        writer.line(f"Annexure to Part B - page {page + 1}")
+        for row in range(50):
+            writer.line(f"Allowance detail {row + 1} exempt under section 10")
+    return writer.save(), truth
+
+
+def generate_invoice(path: Path, rng: random.Random) -> Tuple[int, Dict[str, Any]]:
+    """Single page GST tax invoice."""
+    items = [(f"Service item {i + 1}", rng.randint(1, 10), rng.randint(5, 500) * 100.0) for i in range(rng.randint(2, 8))]
+    subtotal = sum(qty * rate for _, qty, rate in items)
+    cgst = round(subtotal * 0.09, 2)
+    sgst = round(subtotal * 0.09, 2)
+    invoice_date = date(2024, 4, 1) + timedelta(days=rng.randint(0, 364))
+    truth = {
+        'invoice_number': f"INV-{rng.randint(1000, 9999)}",
+        'invoice_date': invoice_date.strftime('%d/%m/%Y'),
+        'vendor_name': rng.choice(COMPANIES),
+        'vendor_gstin': _gstin(rng),
+        'buyer_gstin': _gstin(rng),
+        'subtotal': subtotal,
+        'cgst': cgst,
+        'sgst': sgst,
+        'total_amount': round(subtotal + cgst + sgst, 2)
+    }
+
+    writer = _PageWriter(path)
+    writer.line("TAX INVOICE")
+    writer.line(f"Invoice No: {truth['invoice_number']}")
+    writer.line(f"Date: {truth['invoice_date']}")
+    writer.line("Seller")
+    writer.line(truth['vendor_name'])
+    writer.line(f"GSTIN: {truth['vendor_gstin']}")
+    writer.line(f"Buyer GSTIN: {truth['buyer_gstin']}")
+    writer.line("Description Qty Rate Amount")
+    for description, qty, rate in items:
+        writer.line(f"{description} {qty} {rate:,.2f} {qty * rate:,.2f}")
+    writer.line(f"Subtotal: {subtotal:,.2f}")
+    writer.line(f"CGST: {cgst:,.2f}")
+    writer.line(f"SGST: {sgst:,.2f}")
+    writer.line(f"Grand Total: {truth['total_amount']:,.2f}")
+    return writer.save(), truth
+
+
+def generate_bank_statement(path: Path, rng: random.Random, pages: int = 10) -> Tuple[int, Dict[str, Any]]:
+    """Bank statement spanning the requested number of pages."""
+    rows_per_page = (TOP_MARGIN - BOTTOM_MARGIN) // LINE_HEIGHT
+    transaction_count = max(1, pages * rows_per_page - 6)
+    balance = rng.randint(10, 500) * 1000.0
+    opening_balance = balance
+    start = date(2024, 4, 1)
+    truth = {
+        'bank_name': rng.choice(BANKS),
+        'account_number': str(rng.randint(10 ** 11, 10 ** 12 - 1)),
+        'statement_period': f"{start.strftime('%d/%m/%Y')} to 31/03/2025",
+        'opening_balance': opening_balance
+    }
+
+    writer = _PageWriter(path)
+    writer.line(f"{truth['bank_name']} Bank - Statement of Account")
+    writer.line(f"Account Number: {truth['account_number']}")
+    writer.line(f"Period: {truth['statement_period']}")
+    writer.line(f"Opening Balance: {opening_balance:,.2f}")
+    for i in range(transaction_count):
+        txn_date = start + timedelta(days=i * 365 // transaction_count)
+        amount = rng.randint(1, 500) * 10.0
+        if rng.random() < 0.5:
+            balance += amount
+            marker = 'Cr'
+        else:
+            balance -= amount
+            marker = 'Dr'
+        writer.line(f"{txn_date.strftime('%d/%m/%Y')} NEFT TXN{i:07d} {amount:,.2f} {marker} {balance:,.2f}")
+    writer.line(f"Closing Balance: {balance:,.2f}")
+    truth['closing_balance'] = round(balance, 2)
+    return writer.save(), truth
+
+
+def generate_challan(path: Path, rng: random.Random) -> Tuple[int, Dict[str, Any]]:
+    """Challan 280 payment receipt."""
+    payment_date = date(2024, 6, 15) - timedelta(days=rng.randint(0, 10))
+    truth = {
+        'challan_number': f"{rng.randint(10000, 99999)}",
+        'payment_date': payment_date.strftime('%d/%m/%Y'),
+        'pan': _pan(rng, 'P'),
+        'assessment_year': 'AY 2025-26',
+        'tax_type': 'Advance Tax',
+        'amount_paid': rng.randint(5, 500) * 1000.0,
+        'bank_name': rng.choice(BANKS)
+    }
+
+    writer = _PageWriter(path)
+    writer.line("CHALLAN NO./ITNS 280")
+    writer.line(f"Challan No: {truth['challan_number']}")
+    writer.line(f"Date of Deposit: {truth['payment_date']}")
+    writer.line(f"PAN: {truth['pan']}")
+    writer.line(truth['assessment_year'])
+    writer.line(f"Type of Payment: {truth['tax_type']}")
+    writer.line(f"Amount Paid: {truth['amount_paid']:,.2f}")
+    writer.line(f"Bank: {truth['bank_name']}")
+    return writer.save(), truth
+
+
+def generate_corpus(
+    directory: Path,
+    count: int,
+    bank_pages: List[int],
+    form16_annexure_pages: int,
+    seed: int
+) -> List[Dict[str, Any]]:
+    """Write the synthetic corpus and return its manifest."""
+    rng = random.Random(seed)
+    corpus = []
+
+    def add(document_type: str, name: str, generator, *args):
+        path = directory / name
+        pages, truth = generator(path, rng, *args)
+        corpus.append({'document_type': document_type, 'path': str(path), 'pages': pages, 'truth': truth})
+
+    for i in range(count):
+        add('form16', f"form16_{i}.pdf", generate_form16, form16_annexure_pages)
+        add('invoice', f"invoice_{i}.pdf", generate_invoice)
+        add('challan', f"challan_{i}.pdf", generate_challan)
+    for pages in bank_pages:
+        add('bank_statement', f"bank_statement_{pages}p.pdf", generate_bank_statement, pages)
+    return corpus
+
+
+def _timed_extract(document_type: str, path: str) -> Tuple[Dict[str, Any], float]:
+    """Run one extractor and time it. Module level so it can run in a worker process."""
+    started = time.perf_counter()
+    result = getattr(ocr_service, EXTRACTORS[document_type])(path)
+    return result, time.perf_counter() - started
+
+
+def _fields_match(expected: Any, actual: Any) -> bool:
+    if isinstance(expected, float):
+        return isinstance(actual, (int, float)) and abs(actual - expected) < 0.01
+    return actual is not None and str(actual).strip() == str(expected).strip()
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(who).ru_maxrss / divisor, 2)
+
+
+def run_mode(corpus: List[Dict[str, Any]], mode: str, workers: int) -> Dict[str, Any]:
+    """Extract the whole corpus in one mode and summarize the measurements."""
+    jobs = [(doc['document_type'], doc['path']) for doc in corpus]
+    started = time.perf_counter()
+    if mode == 'parallel':
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            outcomes = list(pool.map(_timed_extract, *zip(*jobs)))
+    else:
+        outcomes = [_timed_extract(document_type, path) for document_type, path in jobs]
+    wall_time = time.perf_counter() - started
+
+    per_extractor: Dict[str, Dict[str, Any]] = {}
+    for doc, (result, seconds) in zip(corpus, outcomes):
+        stats = per_extractor.setdefault(doc['document_type'], {
+            'documents': 0, 'pages': 0, 'failures': 0,
+            'latencies': [], 'fields_total': 0, 'fields_correct': 0, 'field_misses': {}
+        })
+        stats['documents'] += 1
+        stats['pages'] += doc['pages']
+        stats['latencies'].append(seconds)
+        if not result.get('success'):
+            stats['failures'] += 1
+            continue
+        for field, expected in doc['truth'].items():
+            stats['fields_total'] += 1
+            if _fields_match(expected, result['data'].get(field)):
+                stats['fields_correct'] += 1
+            else:
+                stats['field_misses'][field] = stats['field_misses'].get(field, 0) + 1
+
+    extractors = {}
+    for document_type, stats in per_extractor.items():
+        latencies = sorted(stats.pop('latencies'))
+        extractors[document_type] = {
+            **stats,
+            'latency_mean_ms': round(statistics.mean(latencies) * 1000, 2),
+            'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'latency_p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+            'latency_max_ms': round(latencies[-1] * 1000, 2),
+            'pages_per_second': round(stats['pages'] / sum(latencies), 2) if sum(latencies) else None,
+            'field_accuracy': round(stats['fields_correct'] / stats['fields_total'] * 100, 2) if stats['fields_total'] else None
+        }
+
+    total_pages = sum(doc['pages'] for doc in corpus)
+    return {
+        'mode': mode,
+        'workers': workers if mode == 'parallel' else 1,
+        'documents': len(corpus),
+        'pages': total_pages,
+        'wall_time_seconds': round(wall_time, 3),
+        'pages_per_second': round(total_pages / wall_time, 2),
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+        'peak_rss_children_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'extractors': extractors
+    }
+
+
+def run_mode_isolated(manifest: Path, mode: str, workers: int) -> Dict[str, Any]:
+    """run_mode in a child interpreter, so ru_maxrss covers that mode alone."""
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), '--run-mode', mode,
+         '--manifest', str(manifest), '--workers', str(workers)],
+        capture_output=True, text=True, cwd=Path(__file__).parent, check=True
+    )
+    return json.loads(completed.stdout)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def main(argv: List[str] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark ocr_service throughput and accuracy.")
+    parser.add_argument('--count', type=int, default=20, help="Form 16s, invoices and challans per type")
+    parser.add_argument('--bank-pages', type=int, nargs='+', default=[10, 100, 2000],
+                        help="Page counts of the generated bank statements")
+    parser.add_argument('--form16-annexure-pages', type=int, default=2)
+    parser.add_argument('--modes', nargs='+', choices=['serial', 'parallel'], default=['serial', 'parallel'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--corpus-dir', help="Keep the generated corpus in this directory")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    # Internal: measure one mode over a saved manifest (see run_mode_isolated)
+    parser.add_argument('--run-mode', choices=['serial', 'parallel'], help=argparse.SUPPRESS)
+    parser.add_argument('--manifest', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_mode:
+        corpus = json.loads(Path(args.manifest).read_text())
+        result = run_mode(corpus, args.run_mode, args.workers)
+        print(json.dumps(result))
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(args.corpus_dir or tmp)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        started = time.perf_counter()
+        corpus = generate_corpus(directory, args.count, args.bank_pages, args.form16_annexure_pages, args.seed)
+        generation_time = time.perf_counter() - started
+        manifest = directory / 'manifest.json'
+        manifest.write_text(json.dumps(corpus))
+        results = [run_mode_isolated(manifest, mode, args.workers) for mode in args.modes]
+
+        report = {
+            'benchmark': 'ocr_service',
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': {
+                'count': args.count,
+                'bank_pages': args.bank_pages,
+                'form16_annexure_pages': args.form16_annexure_pages,
+                'seed': args.seed
+            },
+            'corpus': {
+                'documents': len(corpus),
+                'pages': sum(doc['pages'] for doc in corpus),
+                'generation_seconds': round(generation_time, 3)
+            },
+            'results': results
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
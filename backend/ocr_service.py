@@ -1,41 +1,68 @@
 import pdfplumber
 import re
+import io
 from typing import Dict, Any, List, Optional
 import logging
 from pathlib import Path
 from datetime import datetime
+from image_ocr_service import image_ocr_service
 
 logger = logging.getLogger(__name__)
 
+PAN_PATTERN = r'\b[A-Z]{5}[0-9]{4}[A-Z]\b'
+
 class OCRService:
     """OCR service for extracting data from documents."""
     
     def __init__(self):
         self.supported_formats = ['.pdf', '.png', '.jpg', '.jpeg']
+        self.image_formats = ['.png', '.jpg', '.jpeg']
+        # Resolution used to render image-only PDF pages for OCR
+        self.ocr_render_resolution = 300
     
-    def extract_form16(self, file_path: str) -> Dict[str, Any]:
-        """Extract data from Form 16 (Salary TDS Certificate)."""
+    def extract_form16(self, file_path: str, lazy: bool = True) -> Dict[str, Any]:
+        """Extract data from Form 16 (Salary TDS Certificate).
+        
+        With lazy=True pages are read one at a time and reading stops once every
+        field has a value and all four quarters of the TDS table were seen;
+        fields still missing fall back to the scanned text.
+        """
         try:
-            text = self._extract_text_from_pdf(file_path)
+            if lazy:
+                # Finders only return values that a full scan could not change
+                text, found, pages_scanned = self._scan_pages(file_path, {
+                    'employer_name': self._extract_employer_name,
+                    'employee_name': self._extract_employee_name,
+                    'financial_year': self._extract_fy,
+                    'gross_salary': lambda t: self._extract_amount(t, 'gross salary'),
+                    'total_deductions': lambda t: self._extract_amount(t, 'total deductions'),
+                    'taxable_income': lambda t: self._extract_amount(t, 'taxable income'),
+                    'tax_deducted': lambda t: self._extract_amount(t, 'tax deducted'),
+                    # Quarter rows are read from all the scanned text; this only holds the exit
+                    'quarters': self._quarters_seen()
+                }, min_pans=2)
+            else:
+                text, found, pages_scanned = self._extract_text(file_path), {}, None
             
             extracted = {
                 'document_type': 'Form 16',
-                'employer_name': self._extract_employer_name(text),
+                'employer_name': self._resolve(found, 'employer_name', self._extract_employer_name, text),
                 'employer_pan': self._extract_pan(text),
-                'employee_name': self._extract_employee_name(text),
+                'employee_name': self._resolve(found, 'employee_name', self._extract_employee_name, text),
                 'employee_pan': self._extract_pan(text, is_employee=True),
-                'financial_year': self._extract_fy(text),
-                'gross_salary': self._extract_amount(text, 'gross salary'),
-                'total_deductions': self._extract_amount(text, 'total deductions'),
-                'taxable_income': self._extract_amount(text, 'taxable income'),
-                'tax_deducted': self._extract_amount(text, 'tax deducted', 'tds'),
+                'financial_year': self._resolve(found, 'financial_year', self._extract_fy, text),
+                'gross_salary': self._resolve(found, 'gross_salary', self._extract_amount, text, 'gross salary'),
+                'total_deductions': self._resolve(found, 'total_deductions', self._extract_amount, text, 'total deductions'),
+                'taxable_income': self._resolve(found, 'taxable_income', self._extract_amount, text, 'taxable income'),
+                'tax_deducted': self._resolve(found, 'tax_deducted', self._extract_amount, text, 'tax deducted', 'tds'),
                 'quarters': self._extract_quarterly_tds(text)
             }
             
             return {
                 'success': True,
                 'data': extracted,
-                'confidence': self._calculate_confidence(extracted)
+                'confidence': self._calculate_confidence(extracted),
+                'pages_scanned': pages_scanned
             }
         except Exception as e:
             logger.error(f"Error extracting Form 16: {str(e)}")
@@ -44,7 +71,7 @@ class OCRService:
     def extract_invoice(self, file_path: str) -> Dict[str, Any]:
         """Extract data from invoice/bill."""
         try:
-            text = self._extract_text_from_pdf(file_path)
+            text = self._extract_text(file_path)
             
             extracted = {
                 'document_type': 'Invoice',
@@ -74,7 +101,7 @@ class OCRService:
     def extract_bank_statement(self, file_path: str) -> Dict[str, Any]:
         """Extract transactions from bank statement."""
         try:
-            text = self._extract_text_from_pdf(file_path)
+            text = self._extract_text(file_path)
             
             extracted = {
                 'document_type': 'Bank Statement',
@@ -95,46 +122,156 @@ class OCRService:
             logger.error(f"Error extracting bank statement: {str(e)}")
             return {'success': False, 'error': str(e)}
     
-    def extract_challan(self, file_path: str) -> Dict[str, Any]:
-        """Extract data from tax payment challan."""
+    def extract_challan(self, file_path: str, lazy: bool = True) -> Dict[str, Any]:
+        """Extract data from tax payment challan.
+        
+        With lazy=True reading stops at the first page on which every field is found.
+        """
         try:
-            text = self._extract_text_from_pdf(file_path)
+            if lazy:
+                text, found, pages_scanned = self._scan_pages(file_path, {
+                    'challan_number': self._extract_challan_number,
+                    'payment_date': lambda t: self._extract_date(t, strict=True),
+                    'assessment_year': self._extract_ay,
+                    'tax_type': lambda t: self._extract_tax_type(t, strict=True),
+                    'amount_paid': lambda t: self._extract_amount(t, 'amount'),
+                    'bank_name': lambda t: self._extract_bank_name(t, strict=True)
+                }, min_pans=1)
+            else:
+                text, found, pages_scanned = self._extract_text(file_path), {}, None
             
             extracted = {
                 'document_type': 'Challan',
-                'challan_number': self._extract_challan_number(text),
-                'payment_date': self._extract_date(text),
+                'challan_number': self._resolve(found, 'challan_number', self._extract_challan_number, text),
+                'payment_date': self._resolve(found, 'payment_date', self._extract_date, text),
                 'pan': self._extract_pan(text),
-                'assessment_year': self._extract_ay(text),
-                'tax_type': self._extract_tax_type(text),
-                'amount_paid': self._extract_amount(text, 'amount', 'paid'),
-                'bank_name': self._extract_bank_name(text)
+                'assessment_year': self._resolve(found, 'assessment_year', self._extract_ay, text),
+                'tax_type': self._resolve(found, 'tax_type', self._extract_tax_type, text),
+                'amount_paid': self._resolve(found, 'amount_paid', self._extract_amount, text, 'amount', 'paid'),
+                'bank_name': self._resolve(found, 'bank_name', self._extract_bank_name, text)
             }
             
             return {
                 'success': True,
                 'data': extracted,
-                'confidence': self._calculate_confidence(extracted)
+                'confidence': self._calculate_confidence(extracted),
+                'pages_scanned': pages_scanned
             }
         except Exception as e:
             logger.error(f"Error extracting challan: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    def extract_text(self, file_path: str) -> str:
+        """Extract the full text of a supported document."""
+        return self._extract_text(file_path)
+    
+    def extract_text_from_bytes(self, content: bytes, filename: str) -> str:
+        """Extract text from an in-memory upload.
+
+        Unsupported formats, and files that cannot be read (no Tesseract for
+        images, corrupt or encrypted PDFs), give empty text.
+        """
+        suffix = Path(filename).suffix.lower()
+        try:
+            if suffix in self.image_formats:
+                return image_ocr_service.ocr_image(content)
+            if suffix == '.pdf':
+                return self._extract_text_from_pdf(io.BytesIO(content))
+        except Exception as e:
+            logger.warning(f"Could not extract text from {filename}: {str(e)}")
+        return ""
+    
     # Helper methods
-    def _extract_text_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF using pdfplumber."""
-        text = ""
+    def _extract_text(self, file_path: str) -> str:
+        """Extract text from a PDF or a scanned image."""
+        if Path(file_path).suffix.lower() in self.image_formats:
+            return image_ocr_service.ocr_image(Path(file_path).read_bytes())
+        return self._extract_text_from_pdf(file_path)
+    
+    def _extract_text_from_pdf(self, source) -> str:
+        """Extract text from a PDF path or file object, running OCR only on pages without a text layer."""
+        page_texts = []
+        scanned_pages = {}
+        with pdfplumber.open(source) as pdf:
+            for index, page in enumerate(pdf.pages):
+                page_text = page.extract_text()
+                if page_text and page_text.strip():
+                    page_texts.append(page_text)
+                else:
+                    page_texts.append("")
+                    scanned_pages[index] = self._render_page(page)
+        
+        if scanned_pages:
+            if image_ocr_service.available:
+                ocr_texts = image_ocr_service.ocr_images(list(scanned_pages.values()))
+                for index, page_text in zip(scanned_pages, ocr_texts):
+                    page_texts[index] = page_text
+            else:
+                logger.warning(f"Skipping OCR for {len(scanned_pages)} image-only page(s) - tesseract not installed")
+        
+        return "".join(page_text + "\n" for page_text in page_texts if page_text)
+    
+    def _iter_page_texts(self, file_path: str):
+        """Yield the text of each page, running OCR only on pages without a text layer."""
+        if Path(file_path).suffix.lower() in self.image_formats:
+            yield image_ocr_service.ocr_image(Path(file_path).read_bytes())
+            return
+        
         with pdfplumber.open(file_path) as pdf:
             for page in pdf.pages:
                 page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        return text
+                if page_text and page_text.strip():
+                    yield page_text
+                elif image_ocr_service.available:
+                    yield image_ocr_service.ocr_image(self._render_page(page))
+                else:
+                    yield ""
+    
+    def _scan_pages(self, file_path: str, finders: Dict[str, Any], min_pans: int = 0):
+        """Read pages until every finder has returned a value and enough PANs were seen.
+        
+        Finders see the current page prefixed with the last line of the previous
+        page, so values split across a page break are still found. Returns the
+        scanned text, the values found and the number of pages read.
+        """
+        found = {}
+        page_texts = []
+        pan_count = 0
+        tail = ""
+        for page_text in self._iter_page_texts(file_path):
+            if not page_text:
+                continue
+            page_texts.append(page_text)
+            pan_count += len(re.findall(PAN_PATTERN, page_text))
+            window = f"{tail}\n{page_text}" if tail else page_text
+            for field, finder in finders.items():
+                if field not in found:
+                    value = finder(window)
+                    if value is not None:
+                        found[field] = value
+            if len(found) == len(finders) and pan_count >= min_pans:
+                break
+            tail = page_text.rsplit("\n", 1)[-1]
+        
+        text = "".join(page_text + "\n" for page_text in page_texts)
+        return text, found, len(page_texts)
+    
+    def _resolve(self, found: Dict[str, Any], field: str, extractor, text: str, *args):
+        """Use the value found while scanning, else run the extractor on the scanned text."""
+        if field in found:
+            return found[field]
+        return extractor(text, *args)
+    
+    def _render_page(self, page) -> bytes:
+        """Render a PDF page to PNG bytes for OCR."""
+        image = page.to_image(resolution=self.ocr_render_resolution).original
+        output = io.BytesIO()
+        image.save(output, format='PNG')
+        return output.getvalue()
     
     def _extract_pan(self, text: str, is_employee: bool = False) -> Optional[str]:
         """Extract PAN number."""
-        pan_pattern = r'\b[A-Z]{5}[0-9]{4}[A-Z]\b'
-        matches = re.findall(pan_pattern, text)
+        matches = re.findall(PAN_PATTERN, text)
         if matches:
             # If multiple PANs, second one is usually employee's in Form 16
             return matches[1] if is_employee and len(matches) > 1 else matches[0]
@@ -159,14 +296,14 @@ class OCRService:
                     continue
         return None
     
-    def _extract_date(self, text: str) -> Optional[str]:
-        """Extract date in various formats."""
+    def _extract_date(self, text: str, strict: bool = False) -> Optional[str]:
+        """Extract date in various formats. strict only tries the preferred format."""
         date_patterns = [
             r'\b\d{2}[/-]\d{2}[/-]\d{4}\b',  # DD/MM/YYYY or DD-MM-YYYY
             r'\b\d{4}[/-]\d{2}[/-]\d{2}\b',  # YYYY-MM-DD
             r'\b\d{2}\s+[A-Za-z]{3}\s+\d{4}\b'  # DD Mon YYYY
         ]
-        for pattern in date_patterns:
+        for pattern in date_patterns[:1] if strict else date_patterns:
             match = re.search(pattern, text)
             if match:
                 return match.group(0)
@@ -200,6 +337,15 @@ class OCRService:
         match = re.search(ay_pattern, text, re.IGNORECASE)
         return match.group(0) if match else None
     
+    def _quarters_seen(self):
+        """Finder that is satisfied once rows for Q1 to Q4 have appeared, across pages."""
+        seen = set()
+        
+        def finder(text: str) -> Optional[bool]:
+            seen.update(quarter['quarter'] for quarter in self._extract_quarterly_tds(text))
+            return True if seen >= {'Q1', 'Q2', 'Q3', 'Q4'} else None
+        return finder
+    
     def _extract_quarterly_tds(self, text: str) -> List[Dict[str, Any]]:
         """Extract quarterly TDS breakdown from Form 16."""
         quarters = []
@@ -273,10 +419,10 @@ class OCRService:
         # Filter out numbers that are too large or small to be HSN
         return [m for m in matches if 1000 <= int(m) <= 99999999]
     
-    def _extract_bank_name(self, text: str) -> Optional[str]:
-        """Extract bank name."""
+    def _extract_bank_name(self, text: str, strict: bool = False) -> Optional[str]:
+        """Extract bank name. strict only looks for the highest-priority bank."""
         banks = ['HDFC', 'ICICI', 'SBI', 'Axis', 'Kotak', 'IDBI', 'PNB', 'Bank of Baroda', 'Canara']
-        for bank in banks:
+        for bank in banks[:1] if strict else banks:
             if bank.lower() in text.lower():
                 return bank
         return None
@@ -322,11 +468,11 @@ class OCRService:
         match = re.search(pattern, text, re.IGNORECASE)
         return match.group(1) if match else None
     
-    def _extract_tax_type(self, text: str) -> Optional[str]:
-        """Extract tax type from challan."""
+    def _extract_tax_type(self, text: str, strict: bool = False) -> Optional[str]:
+        """Extract tax type from challan. strict only looks for the highest-priority type."""
         tax_types = ['advance tax', 'self assessment', 'tds', 'tcs', 'regular assessment']
         text_lower = text.lower()
-        for tax_type in tax_types:
+        for tax_type in tax_types[:1] if strict else tax_types:
             if tax_type in text_lower:
                 return tax_type.title()
         return None
@@ -7,6 +7,7 @@ from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_RIGHT
 from io import BytesIO
 from datetime import datetime
 import logging
+from money import to_paise, format_inr
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,13 @@ class PDFService:
             spaceAfter=12
         )
     
+    def _format_amount(self, data: dict, field: str) -> str:
+        """Format a money field, preferring its exact paise value when stored."""
+        paise = data.get(f'{field}_paise')
+        if paise is None:
+            paise = to_paise(data.get(field) or 0)
+        return format_inr(paise)
+    
     def generate_invoice_pdf(self, invoice_data: dict) -> bytes:
         """Generate PDF invoice."""
         try:
@@ -81,8 +89,8 @@ class PDFService:
                 items_data.append([
                     item.get('description', ''),
                     str(item.get('quantity', 0)),
-                    f"₹{item.get('rate', 0):,.2f}",
-                    f"₹{item.get('amount', 0):,.2f}"
+                    self._format_amount(item, 'rate'),
+                    self._format_amount(item, 'amount')
                 ])
             
             items_table = Table(items_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
@@ -108,9 +116,9 @@ class PDFService:
             
             # Totals
             totals_data = [
-                ['Subtotal:', f"₹{invoice_data.get('subtotal', 0):,.2f}"],
-                ['Tax (18%):', f"₹{invoice_data.get('tax', 0):,.2f}"],
-                ['Total:', f"₹{invoice_data.get('total', 0):,.2f}"]
+                ['Subtotal:', self._format_amount(invoice_data, 'subtotal')],
+                ['Tax (18%):', self._format_amount(invoice_data, 'tax')],
+                ['Total:', self._format_amount(invoice_data, 'total')]
             ]
             
             totals_table = Table(totals_data, colWidths=[5*inch, 2*inch])
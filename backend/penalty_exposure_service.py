@@ -0,0 +1,281 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne, DeleteMany, ReturnDocument
+
+from ca_workflow_service import LATE_FEES, ASSUMED_LIABILITY
+from money import to_paise_array, from_paise, rate_to_ppm, prorate_array, RATE_SCALE
+
+logger = logging.getLogger(__name__)
+
+# Tasks read from the cursor and computed per chunk
+EXPOSURE_CHUNK_SIZE = 10000
+OPEN_STATUSES = ["PENDING", "IN_PROGRESS", "OVERDUE"]
+UNASSIGNED = "unassigned"
+AMOUNT_FIELDS = ["late_fee_paise", "interest_paise", "total_paise"]
+
+
+def _fee_column(task_types: np.ndarray, field: str, default=0) -> np.ndarray:
+    """Per-row value of a LATE_FEES field, looked up once per distinct task type."""
+    codes, uniques = pd.factorize(pd.Series(task_types), use_na_sentinel=False)
+    values = np.array([LATE_FEES.get(task_type, {}).get(field, default) for task_type in uniques], dtype=np.float64)
+    return values[codes]
+
+
+def task_liability(task: Dict[str, Any]) -> Optional[float]:
+    """Tax liability recorded on a task, from tax_liability or its challan."""
+    if task.get("tax_liability") is not None:
+        return task["tax_liability"]
+    challan = task.get("challan_details") or {}
+    return challan.get("amount_paid") or challan.get("amount")
+
+
+class PenaltyExposureService:
+    """Late fee and interest across all overdue tasks, with client and staff totals.
+
+    A full refresh streams every open overdue task and computes penalties in
+    numpy chunks, element-wise identical to calculate_late_fee. Per-task
+    exposures are kept in penalty_exposures and totals in penalty_rollups;
+    when a single task changes, refresh_task applies only the difference to
+    its client's and staff member's totals with $inc.
+    """
+
+    async def ensure_indexes(self, db):
+        """Create indexes for exposure and rollup lookups."""
+        await db.penalty_exposures.create_index("task_id", unique=True)
+        await db.penalty_exposures.create_index("client_id")
+        await db.penalty_exposures.create_index("run_id")
+        await db.penalty_rollups.create_index([("scope", 1), ("key", 1)], unique=True)
+        await db.penalty_rollups.create_index([("scope", 1), ("total_paise", -1)])
+
+    def compute(self, tasks: List[Dict[str, Any]], as_of: datetime) -> pd.DataFrame:
+        """Penalty of each task as of a time, in paise."""
+        task_types = np.array([task.get("task_type") for task in tasks], dtype=object)
+        due = pd.to_datetime([task["due_date"] for task in tasks], utc=True, format="ISO8601")
+        as_of = pd.Timestamp(as_of)
+        elapsed = (as_of.tz_localize("UTC") if as_of.tzinfo is None else as_of) - due
+        overdue = np.asarray(elapsed > pd.Timedelta(0))
+        days = np.where(overdue, np.asarray(elapsed // pd.Timedelta(days=1)), 0).astype(np.int64)
+
+        daily_fee = _fee_column(task_types, "daily_fee", np.nan)
+        max_fee = _fee_column(task_types, "max_fee", np.inf)
+        flat_fee = _fee_column(task_types, "flat_fee", 0)
+        flat_fee_after_year = _fee_column(task_types, "flat_fee_after_year", np.nan)
+        flat_fee = np.where((days > 365) & ~np.isnan(flat_fee_after_year), flat_fee_after_year, flat_fee)
+        # Daily fees and caps are whole rupees
+        daily = np.minimum(days * np.nan_to_num(daily_fee), max_fee)
+        late_fee = to_paise_array(np.where(np.isnan(daily_fee), flat_fee, daily).astype(np.int64))
+
+        liabilities = [task_liability(task) for task in tasks]
+        liability_known = np.array([liability is not None for liability in liabilities])
+        liability = to_paise_array(np.array(
+            [ASSUMED_LIABILITY if liability is None else liability for liability in liabilities], dtype=np.float64
+        ))
+        rate_ppm = np.array([rate_to_ppm(rate) for rate in _fee_column(task_types, "interest_rate", 0)], dtype=np.int64)
+        interest = prorate_array(liability * rate_ppm, days, 365 * RATE_SCALE)
+
+        late_fee = np.where(overdue, late_fee, 0)
+        interest = np.where(overdue, interest, 0)
+        return pd.DataFrame({
+            "task_id": [task["id"] for task in tasks],
+            "client_id": [task.get("client_id") for task in tasks],
+            "client_name": [task.get("client_name") for task in tasks],
+            "assigned_to": [task.get("assigned_to") or UNASSIGNED for task in tasks],
+            "task_type": task_types,
+            "overdue": overdue,
+            "days_overdue": days,
+            "liability_paise": liability,
+            "liability_known": liability_known,
+            "late_fee_paise": late_fee,
+            "interest_paise": interest,
+            "total_paise": late_fee + interest
+        })
+
+    def _exposure_docs(self, table: pd.DataFrame, run_id: str, computed_at: str) -> List[Dict[str, Any]]:
+        rows = table[table["overdue"]].drop(columns="overdue")
+        docs = rows.to_dict("records")
+        for doc in docs:
+            for field in ("days_overdue", "liability_paise", *AMOUNT_FIELDS):
+                doc[field] = int(doc[field])
+            doc["liability_known"] = bool(doc["liability_known"])
+            doc["run_id"] = run_id
+            doc["computed_at"] = computed_at
+        return docs
+
+    async def refresh_all(self, db, as_of: Optional[datetime] = None) -> Dict[str, Any]:
+        """Recompute every overdue task's exposure and rebuild the client and staff totals."""
+        try:
+            as_of = as_of or datetime.now(timezone.utc)
+            run_id = str(uuid.uuid4())
+            computed_at = datetime.now(timezone.utc).isoformat()
+            totals = {"client": {}, "staff": {}}
+            tasks_evaluated = 0
+
+            cursor = db.tasks.find(
+                {"status": {"$in": OPEN_STATUSES}, "due_date": {"$lt": as_of.isoformat()}},
+                {"_id": 0, "id": 1, "client_id": 1, "client_name": 1, "assigned_to": 1, "task_type": 1,
+                 "due_date": 1, "tax_liability": 1, "challan_details": 1}
+            ).batch_size(EXPOSURE_CHUNK_SIZE)
+
+            async def flush(chunk):
+                table = self.compute(chunk, as_of)
+                docs = self._exposure_docs(table, run_id, computed_at)
+                if docs:
+                    await db.penalty_exposures.bulk_write([
+                        UpdateOne({"task_id": doc["task_id"]}, {"$set": doc}, upsert=True) for doc in docs
+                    ], ordered=False)
+                overdue = table[table["overdue"]]
+                for scope, column in (("client", "client_id"), ("staff", "assigned_to")):
+                    grouped = overdue.groupby(column)[AMOUNT_FIELDS].sum()
+                    counts = overdue.groupby(column).size()
+                    for key, row in grouped.iterrows():
+                        total = totals[scope].setdefault(key, {field: 0 for field in AMOUNT_FIELDS + ["tasks"]})
+                        for field in AMOUNT_FIELDS:
+                            total[field] += int(row[field])
+                        total["tasks"] += int(counts[key])
+
+            chunk = []
+            async for task in cursor:
+                chunk.append(task)
+                if len(chunk) >= EXPOSURE_CHUNK_SIZE:
+                    await flush(chunk)
+                    tasks_evaluated += len(chunk)
+                    chunk = []
+            if chunk:
+                await flush(chunk)
+                tasks_evaluated += len(chunk)
+
+            # Exposures and totals not written by this run belong to tasks no longer overdue
+            await db.penalty_exposures.delete_many({"run_id": {"$ne": run_id}})
+            rollups = [
+                UpdateOne(
+                    {"scope": scope, "key": key},
+                    {"$set": {**total, "run_id": run_id, "updated_at": computed_at}},
+                    upsert=True
+                )
+                for scope, keyed in totals.items() for key, total in keyed.items()
+            ]
+            if rollups:
+                await db.penalty_rollups.bulk_write(rollups, ordered=False)
+            await db.penalty_rollups.delete_many({"run_id": {"$ne": run_id}})
+
+            client_totals = totals["client"].values()
+            logger.info(f"Penalty exposure refreshed for {tasks_evaluated} overdue tasks")
+            return {
+                "success": True,
+                "tasks_evaluated": tasks_evaluated,
+                "clients": len(totals["client"]),
+                "total_exposure": from_paise(sum(total["total_paise"] for total in client_totals)),
+                "as_of": as_of.isoformat()
+            }
+        except Exception as e:
+            logger.error(f"Error refreshing penalty exposure: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def refresh_task(self, db, task_id: str, as_of: Optional[datetime] = None):
+        """Bring one task's exposure up to date and move the difference into the totals."""
+        try:
+            as_of = as_of or datetime.now(timezone.utc)
+            task = await db.tasks.find_one({"id": task_id}, {"_id": 0})
+            current = None
+            if task and task.get("status") in OPEN_STATUSES:
+                table = self.compute([task], as_of)
+                docs = self._exposure_docs(table, None, datetime.now(timezone.utc).isoformat())
+                current = docs[0] if docs else None
+
+            if current:
+                # run_id stays as the last full refresh wrote it
+                current.pop("run_id")
+                previous = await db.penalty_exposures.find_one_and_update(
+                    {"task_id": task_id}, {"$set": current}, upsert=True,
+                    return_document=ReturnDocument.BEFORE, projection={"_id": 0}
+                )
+            else:
+                previous = await db.penalty_exposures.find_one_and_delete({"task_id": task_id}, projection={"_id": 0})
+
+            await self._move_totals(db, [(previous, current)])
+        except Exception as e:
+            logger.error(f"Error refreshing penalty exposure for task {task_id}: {str(e)}")
+
+    async def refresh_tasks(self, db, task_ids: List[str], as_of: Optional[datetime] = None):
+        """refresh_task for a batch of tasks, e.g. after a bulk insert, in one pass."""
+        if not task_ids:
+            return
+        try:
+            as_of = as_of or datetime.now(timezone.utc)
+            tasks = await db.tasks.find(
+                {"id": {"$in": task_ids}, "status": {"$in": OPEN_STATUSES}}, {"_id": 0}
+            ).to_list(None)
+            current = {}
+            if tasks:
+                table = self.compute(tasks, as_of)
+                for doc in self._exposure_docs(table, None, datetime.now(timezone.utc).isoformat()):
+                    doc.pop("run_id")
+                    current[doc["task_id"]] = doc
+            previous = {
+                exposure["task_id"]: exposure
+                async for exposure in db.penalty_exposures.find({"task_id": {"$in": task_ids}}, {"_id": 0})
+            }
+
+            writes = [UpdateOne({"task_id": task_id}, {"$set": doc}, upsert=True) for task_id, doc in current.items()]
+            stale = [task_id for task_id in previous if task_id not in current]
+            if stale:
+                writes.append(DeleteMany({"task_id": {"$in": stale}}))
+            if writes:
+                await db.penalty_exposures.bulk_write(writes, ordered=False)
+            await self._move_totals(db, [
+                (previous.get(task_id), current.get(task_id)) for task_id in set(previous) | set(current)
+            ])
+        except Exception as e:
+            logger.error(f"Error refreshing penalty exposure for {len(task_ids)} tasks: {str(e)}")
+
+    async def _move_totals(self, db, changed: List[tuple]):
+        """Apply (previous, current) exposure pairs to the client and staff totals as $inc deltas."""
+        changes = {}
+        for previous, current in changed:
+            for exposure, sign in ((previous, -1), (current, 1)):
+                if not exposure:
+                    continue
+                for scope, key in (("client", exposure["client_id"]), ("staff", exposure["assigned_to"])):
+                    delta = changes.setdefault((scope, key), {field: 0 for field in AMOUNT_FIELDS + ["tasks"]})
+                    for field in AMOUNT_FIELDS:
+                        delta[field] += sign * exposure[field]
+                    delta["tasks"] += sign
+        updates = [
+            UpdateOne(
+                {"scope": scope, "key": key},
+                {"$inc": delta, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True
+            )
+            for (scope, key), delta in changes.items() if any(delta.values())
+        ]
+        if updates:
+            await db.penalty_rollups.bulk_write(updates, ordered=False)
+
+    async def get_rollups(self, db, scope: str = "client", limit: int = 100) -> List[Dict[str, Any]]:
+        """Largest exposures by client or staff member."""
+        rollups = await db.penalty_rollups.find(
+            {"scope": scope, "tasks": {"$gt": 0}}, {"_id": 0, "run_id": 0}
+        ).sort("total_paise", -1).to_list(limit)
+        for rollup in rollups:
+            for field in AMOUNT_FIELDS:
+                rollup[field.replace("_paise", "")] = from_paise(rollup.pop(field))
+        return rollups
+
+    async def get_task_exposures(self, db, client_id: Optional[str] = None, limit: int = 500) -> List[Dict[str, Any]]:
+        """Per-task exposures, largest first."""
+        query = {"client_id": client_id} if client_id else {}
+        exposures = await db.penalty_exposures.find(
+            query, {"_id": 0, "run_id": 0}
+        ).sort("total_paise", -1).to_list(limit)
+        for exposure in exposures:
+            for field in ("liability_paise", *AMOUNT_FIELDS):
+                exposure[field.replace("_paise", "")] = from_paise(exposure.pop(field))
+        return exposures
+
+# Global penalty exposure service
+penalty_exposure_service = PenaltyExposureService()
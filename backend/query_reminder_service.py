@@ -0,0 +1,190 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional
+
+from pymongo import UpdateOne
+
+from ca_workflow_models import QueryStatus
+from ca_workflow_service import QUERY_REMINDER_DAYS
+from email_service import email_service
+
+logger = logging.getLogger(__name__)
+
+# Queries reminded per batch
+REMINDER_BATCH_SIZE = 500
+# Emails in flight at once and sent per second, as for deadline reminders
+REMINDER_CONCURRENCY = int(os.environ.get('REMINDER_CONCURRENCY', 4))
+REMINDER_RATE_PER_SECOND = float(os.environ.get('REMINDER_RATE_PER_SECOND', 2))
+# A query is never reminded twice within this gap, even when catching up
+MIN_REMINDER_GAP = timedelta(days=1)
+# Lower bounds of the days-pending buckets of the query list
+AGING_BOUNDARIES = [0, 3, 7, 14, 30]
+MS_PER_DAY = 86400000
+OPEN_STATUSES = [QueryStatus.OPEN.value, QueryStatus.PENDING_CLIENT.value]
+
+
+def _parse(value) -> datetime:
+    parsed = datetime.fromisoformat(value) if isinstance(value, str) else value
+    # Queries raised before timestamps were zone-aware are taken as UTC
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def reminder_schedule(raised_at, reminders_sent: int, status: str, not_before: Optional[datetime] = None) -> Dict[str, Any]:
+    """raised_at_ms and next_reminder_at of a query.
+
+    next_reminder_at is the moment should_send_query_reminder first turns
+    true, or None once every reminder is sent or the query is answered.
+    """
+    raised_at = _parse(raised_at)
+    fields = {"raised_at_ms": int(raised_at.timestamp() * 1000), "next_reminder_at": None}
+    if status in OPEN_STATUSES and reminders_sent < len(QUERY_REMINDER_DAYS):
+        due = raised_at + timedelta(days=QUERY_REMINDER_DAYS[reminders_sent])
+        if not_before and due < not_before:
+            due = not_before
+        fields["next_reminder_at"] = due.astimezone(timezone.utc).isoformat()
+    return fields
+
+
+class QueryReminderService:
+    """Follow-up reminders for unanswered queries, and query aging.
+
+    Each open query carries next_reminder_at, so a run picks up exactly the
+    queries due with one range scan on its index, sends their reminders a
+    batch at a time off the event loop, rate-limited through
+    email_service.send_many, and advances the counters with one bulk_write
+    per batch. Aging in the query list is computed by Mongo from raised_at_ms.
+    """
+
+    async def ensure_indexes(self, db):
+        """Create indexes for the reminder scan and query list filters."""
+        await db.queries.create_index("next_reminder_at")
+        await db.queries.create_index("client_id")
+        await db.queries.create_index("task_id")
+        await db.queries.create_index([("status", 1), ("raised_at_ms", 1)])
+
+    async def backfill(self, db) -> int:
+        """Add the schedule fields to queries raised before they existed."""
+        cursor = db.queries.find(
+            {"raised_at_ms": {"$exists": False}},
+            {"_id": 0, "id": 1, "raised_at": 1, "reminders_sent": 1, "status": 1}
+        )
+        updates = []
+        async for query in cursor:
+            fields = reminder_schedule(query["raised_at"], query.get("reminders_sent", 0), query.get("status"))
+            updates.append(UpdateOne({"id": query["id"]}, {"$set": fields}))
+        if updates:
+            await db.queries.bulk_write(updates, ordered=False)
+            logger.info(f"Added reminder schedule to {len(updates)} queries")
+        return len(updates)
+
+    async def send_due_reminders(self, db, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Send every reminder that is due and schedule the next one."""
+        try:
+            now = now or datetime.now(timezone.utc)
+            sent = 0
+            failed = 0
+            while True:
+                queries = await db.queries.find(
+                    # Queries closed by any other path than respond_to_query still carry a schedule
+                    {"next_reminder_at": {"$lte": now.isoformat()}, "status": {"$in": OPEN_STATUSES}},
+                    {"_id": 0, "id": 1, "client_id": 1, "client_name": 1, "query_text": 1,
+                     "raised_at": 1, "reminders_sent": 1, "status": 1}
+                ).sort("next_reminder_at", 1).to_list(REMINDER_BATCH_SIZE)
+                if not queries:
+                    break
+
+                clients = await db.clients.find(
+                    {"id": {"$in": list({query["client_id"] for query in queries})}},
+                    {"_id": 0, "id": 1, "name": 1, "email": 1}
+                ).to_list(None)
+                clients = {client["id"]: client for client in clients}
+
+                messages = {}
+                for query in queries:
+                    client = clients.get(query["client_id"]) or {}
+                    if client.get("email"):
+                        messages[query["id"]] = email_service.query_reminder_message(
+                            to=client["email"],
+                            client_name=client.get("name") or query.get("client_name"),
+                            query_text=query["query_text"],
+                            days_pending=(now - _parse(query["raised_at"])).days,
+                            reminder_number=query.get("reminders_sent", 0) + 1
+                        )
+                delivered = await email_service.send_many(
+                    list(messages.values()),
+                    concurrency=REMINDER_CONCURRENCY,
+                    rate_per_second=REMINDER_RATE_PER_SECOND
+                )
+                results = dict(zip(messages, delivered))
+
+                updates = []
+                for query in queries:
+                    reminders_sent = query.get("reminders_sent", 0)
+                    result = results.get(query["id"]) or {"success": False, "error": "Client has no email"}
+
+                    if result.get("success"):
+                        sent += 1
+                        fields = reminder_schedule(
+                            query["raised_at"], reminders_sent + 1, query["status"], not_before=now + MIN_REMINDER_GAP
+                        )
+                        change = {"$inc": {"reminders_sent": 1},
+                                  "$set": {"last_reminder_at": now.isoformat(), **fields}}
+                    else:
+                        # Retried on tomorrow's run
+                        failed += 1
+                        change = {"$set": {"next_reminder_at": (now + MIN_REMINDER_GAP).isoformat(),
+                                           "last_reminder_error": result.get("error")}}
+                    # The reminders_sent guard keeps an overlapping run from advancing twice
+                    updates.append(UpdateOne({"id": query["id"], "reminders_sent": query.get("reminders_sent")}, change))
+
+                await db.queries.bulk_write(updates, ordered=False)
+
+            logger.info(f"Query reminders: {sent} sent, {failed} failed")
+            return {"success": True, "sent": sent, "failed": failed}
+        except Exception as e:
+            logger.error(f"Error sending query reminders: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def list_with_aging(self, db, query_filter: Dict[str, Any], limit: int = 1000) -> Dict[str, Any]:
+        """Queries matching a filter with days pending, plus counts per aging bucket."""
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        days_pending = {"$floor": {"$divide": [{"$subtract": [now_ms, "$raised_at_ms"]}, MS_PER_DAY]}}
+        result = await db.queries.aggregate([
+            {"$match": query_filter},
+            {"$addFields": {"days_pending": days_pending}},
+            {"$facet": {
+                "queries": [
+                    {"$sort": {"raised_at_ms": 1}},
+                    {"$limit": limit},
+                    {"$project": {"_id": 0, "raised_at_ms": 0}}
+                ],
+                "aging": [
+                    {"$match": {"status": {"$in": OPEN_STATUSES}}},
+                    {"$bucket": {
+                        "groupBy": "$days_pending",
+                        "boundaries": AGING_BOUNDARIES,
+                        "default": f"{AGING_BOUNDARIES[-1]}+",
+                        "output": {"count": {"$sum": 1}}
+                    }}
+                ],
+                "total": [{"$count": "count"}]
+            }}
+        ]).to_list(None)
+        facets = result[0]
+
+        labels = {
+            low: f"{low}-{high - 1}" for low, high in zip(AGING_BOUNDARIES, AGING_BOUNDARIES[1:])
+        }
+        aging = {label: 0 for label in labels.values()}
+        aging[f"{AGING_BOUNDARIES[-1]}+"] = 0
+        for bucket in facets["aging"]:
+            aging[labels.get(bucket["_id"], bucket["_id"])] = bucket["count"]
+        return {
+            "queries": facets["queries"],
+            "total": facets["total"][0]["count"] if facets["total"] else 0,
+            "open_aging": aging
+        }
+
+# Global query reminder service
+query_reminder_service = QueryReminderService()
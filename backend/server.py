@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Response, BackgroundTasks
 from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -8,9 +8,11 @@ import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+import asyncio
+import zipfile
+from datetime import datetime, date, timedelta, timezone
 from enum import Enum
 
 # Import production services
@@ -22,8 +24,27 @@ from pdf_service import pdf_service
 from automation_service import automation_service
 from bulk_import_service import bulk_import_service
 from document_intelligence import document_intelligence
+from document_classifier import document_classifier
+from document_text_service import document_text_service
+from duplicate_detection_service import duplicate_detection_service
 from template_service import template_service
 from ca_workflow_service import ca_workflow_service
+from batch_extraction_service import batch_extraction_service
+from image_ocr_service import image_ocr_service
+from ocr_service import ocr_service
+from tax_executor import tax_executor
+from tax_rule_registry import normalize_financial_year, fy_code_start_year
+from capital_gains_engine import capital_gains_engine
+from gst_register_engine import gst_register_engine
+from tds_ledger_service import tds_ledger_service
+from advance_tax_service import advance_tax_service
+from penalty_exposure_service import penalty_exposure_service
+from compliance_calendar_service import compliance_calendar_service
+from identifier_validator import identifier_validator
+from wip_stage_service import wip_stage_service
+from query_reminder_service import query_reminder_service, reminder_schedule
+from depreciation_ledger_service import depreciation_ledger_service
+from money import to_paise, from_paise
 from ca_workflow_models import (
     BusinessType, WIPStage, QueryStatus,
     ClientExtended, TaskExtended, Query, QueryCreate, QueryResponse
@@ -88,6 +109,10 @@ class Client(BaseModel):
     gstin: Optional[str] = None
     pan: Optional[str] = None
     address: Optional[str] = None
+    business_type: Optional[BusinessType] = None
+    turnover: Optional[float] = None
+    tan: Optional[str] = None
+    cin: Optional[str] = None
     status: ClientStatus = ClientStatus.ACTIVE
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -98,6 +123,10 @@ class ClientCreate(BaseModel):
     gstin: Optional[str] = None
     pan: Optional[str] = None
     address: Optional[str] = None
+    business_type: Optional[BusinessType] = None
+    turnover: Optional[float] = None
+    tan: Optional[str] = None
+    cin: Optional[str] = None
     status: Optional[ClientStatus] = ClientStatus.ACTIVE
 
 class Task(BaseModel):
@@ -112,6 +141,7 @@ class Task(BaseModel):
     status: TaskStatus = TaskStatus.PENDING
     priority: Priority = Priority.MEDIUM
     assigned_to: Optional[str] = None
+    tax_liability: Optional[float] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class TaskCreate(BaseModel):
@@ -123,6 +153,7 @@ class TaskCreate(BaseModel):
     status: Optional[TaskStatus] = TaskStatus.PENDING
     priority: Optional[Priority] = Priority.MEDIUM
     assigned_to: Optional[str] = None
+    tax_liability: Optional[float] = None
 
 class Document(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -185,6 +216,88 @@ class StaffCreate(BaseModel):
     role: str
     phone: str
 
+class BatchExtractionRequest(BaseModel):
+    document_ids: List[str]
+    document_type: str = "form16"
+    client_id: Optional[str] = None
+
+class IncomeTaxRequest(BaseModel):
+    income_data: Dict[str, float]
+    regime: str = "new"
+    financial_year: Optional[str] = None
+
+class RegimeComparisonRequest(BaseModel):
+    income_data: Dict[str, float]
+    financial_year: Optional[str] = None
+
+class DepreciationRequest(BaseModel):
+    assets: List[Dict[str, Any]]
+    method: str = "wdv"
+    financial_year: Optional[str] = None
+
+class CapitalGainsTransaction(BaseModel):
+    asset_type: str = "equity"
+    purchase_price: float = 0
+    sale_price: float = 0
+    purchase_date: Optional[date] = None
+    sale_date: Optional[date] = None
+    holding_days: int = 0
+    cost_inflation_index_purchase: float = 100
+    cost_inflation_index_sale: float = 110
+
+class CapitalGainsRequest(BaseModel):
+    transaction: CapitalGainsTransaction
+
+class GSTLiabilityRequest(BaseModel):
+    transactions: List[Dict[str, Any]]
+
+class TDSRequest(BaseModel):
+    payment_data: Dict[str, Any]
+    financial_year: Optional[str] = None
+
+class DeductionOptimizationRequest(BaseModel):
+    income_data: Dict[str, float]
+    budget: float = Field(ge=0)
+    step: float = Field(default=5000, gt=0)
+    financial_year: Optional[str] = None
+    deduction_limits: Optional[Dict[str, float]] = None
+
+class FixedAssetCreate(BaseModel):
+    name: str
+    asset_type: str
+    cost: float
+    put_to_use_date: datetime
+    is_opening_balance: bool = False
+    sale_date: Optional[datetime] = None
+    sale_value: Optional[float] = None
+
+class TDSPaymentCreate(BaseModel):
+    deductee_pan: str
+    section: str
+    amount: float = Field(gt=0)
+    payment_date: Optional[datetime] = None
+    financial_year: Optional[str] = None
+
+class AdvanceTaxEstimate(BaseModel):
+    financial_year: Optional[str] = None
+    income_data: Dict[str, float]
+    regime: str = "new"
+    tds_credit: float = Field(default=0, ge=0)
+    presumptive: bool = False
+
+class ComplianceOverrideCreate(BaseModel):
+    kind: str  # extension or holiday
+    form: Optional[str] = None
+    period: Optional[str] = None
+    due_date: Optional[date] = None
+    holiday_date: Optional[date] = None
+    state_codes: Optional[List[str]] = None
+    reason: Optional[str] = None
+
+class IdentifierRecord(BaseModel):
+    gstin: Optional[str] = None
+    pan: Optional[str] = None
+
 class DashboardStats(BaseModel):
     total_clients: int
     active_tasks: int
@@ -198,6 +311,21 @@ def serialize_datetime(obj):
         return obj.isoformat()
     return obj
 
+# Helper function to settle invoice amounts in exact paise
+def apply_invoice_amounts(invoice: dict) -> dict:
+    """Store item, subtotal, tax and total amounts as integer paise; total = subtotal + tax."""
+    for item in invoice.get('items', []):
+        item['rate_paise'] = to_paise(item['rate'])
+        item['amount_paise'] = to_paise(item['amount'])
+        item['amount'] = from_paise(item['amount_paise'])
+    invoice['subtotal_paise'] = sum(item['amount_paise'] for item in invoice.get('items', []))
+    invoice['tax_paise'] = to_paise(invoice['tax'])
+    invoice['total_paise'] = invoice['subtotal_paise'] + invoice['tax_paise']
+    invoice['subtotal'] = from_paise(invoice['subtotal_paise'])
+    invoice['tax'] = from_paise(invoice['tax_paise'])
+    invoice['total'] = from_paise(invoice['total_paise'])
+    return invoice
+
 # Routes
 @api_router.get("/")
 async def root():
@@ -211,6 +339,7 @@ async def create_client(client_input: ClientCreate):
     doc = client.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.clients.insert_one(doc)
+    await compliance_calendar_service.refresh_client(db, client.id)
     return client
 
 @api_router.get("/clients", response_model=List[Client])
@@ -239,6 +368,7 @@ async def update_client(client_id: str, client_input: ClientCreate):
     result = await db.clients.update_one({"id": client_id}, {"$set": client_dict})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
+    await compliance_calendar_service.refresh_client(db, client_id)
     updated_client = await db.clients.find_one({"id": client_id}, {"_id": 0})
     if isinstance(updated_client.get('created_at'), str):
         updated_client['created_at'] = datetime.fromisoformat(updated_client['created_at'])
@@ -249,6 +379,7 @@ async def delete_client(client_id: str):
     result = await db.clients.delete_one({"id": client_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
+    await compliance_calendar_service.remove_client(db, client_id)
     return {"message": "Client deleted successfully"}
 
 # Task Routes
@@ -264,6 +395,7 @@ async def create_task(task_input: TaskCreate):
     doc['created_at'] = doc['created_at'].isoformat()
     doc['due_date'] = doc['due_date'].isoformat()
     await db.tasks.insert_one(doc)
+    await penalty_exposure_service.refresh_task(db, task.id)
     return task
 
 @api_router.get("/tasks", response_model=List[Task])
@@ -303,6 +435,7 @@ async def update_task(task_id: str, task_input: TaskCreate):
     result = await db.tasks.update_one({"id": task_id}, {"$set": task_dict})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
+    await penalty_exposure_service.refresh_task(db, task_id)
     updated_task = await db.tasks.find_one({"id": task_id}, {"_id": 0})
     if isinstance(updated_task.get('created_at'), str):
         updated_task['created_at'] = datetime.fromisoformat(updated_task['created_at'])
@@ -315,6 +448,7 @@ async def delete_task(task_id: str):
     result = await db.tasks.delete_one({"id": task_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
+    await penalty_exposure_service.refresh_task(db, task_id)
     return {"message": "Task deleted successfully"}
 
 # Document Routes
@@ -336,7 +470,7 @@ async def get_documents(client_id: Optional[str] = None):
     query = {}
     if client_id:
         query['client_id'] = client_id
-    documents = await db.documents.find(query, {"_id": 0}).to_list(1000)
+    documents = await db.documents.find(query, {"_id": 0, "minhash": 0, "lsh_bands": 0}).to_list(1000)
     for doc in documents:
         if isinstance(doc.get('uploaded_at'), str):
             doc['uploaded_at'] = datetime.fromisoformat(doc['uploaded_at'])
@@ -347,6 +481,7 @@ async def delete_document(doc_id: str):
     result = await db.documents.delete_one({"id": doc_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Document not found")
+    await duplicate_detection_service.remove(db, doc_id)
     return {"message": "Document deleted successfully"}
 
 # Invoice Routes
@@ -358,11 +493,11 @@ async def create_invoice(invoice_input: InvoiceCreate):
     if client:
         invoice_dict['client_name'] = client['name']
     invoice = Invoice(**invoice_dict)
-    doc = invoice.model_dump()
+    doc = apply_invoice_amounts(invoice.model_dump())
     doc['created_at'] = doc['created_at'].isoformat()
     doc['due_date'] = doc['due_date'].isoformat()
     await db.invoices.insert_one(doc)
-    return invoice
+    return Invoice(**doc)
 
 @api_router.get("/invoices", response_model=List[Invoice])
 async def get_invoices(status: Optional[str] = None):
@@ -385,6 +520,7 @@ async def update_invoice(invoice_id: str, invoice_input: InvoiceCreate):
     if client:
         invoice_dict['client_name'] = client['name']
     invoice_dict['due_date'] = invoice_dict['due_date'].isoformat()
+    apply_invoice_amounts(invoice_dict)
     result = await db.invoices.update_one({"id": invoice_id}, {"$set": invoice_dict})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Invoice not found")
@@ -432,9 +568,15 @@ async def get_dashboard_stats():
     # Count pending invoices
     pending_invoices = await db.invoices.count_documents({"status": {"$in": ["SENT", "OVERDUE"]}})
     
-    # Calculate total revenue
-    paid_invoices = await db.invoices.find({"status": "PAID"}, {"_id": 0}).to_list(1000)
-    total_revenue = sum(invoice.get('total', 0) for invoice in paid_invoices)
+    # Calculate total revenue, summed exactly in paise by the database
+    revenue = await db.invoices.aggregate([
+        {"$match": {"status": "PAID"}},
+        {"$group": {"_id": None, "total_paise": {"$sum": {
+            # Invoices saved before amounts were kept in paise
+            "$ifNull": ["$total_paise", {"$round": [{"$multiply": ["$total", 100]}, 0]}]
+        }}}}
+    ]).to_list(1)
+    total_revenue = from_paise(int(revenue[0]["total_paise"])) if revenue else 0
     
     # Get upcoming deadlines (next 7 days)
     upcoming_tasks = await db.tasks.find(
@@ -668,6 +810,7 @@ async def bulk_import_clients(
     try:
         file_content = await file.read()
         result = await bulk_import_service.import_clients_from_csv(file_content, db)
+        await compliance_calendar_service.refresh_all(db)
         return result
     except Exception as e:
         logger.error(f"Import error: {str(e)}")
@@ -754,8 +897,15 @@ async def smart_upload_file(
 ):
     """Upload file with automatic categorization."""
     try:
+        file_content = await file.read()
+        
+        # Extract text once; it feeds the classifier and is kept for later re-classification
+        text = await asyncio.get_running_loop().run_in_executor(
+            None, ocr_service.extract_text_from_bytes, file_content, file.filename
+        )
+        
         # Auto-categorize
-        category = document_intelligence.auto_categorize(file.filename)
+        category = document_intelligence.auto_categorize(file.filename, text=text)
         
         # Extract metadata
         metadata = document_intelligence.extract_metadata(file.filename)
@@ -764,7 +914,6 @@ async def smart_upload_file(
         tags = document_intelligence.suggest_tags(file.filename, category)
         
         # Save file
-        file_content = await file.read()
         result = file_service.save_file(file_content, file.filename, category)
         
         if not result["success"]:
@@ -777,6 +926,8 @@ async def smart_upload_file(
             "filename": file.filename,
             "file_url": result["file_url"],
             "category": category,
+            # Reclassification may revisit automatic categories, never ones set by hand
+            "category_source": "auto",
             "tags": tags,
             "metadata": metadata,
             "uploaded_at": datetime.now(timezone.utc).isoformat()
@@ -788,18 +939,152 @@ async def smart_upload_file(
                 doc["client_name"] = client['name']
         
         await db.documents.insert_one(doc)
+        await document_text_service.save_text(db, doc["id"], text)
+        
+        # Flag re-scanned or re-exported copies of documents already on file
+        duplicates = await duplicate_detection_service.check_and_index(db, doc["id"], text)
         
         return {
             "success": True,
             "file_url": result["file_url"],
             "category": category,
             "tags": tags,
-            "metadata": metadata
+            "metadata": metadata,
+            "possible_duplicates": duplicates
         }
     except Exception as e:
         logger.error(f"Smart upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/documents/classifier/train")
+async def train_document_classifier(current_user: User = Depends(get_current_user)):
+    """Train the content classifier from already-categorized documents."""
+    try:
+        result = await document_classifier.train_from_db(db)
+        return {"success": True, **result}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Classifier training error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/documents/reclassify")
+async def reclassify_documents(
+    background_tasks: BackgroundTasks,
+    only_general: bool = True,
+    batch_size: int = 500,
+    current_user: User = Depends(get_current_user)
+):
+    """Re-categorize the document archive in the background."""
+    try:
+        background_tasks.add_task(document_intelligence.reclassify_archive, db, batch_size, only_general)
+        return {"success": True, "message": "Re-classification started"}
+    except Exception as e:
+        logger.error(f"Reclassification error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/documents/duplicates/scan")
+async def scan_duplicate_documents(
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Cluster near-duplicate documents across the archive in the background."""
+    try:
+        background_tasks.add_task(duplicate_detection_service.scan_archive, db)
+        return {"success": True, "message": "Duplicate scan started"}
+    except Exception as e:
+        logger.error(f"Duplicate scan error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/documents/duplicates")
+async def get_duplicate_documents(current_user: User = Depends(get_current_user)):
+    """Get the clusters found by the latest duplicate scan."""
+    try:
+        scan = await db.duplicate_scans.find_one({}, {"_id": 0}, sort=[("scanned_at", -1)])
+        if not scan:
+            raise HTTPException(status_code=404, detail="No duplicate scan has been run")
+        return scan
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get duplicates error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch OCR Extraction
+@api_router.post("/ocr/batch/upload")
+async def batch_extract_zip(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    document_type: str = "form16",
+    client_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Extract every document in a zip archive in the background."""
+    try:
+        batch_extraction_service.check_document_type(document_type)
+        zip_content = await file.read()
+        items = batch_extraction_service.unpack_zip(zip_content)
+        if not items:
+            raise HTTPException(status_code=400, detail="No supported documents found in archive")
+        
+        job = await batch_extraction_service.create_job(db, document_type, items, "zip", client_id)
+        background_tasks.add_task(batch_extraction_service.run_job, db, job["id"], document_type, items)
+        return {"success": True, "job": job}
+    except HTTPException:
+        raise
+    except (ValueError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch extraction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/ocr/batch/documents")
+async def batch_extract_documents(
+    request: BatchExtractionRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Extract a list of stored documents in the background."""
+    try:
+        items = await batch_extraction_service.items_from_documents(db, request.document_ids)
+        if not items:
+            raise HTTPException(status_code=404, detail="No documents found")
+        
+        job = await batch_extraction_service.create_job(
+            db, request.document_type, items, "documents", request.client_id
+        )
+        background_tasks.add_task(batch_extraction_service.run_job, db, job["id"], request.document_type, items)
+        return {"success": True, "job": job}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Batch extraction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/ocr/batch/{job_id}")
+async def get_batch_extraction_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get progress of a batch extraction job."""
+    job = await batch_extraction_service.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.get("/ocr/batch/{job_id}/results")
+async def get_batch_extraction_results(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Get the consolidated result table of a batch extraction job."""
+    result = await batch_extraction_service.get_consolidated_table(db, job_id)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
 # Automation Control
 @api_router.post("/automation/start")
 async def start_automation(current_user: User = Depends(get_current_user)):
@@ -813,7 +1098,11 @@ async def start_automation(current_user: User = Depends(get_current_user)):
                 "Deadline reminders (daily at 9 AM)",
                 "Recurring task generation (daily at midnight)",
                 "Overdue task updates (hourly)",
-                "Auto task assignment (daily at 8 AM)"
+                "Auto task assignment (daily at 8 AM)",
+                "Advance tax shortfall report (10 Jun, Sep, Dec and Mar at 7 AM)",
+                "Penalty exposure refresh (daily at 1 AM)",
+                "Compliance calendar refresh (daily at 12:30 AM)",
+                "Query follow-up reminders (daily at 10 AM)"
             ]
         }
     except Exception as e:
@@ -831,12 +1120,29 @@ async def stop_automation(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Manual trigger for testing
+@api_router.get("/automation/runs")
+async def get_automation_runs(
+    job: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user)
+):
+    """Recorded automation runs with their counts and timings, newest first."""
+    return await automation_service.get_runs(db, job, limit)
+
+@api_router.post("/automation/trigger/query-reminders")
+async def trigger_query_reminders(current_user: User = Depends(get_current_user)):
+    """Manually send the query reminders that are due."""
+    result = await query_reminder_service.send_due_reminders(db)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
 @api_router.post("/automation/trigger/reminders")
 async def trigger_reminders(current_user: User = Depends(get_current_user)):
     """Manually trigger deadline reminders."""
     try:
-        await automation_service.send_deadline_reminders()
-        return {"success": True, "message": "Reminders sent"}
+        run = await automation_service.send_deadline_reminders()
+        return {"success": run["success"], "message": "Reminders sent", "run": run}
     except Exception as e:
         logger.error(f"Reminder trigger error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -845,12 +1151,22 @@ async def trigger_reminders(current_user: User = Depends(get_current_user)):
 async def trigger_recurring_tasks(current_user: User = Depends(get_current_user)):
     """Manually trigger recurring task generation."""
     try:
-        await automation_service.generate_recurring_tasks()
-        return {"success": True, "message": "Recurring tasks generated"}
+        run = await automation_service.generate_recurring_tasks()
+        return {"success": run["success"], "message": "Recurring tasks generated", "run": run}
     except Exception as e:
         logger.error(f"Recurring task trigger error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/automation/trigger/advance-tax-report")
+async def trigger_advance_tax_report(current_user: User = Depends(get_current_user)):
+    """Manually trigger the advance tax shortfall report."""
+    try:
+        await automation_service.send_advance_tax_report()
+        return {"success": True, "message": "Advance tax report generated"}
+    except Exception as e:
+        logger.error(f"Advance tax report trigger error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===== CA WORKFLOW FEATURES =====
 
 # Business Type & Compliance Management
@@ -913,33 +1229,50 @@ async def update_task_wip_stage(
     wip_stage: WIPStage,
     current_user: User = Depends(get_current_user)
 ):
-    """Update task WIP stage."""
+    """Update task WIP stage, logging the transition."""
     try:
-        result = await db.tasks.update_one(
-            {"id": task_id},
-            {
-                "$set": {
-                    "wip_stage": wip_stage.value,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+        event = await wip_stage_service.transition(
+            db, task_id, wip_stage, {"id": current_user.id, "name": current_user.name}
         )
-        
-        if result.modified_count == 0:
+        if event is None:
             raise HTTPException(status_code=404, detail="Task not found")
         
-        # If stage is COMPLETED, mark task as completed
         if wip_stage == WIPStage.COMPLETED:
-            await db.tasks.update_one(
-                {"id": task_id},
-                {"$set": {"status": "COMPLETED"}}
-            )
+            await penalty_exposure_service.refresh_task(db, task_id)
         
-        return {"success": True, "wip_stage": wip_stage.value}
+        return {"success": True, "wip_stage": wip_stage.value, "event": event}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating WIP stage: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/tasks/{task_id}/wip-history")
+async def get_task_wip_history(task_id: str, current_user: User = Depends(get_current_user)):
+    """Stage transitions of a task with time spent in each stage."""
+    return await wip_stage_service.task_history(db, task_id)
+
+@api_router.get("/ca/wip-bottlenecks")
+async def get_wip_bottlenecks(
+    dimension: str = "firm",
+    financial_year: Optional[str] = None,
+    key: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Time in stage per task type, staff member or firm-wide, slowest stage first."""
+    try:
+        return await wip_stage_service.bottlenecks(db, dimension, financial_year, key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@api_router.post("/ca/wip-bottlenecks/rebuild")
+async def rebuild_wip_rollups(current_user: User = Depends(get_current_user)):
+    """Recompute time-in-stage rollups from the event log."""
+    result = await wip_stage_service.rebuild_rollups(db)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
 # Query Management
 @api_router.post("/queries")
 async def create_query(
@@ -963,6 +1296,7 @@ async def create_query(
         
         doc = query.model_dump()
         doc['raised_at'] = doc['raised_at'].isoformat()
+        doc.update(reminder_schedule(doc['raised_at'], 0, doc['status']))
         
         await db.queries.insert_one(doc)
         
@@ -998,7 +1332,7 @@ async def get_queries(
     status: Optional[QueryStatus] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Get queries with optional filters."""
+    """Get queries with optional filters, their aging and open query counts per aging bucket."""
     try:
         query_filter = {}
         if task_id:
@@ -1008,16 +1342,8 @@ async def get_queries(
         if status:
             query_filter['status'] = status.value
         
-        queries = await db.queries.find(query_filter, {"_id": 0}).to_list(1000)
-        
-        # Calculate aging for each query
-        now = datetime.now(timezone.utc)
-        for query in queries:
-            if isinstance(query.get('raised_at'), str):
-                raised_at = datetime.fromisoformat(query['raised_at'])
-                query['days_pending'] = ca_workflow_service.calculate_query_aging(raised_at, now)
-        
-        return queries
+        # Days pending and aging buckets are computed by Mongo
+        return await query_reminder_service.list_with_aging(db, query_filter)
     except Exception as e:
         logger.error(f"Error fetching queries: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1036,7 +1362,8 @@ async def respond_to_query(
                 "$set": {
                     "response": response_input.response,
                     "responded_at": datetime.now(timezone.utc).isoformat(),
-                    "status": QueryStatus.RESOLVED.value
+                    "status": QueryStatus.RESOLVED.value,
+                    "next_reminder_at": None
                 }
             }
         )
@@ -1054,12 +1381,42 @@ async def respond_to_query(
 async def calculate_late_fee(
     task_type: str,
     due_date: datetime,
+    liability: Optional[float] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Calculate late fee for a missed deadline."""
-    penalty = ca_workflow_service.calculate_late_fee(task_type, due_date)
+    penalty = ca_workflow_service.calculate_late_fee(task_type, due_date, liability=liability)
     return penalty
 
+# Penalty Exposure
+@api_router.get("/penalties/exposure")
+async def get_penalty_exposure(
+    scope: str = "client",
+    limit: int = 100,
+    current_user: User = Depends(get_current_user)
+):
+    """Late fee and interest exposure per client or per staff member (scope=staff)."""
+    if scope not in ("client", "staff"):
+        raise HTTPException(status_code=400, detail="scope must be client or staff")
+    return await penalty_exposure_service.get_rollups(db, scope, limit)
+
+@api_router.get("/penalties/exposure/tasks")
+async def get_task_penalty_exposure(
+    client_id: Optional[str] = None,
+    limit: int = 500,
+    current_user: User = Depends(get_current_user)
+):
+    """Per-task penalty exposure, largest first."""
+    return await penalty_exposure_service.get_task_exposures(db, client_id, limit)
+
+@api_router.post("/penalties/exposure/refresh")
+async def refresh_penalty_exposure(current_user: User = Depends(get_current_user)):
+    """Recompute exposure for every overdue task."""
+    result = await penalty_exposure_service.refresh_all(db)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
 # Service Checklists
 @api_router.get("/ca/checklist/{service_type}")
 async def get_service_checklist(
@@ -1074,10 +1431,11 @@ async def get_service_checklist(
 @api_router.post("/ca/validate-gstin")
 async def validate_gstin(
     gstin: str,
+    pan: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    """Validate GSTIN format."""
-    return ca_workflow_service.validate_gstin(gstin)
+    """Validate GSTIN format and checksum, and that it carries the given PAN."""
+    return ca_workflow_service.validate_gstin(gstin, pan)
 
 @api_router.post("/ca/validate-pan")
 async def validate_pan(
@@ -1087,6 +1445,449 @@ async def validate_pan(
     """Validate PAN format."""
     return ca_workflow_service.validate_pan(pan)
 
+@api_router.post("/ca/validate-identifiers")
+async def validate_identifiers(
+    records: List[IdentifierRecord],
+    current_user: User = Depends(get_current_user)
+):
+    """Validate many GSTIN/PAN pairs at once."""
+    return identifier_validator.validate_batch([record.model_dump() for record in records])
+
+@api_router.get("/ca/identifier-audit")
+async def audit_client_identifiers(current_user: User = Depends(get_current_user)):
+    """Check the GSTIN and PAN of every client."""
+    result = await identifier_validator.audit_clients(db)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+# ===== TAX COMPUTATION =====
+
+async def _run_tax_computation(method: str, **kwargs) -> Dict[str, Any]:
+    """Run a tax computation on the worker pool; a failed computation is a 400."""
+    try:
+        result = await tax_executor.run(method, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+# Tax Calculators
+@api_router.post("/tax/income-tax")
+async def compute_income_tax(
+    request: IncomeTaxRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Income tax under one regime."""
+    try:
+        return await _run_tax_computation("calculate_income_tax", **request.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Income tax error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/tax/compare-regimes")
+async def compare_tax_regimes(
+    request: RegimeComparisonRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Tax under both regimes, with the recommended one."""
+    try:
+        return await _run_tax_computation("compare_regimes", **request.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Regime comparison error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/tax/depreciation")
+async def compute_depreciation(
+    request: DepreciationRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Depreciation schedule for a list of assets."""
+    try:
+        return await _run_tax_computation("calculate_depreciation", **request.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Depreciation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/tax/capital-gains")
+async def compute_capital_gains(
+    request: CapitalGainsRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Capital gain on a single sale."""
+    try:
+        return await _run_tax_computation("calculate_capital_gains", **request.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Capital gains error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/tax/gst")
+async def compute_gst_liability(
+    request: GSTLiabilityRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """GST output tax, input credit and net liability for a period."""
+    try:
+        return await _run_tax_computation("calculate_gst_liability", **request.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"GST liability error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/tax/tds")
+async def compute_tds(
+    request: TDSRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """TDS on a single payment."""
+    try:
+        return await _run_tax_computation("calculate_tds", **request.model_dump())
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"TDS error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/tax/cache-stats")
+async def get_tax_cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit and miss counts of the tax computation cache."""
+    return tax_executor.stats()
+
+# Tax Planning
+@api_router.post("/tax/optimize-deductions")
+async def optimize_deductions(
+    request: DeductionOptimizationRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Find the investment allocation and regime with the lowest tax."""
+    try:
+        return await _run_tax_computation(
+            "optimize_deductions",
+            income_data=request.income_data,
+            budget=request.budget,
+            step=request.step,
+            financial_year=request.financial_year,
+            limits=request.deduction_limits
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Deduction optimization error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Capital Gains
+@api_router.post("/tax/capital-gains/trades")
+async def capital_gains_from_trades(
+    file: UploadFile = File(...),
+    asset_type: str = "equity",
+    current_user: User = Depends(get_current_user)
+):
+    """FIFO-match a broker trade file and total STCG/LTCG per financial year."""
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, capital_gains_engine.process, file.file, asset_type
+        )
+        if not result["success"]:
+            raise HTTPException(status_code=400, detail=result["error"])
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Capital gains error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# GST Registers
+def _register_format(upload: Optional[UploadFile]) -> Optional[str]:
+    if upload is None:
+        return None
+    return "parquet" if (upload.filename or "").lower().endswith(".parquet") else "csv"
+
+@api_router.post("/gst/register")
+async def gst_liability_from_registers(
+    sales: Optional[UploadFile] = File(None),
+    purchases: Optional[UploadFile] = File(None),
+    client_id: Optional[str] = None,
+    home_state: Optional[str] = None,
+    rate_unit: str = "percent",
+    current_user: User = Depends(get_current_user)
+):
+    """Output tax, ITC and cash payable from sales and purchase registers (CSV or Parquet).
+
+    gst_rate is read as a percent (18) unless rate_unit is "fraction" (0.18).
+    """
+    try:
+        if sales is None and purchases is None:
+            raise HTTPException(status_code=400, detail="Upload a sales or purchase register")
+        if not home_state and client_id:
+            client = await db.clients.find_one({"id": client_id}, {"_id": 0, "gstin": 1})
+            if not client:
+                raise HTTPException(status_code=404, detail="Client not found")
+            home_state = client.get("gstin")
+        if not home_state:
+            raise HTTPException(status_code=400, detail="home_state or a client with a GSTIN is required")
+
+        result = await asyncio.get_running_loop().run_in_executor(
+            None,
+            gst_register_engine.compute_liability,
+            home_state,
+            sales.file if sales else None,
+            purchases.file if purchases else None,
+            _register_format(sales),
+            _register_format(purchases),
+            rate_unit
+        )
+        if not result["success"]:
+            raise HTTPException(status_code=400, detail=result["error"])
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"GST register error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# TDS Ledger
+@api_router.post("/clients/{client_id}/tds/payments")
+async def record_tds_payment(
+    client_id: str,
+    payment: TDSPaymentCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Add a payment to the deductee's running total and return the TDS to deduct, including any catch-up."""
+    try:
+        result = await tds_ledger_service.record_payment(db, client_id, payment.model_dump())
+        if not result["success"]:
+            raise HTTPException(status_code=400, detail=result["error"])
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"TDS payment error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/clients/{client_id}/tds/payments/import")
+async def import_tds_payments(
+    client_id: str,
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Import a quarter's payment ledger from CSV."""
+    try:
+        file_content = await file.read()
+        result = await tds_ledger_service.import_payments_from_csv(db, client_id, file_content)
+        if not result["success"]:
+            raise HTTPException(status_code=400, detail=result["error"])
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"TDS import error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/clients/{client_id}/tds/ledger")
+async def get_tds_ledger(
+    client_id: str,
+    financial_year: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Cumulative payments and TDS owed per deductee and section."""
+    try:
+        return await tds_ledger_service.get_ledger(db, client_id, financial_year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"TDS ledger error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Advance Tax
+@api_router.put("/clients/{client_id}/advance-tax/estimate")
+async def save_advance_tax_estimate(
+    client_id: str,
+    estimate: AdvanceTaxEstimate,
+    current_user: User = Depends(get_current_user)
+):
+    """Set a client's estimated income for a year's advance tax."""
+    try:
+        return await advance_tax_service.save_estimate(db, client_id, estimate.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Advance tax estimate error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/clients/{client_id}/advance-tax")
+async def get_advance_tax_schedule(
+    client_id: str,
+    financial_year: Optional[str] = None,
+    as_of: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Instalments due, challans paid and 234B/234C interest for a client."""
+    result = await advance_tax_service.client_schedule(db, client_id, financial_year, as_of)
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@api_router.post("/advance-tax/shortfall-report")
+async def run_advance_tax_report(
+    financial_year: Optional[str] = None,
+    as_of: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Evaluate every client's advance tax position and store the shortfall report."""
+    result = await advance_tax_service.shortfall_report(db, financial_year, as_of)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@api_router.get("/advance-tax/shortfall-report/latest")
+async def get_latest_advance_tax_report(
+    financial_year: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Most recent stored shortfall report."""
+    report = await advance_tax_service.latest_report(db, financial_year)
+    if not report:
+        raise HTTPException(status_code=404, detail="No advance tax report yet")
+    return report
+
+# Compliance Calendar
+@api_router.get("/compliance/calendar")
+async def get_compliance_calendar(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    client_id: Optional[str] = None,
+    return_type: Optional[str] = None,
+    limit: int = 1000,
+    current_user: User = Depends(get_current_user)
+):
+    """Obligations due between two dates, inclusive; the next seven days by default."""
+    start = start or datetime.now(timezone.utc).date()
+    end = end or start + timedelta(days=7)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    return await compliance_calendar_service.due_between(db, start, end, client_id, return_type, limit)
+
+@api_router.get("/clients/{client_id}/compliance/calendar")
+async def get_client_compliance_calendar(
+    client_id: str,
+    financial_year: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """A client's dated obligations for a financial year."""
+    return await compliance_calendar_service.client_calendar(db, client_id, financial_year)
+
+@api_router.post("/compliance/calendar/rebuild")
+async def rebuild_compliance_calendar(
+    financial_year: Optional[str] = None,
+    force: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Rebuild calendars of clients whose profile changed, or all of them with force."""
+    result = await compliance_calendar_service.refresh_all(db, [financial_year] if financial_year else None, force)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+@api_router.get("/compliance/calendar/overrides")
+async def get_compliance_overrides(current_user: User = Depends(get_current_user)):
+    """Due date extensions and holidays in effect."""
+    return await compliance_calendar_service.list_overrides(db)
+
+@api_router.post("/compliance/calendar/overrides")
+async def create_compliance_override(
+    override: ComplianceOverrideCreate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Record a due date extension or holiday and move the affected obligations in the background."""
+    try:
+        doc = await compliance_calendar_service.add_override(db, override.model_dump(mode="json"))
+        background_tasks.add_task(compliance_calendar_service.refresh_all, db)
+        return {"success": True, "override": doc, "message": "Calendar refresh started"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Compliance override error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.delete("/compliance/calendar/overrides/{override_id}")
+async def delete_compliance_override(
+    override_id: str,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user)
+):
+    """Remove an extension or holiday and restore the affected due dates in the background."""
+    if not await compliance_calendar_service.delete_override(db, override_id):
+        raise HTTPException(status_code=404, detail="Override not found")
+    background_tasks.add_task(compliance_calendar_service.refresh_all, db)
+    return {"success": True, "message": "Calendar refresh started"}
+
+# Depreciation
+@api_router.post("/clients/{client_id}/assets")
+async def create_fixed_asset(
+    client_id: str,
+    asset_input: FixedAssetCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Add an asset to a client's block-of-assets register."""
+    try:
+        return await depreciation_ledger_service.create_asset(db, client_id, asset_input.model_dump())
+    except Exception as e:
+        logger.error(f"Create asset error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/clients/{client_id}/assets")
+async def get_fixed_assets(client_id: str, current_user: User = Depends(get_current_user)):
+    """List a client's assets."""
+    return await depreciation_ledger_service.list_assets(db, client_id)
+
+@api_router.put("/clients/{client_id}/assets/{asset_id}")
+async def update_fixed_asset(
+    client_id: str,
+    asset_id: str,
+    asset_input: FixedAssetCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """Edit an asset; cached ledger years from its date onwards are recomputed."""
+    try:
+        asset = await depreciation_ledger_service.update_asset(db, client_id, asset_id, asset_input.model_dump())
+    except Exception as e:
+        logger.error(f"Update asset error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not asset:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return asset
+
+@api_router.delete("/clients/{client_id}/assets/{asset_id}")
+async def delete_fixed_asset(client_id: str, asset_id: str, current_user: User = Depends(get_current_user)):
+    """Remove an asset from the register."""
+    if not await depreciation_ledger_service.delete_asset(db, client_id, asset_id):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return {"message": "Asset deleted successfully"}
+
+@api_router.get("/clients/{client_id}/depreciation")
+async def get_depreciation_ledger(
+    client_id: str,
+    financial_year: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Block-wise WDV ledger for every year up to financial_year (default: current FY)."""
+    to_year = fy_code_start_year(normalize_financial_year(financial_year)) if financial_year else None
+    result = await depreciation_ledger_service.get_ledger(db, client_id, to_year)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
 # Include auth router
 app.include_router(auth_router, prefix="/api")
 
@@ -1108,6 +1909,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await batch_extraction_service.ensure_indexes(db)
+    await document_text_service.ensure_indexes(db)
+    await depreciation_ledger_service.ensure_indexes(db)
+    await tds_ledger_service.ensure_indexes(db)
+    await advance_tax_service.ensure_indexes(db)
+    await penalty_exposure_service.ensure_indexes(db)
+    await compliance_calendar_service.ensure_indexes(db)
+    await wip_stage_service.ensure_indexes(db)
+    await wip_stage_service.deliver_pending(db)
+    await query_reminder_service.ensure_indexes(db)
+    await query_reminder_service.backfill(db)
+    await automation_service.backfill_idempotency_keys(db)
+    await automation_service.ensure_indexes(db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    batch_extraction_service.shutdown()
+    image_ocr_service.shutdown()
+    tax_executor.shutdown()
     client.close()
\ No newline at end of file
@@ -0,0 +1,477 @@
+"""Tax engine benchmark and equivalence suite.
+
+Times each public TaxComputationService method at several input sizes,
+alongside the batch and streaming paths that compute the same thing
+(calculate_income_tax_batch, compare_regimes_batch, gst_register_engine,
+capital_gains_engine). It then checks on randomized inputs that each pair
+of paths agrees, including incomes on slab boundaries and half-paisa
+amounts. The JSON report can be compared against an earlier one with
+--baseline, which adds an ops/sec ratio to every measurement. The exit
+status is non-zero when any equivalence check fails.
+
+Usage:
+    python tax_benchmark.py --output bench.json
+    python tax_benchmark.py --sizes 1 1000 --trials 500 --baseline bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from tax_computation_service import tax_computation_service, INCOME_COLUMNS, DEDUCTION_COLUMNS
+from tax_rule_registry import tax_rule_registry, fy_code_start_year
+from money import to_paise
+from gst_register_engine import gst_register_engine
+from capital_gains_engine import capital_gains_engine
+from depreciation_ledger_service import depreciation_ledger_service
+from tds_ledger_service import tds_ledger_service
+
+ASSET_TYPES = ['building', 'furniture', 'plant_machinery', 'computers', 'vehicles', 'intangible']
+# Fractions for the scalar path; gst_register_csv writes them as percents
+GST_RATES = [0.0, 0.0025, 0.01, 0.03, 0.05, 0.12, 0.18, 0.28]
+TDS_TYPES = ['salary', 'professional_fees', 'contract', 'rent', 'commission', 'interest']
+# Counterexamples kept per equivalence check
+MAX_MISMATCH_SAMPLES = 5
+
+
+# Input generators
+def _amount(rng: random.Random, high: float) -> float:
+    """Random rupee amount, sometimes whole, sometimes ending in half a paisa."""
+    kind = rng.random()
+    if kind < 0.2:
+        return float(rng.randint(0, int(high)))
+    if kind < 0.3:
+        return rng.randint(0, int(high) * 100) / 100 + 0.005
+    return round(rng.uniform(0, high), 2)
+
+
+def _slab_edges() -> List[float]:
+    """Slab starts of every rule set, offset by standard deductions, for boundary cases."""
+    edges = set()
+    for financial_year in tax_rule_registry.financial_years():
+        rules = tax_rule_registry.get(financial_year)
+        for regime in rules.regimes:
+            for start in rules.slabs(regime).definition:
+                edges.add(start['from'] + rules.standard_deduction(regime))
+    return sorted(edges)
+
+
+def income_frame(rng: np.random.Generator, size: int) -> pd.DataFrame:
+    columns = {'gross_salary': np.round(rng.uniform(0, 5_000_000, size), 2)}
+    for column in INCOME_COLUMNS[1:]:
+        columns[column] = np.where(rng.random(size) < 0.3, np.round(rng.uniform(0, 1_000_000, size), 2), 0.0)
+    for column in DEDUCTION_COLUMNS:
+        columns[column] = np.where(rng.random(size) < 0.5, np.round(rng.uniform(0, 200_000, size), 2), 0.0)
+    return pd.DataFrame(columns)
+
+
+def random_income(rng: random.Random, edges: List[float]) -> Dict[str, float]:
+    data = {column: _amount(rng, 1_000_000) if rng.random() < 0.4 else 0.0 for column in INCOME_COLUMNS}
+    if rng.random() < 0.3:
+        # Land exactly on (or a paisa either side of) a slab boundary
+        data['gross_salary'] = rng.choice(edges) + rng.choice([-0.01, 0.0, 0.01])
+        data.update({column: 0.0 for column in INCOME_COLUMNS[1:]})
+    else:
+        data['gross_salary'] = _amount(rng, 5_000_000)
+    for column in DEDUCTION_COLUMNS:
+        data[column] = _amount(rng, 200_000) if rng.random() < 0.5 else 0.0
+    return data
+
+
+def random_assets(rng: random.Random, size: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            'name': f"Asset {i}",
+            'type': rng.choice(ASSET_TYPES),
+            'opening_wdv': _amount(rng, 5_000_000),
+            'additions': _amount(rng, 500_000) if rng.random() < 0.3 else 0
+        }
+        for i in range(size)
+    ]
+
+
+def random_sale(rng: random.Random) -> Dict[str, Any]:
+    purchase_date = date(2018, 4, 1) + timedelta(days=rng.randint(0, 2000))
+    asset_type = rng.choice(['equity', 'equity', 'property', 'other'])
+    return {
+        'asset_type': asset_type,
+        'purchase_price': _amount(rng, 2_000_000),
+        'sale_price': _amount(rng, 3_000_000),
+        'purchase_date': purchase_date,
+        'sale_date': purchase_date + timedelta(days=rng.randint(1, 1500))
+    }
+
+
+def random_gst_transactions(rng: random.Random, size: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            'type': 'sale' if rng.random() < 0.6 else 'purchase',
+            'amount': _amount(rng, 500_000),
+            'gst_rate': rng.choice(GST_RATES)
+        }
+        for _ in range(size)
+    ]
+
+
+def random_payment(rng: random.Random) -> Dict[str, Any]:
+    return {'type': rng.choice(TDS_TYPES), 'amount': _amount(rng, 500_000)}
+
+
+def gst_register_csv(transactions: List[Dict[str, Any]], register_type: str) -> io.StringIO:
+    """Transactions of one type as an intra-state register CSV, rates in percent."""
+    rows = [txn for txn in transactions if (txn['type'] == 'sale') == (register_type == 'sales')]
+    buffer = io.StringIO()
+    pd.DataFrame({
+        'taxable_value': [txn['amount'] for txn in rows],
+        'gst_rate': [round(txn['gst_rate'] * 100, 4) for txn in rows],
+        'hsn': '9983'
+    }).to_csv(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def trade_csv(sales: List[Dict[str, Any]]) -> io.StringIO:
+    """One ISIN per sale: a buy of one unit at the purchase price, then the sell."""
+    rows = []
+    for index, sale in enumerate(sales):
+        isin = f"INE{index:09d}"
+        rows.append((sale['purchase_date'].isoformat(), isin, 'BUY', 1, sale['purchase_price']))
+        rows.append((sale['sale_date'].isoformat(), isin, 'SELL', 1, sale['sale_price']))
+    rows.sort(key=lambda row: row[0])
+    buffer = io.StringIO()
+    pd.DataFrame(rows, columns=['trade_date', 'isin', 'side', 'quantity', 'price']).to_csv(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+# Timing
+def _measure(function: Callable[[], Any], inputs: int, min_time: float) -> Dict[str, Any]:
+    """Call function until min_time has passed (at least once); inputs is how many it handles per call."""
+    calls = 0
+    best = float('inf')
+    started = time.perf_counter()
+    while True:
+        call_started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - call_started)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+    return {
+        'calls': calls,
+        'best_call_seconds': round(best, 6),
+        'ops_per_second': round(calls * inputs / elapsed, 2)
+    }
+
+
+def _scalar_loop(method: Callable, arguments: List[tuple]) -> Callable[[], None]:
+    def run():
+        for args in arguments:
+            method(*args)
+    return run
+
+
+def benchmark(sizes: List[int], scalar_sample: int, min_time: float, seed: int) -> List[Dict[str, Any]]:
+    """Ops/sec of every method and path at every size."""
+    service = tax_computation_service
+    results = []
+
+    def record(method: str, path: str, size: int, measured: Dict[str, Any], sampled: Optional[int] = None):
+        entry = {'method': method, 'path': path, 'size': size, **measured}
+        if sampled is not None and sampled < size:
+            # Per-input scalar paths are timed on a sample; ops/sec is a rate, so it carries over
+            entry['sampled_inputs'] = sampled
+        results.append(entry)
+        print(f"{method:<24} {path:<8} {size:>9}  {entry['ops_per_second']:>14,.0f} ops/s", file=sys.stderr)
+
+    for size in sizes:
+        rng = random.Random(seed + size)
+        frame = income_frame(np.random.default_rng(seed + size), size)
+        sample = min(size, scalar_sample)
+        records = frame.head(sample).to_dict('records')
+
+        record('calculate_income_tax', 'scalar', size, _measure(
+            _scalar_loop(service.calculate_income_tax, [(row, 'new') for row in records]), sample, min_time
+        ), sample)
+        record('calculate_income_tax', 'batch', size, _measure(
+            lambda: service.calculate_income_tax_batch(frame, 'new'), size, min_time
+        ))
+        record('compare_regimes', 'scalar', size, _measure(
+            _scalar_loop(service.compare_regimes, [(row,) for row in records]), sample, min_time
+        ), sample)
+        record('compare_regimes', 'batch', size, _measure(
+            lambda: service.compare_regimes_batch(frame), size, min_time
+        ))
+
+        assets = random_assets(rng, size)
+        record('calculate_depreciation', 'scalar', size, _measure(
+            lambda: service.calculate_depreciation(assets), size, min_time
+        ))
+        del assets
+
+        sales = [random_sale(rng) for _ in range(size)]
+        record('calculate_capital_gains', 'scalar', size, _measure(
+            _scalar_loop(service.calculate_capital_gains, [(sale,) for sale in sales[:sample]]), sample, min_time
+        ), sample)
+        trades = trade_csv(sales).getvalue()
+        del sales
+        record('calculate_capital_gains', 'stream', size, _measure(
+            lambda: capital_gains_engine.process(io.StringIO(trades)), size, min_time
+        ))
+        del trades
+
+        transactions = random_gst_transactions(rng, size)
+        record('calculate_gst_liability', 'scalar', size, _measure(
+            lambda: service.calculate_gst_liability(transactions), size, min_time
+        ))
+        sales_register = gst_register_csv(transactions, 'sales').getvalue()
+        purchases_register = gst_register_csv(transactions, 'purchases').getvalue()
+        del transactions
+        record('calculate_gst_liability', 'stream', size, _measure(
+            lambda: gst_register_engine.compute_liability(
+                '27', io.StringIO(sales_register), io.StringIO(purchases_register)
+            ), size, min_time
+        ))
+        del sales_register, purchases_register
+
+        payments = [(random_payment(rng),) for _ in range(sample)]
+        record('calculate_tds', 'scalar', size, _measure(
+            _scalar_loop(service.calculate_tds, payments), sample, min_time
+        ), sample)
+
+    return results
+
+
+# Equivalence
+def _check(name: str, trials: int, trial: Callable[[random.Random], Optional[Dict[str, Any]]], seed: int) -> Dict[str, Any]:
+    """Run trial on seeded generators; a returned dict is a counterexample."""
+    mismatches = []
+    count = 0
+    for index in range(trials):
+        counterexample = trial(random.Random(f"{seed}:{name}:{index}"))
+        if counterexample is not None:
+            count += 1
+            if len(mismatches) < MAX_MISMATCH_SAMPLES:
+                mismatches.append(counterexample)
+    return {'check': name, 'trials': trials, 'mismatches': count, 'passed': count == 0, 'samples': mismatches}
+
+
+def equivalence_checks(trials: int, seed: int) -> List[Dict[str, Any]]:
+    service = tax_computation_service
+    edges = _slab_edges()
+    financial_years = tax_rule_registry.financial_years()
+    batch_size = 50
+
+    def income_tax(rng):
+        rows = [random_income(rng, edges) for _ in range(batch_size)]
+        years = [rng.choice(financial_years) for _ in rows]
+        frame = pd.DataFrame(rows).assign(financial_year=years)
+        for regime in ('old', 'new'):
+            batch = service.calculate_income_tax_batch(frame, regime)
+            for index, (row, year) in enumerate(zip(rows, years)):
+                scalar = service.calculate_income_tax(row, regime, year)
+                for field, values in batch.items():
+                    if scalar[field] != values[index]:
+                        return {'income_data': row, 'financial_year': year, 'regime': regime,
+                                'field': field, 'scalar': scalar[field], 'batch': float(values[index])}
+        return None
+
+    def regimes(rng):
+        rows = [random_income(rng, edges) for _ in range(batch_size)]
+        year = rng.choice(financial_years)
+        batch = service.compare_regimes_batch(pd.DataFrame(rows), year)
+        for index, row in enumerate(rows):
+            scalar = service.compare_regimes(row, year)
+            expected = {
+                'recommended_regime': scalar['recommended_regime'],
+                'tax_savings': scalar['tax_savings'],
+                'savings_percentage': scalar['savings_percentage'],
+                'old_total_tax_liability': scalar['old_regime']['total_tax_liability'],
+                'new_total_tax_liability': scalar['new_regime']['total_tax_liability']
+            }
+            for field, value in expected.items():
+                if batch[field].iloc[index] != value:
+                    return {'income_data': row, 'financial_year': year, 'field': field,
+                            'scalar': value, 'batch': batch[field].iloc[index]}
+        return None
+
+    def gst(rng):
+        transactions = random_gst_transactions(rng, rng.randint(1, 40))
+        scalar = service.calculate_gst_liability(transactions)
+        stream = gst_register_engine.compute_liability(
+            '27', gst_register_csv(transactions, 'sales'), gst_register_csv(transactions, 'purchases')
+        )
+        output_tax = sum(to_paise(value) for value in stream['output_tax'].values())
+        input_tax = sum(to_paise(value) for value in stream['input_tax_credit'].values())
+        if (output_tax, input_tax) != (to_paise(scalar['output_gst']), to_paise(scalar['input_gst'])):
+            return {'transactions': transactions, 'scalar': [scalar['output_gst'], scalar['input_gst']],
+                    'stream': [output_tax / 100, input_tax / 100]}
+        return None
+
+    def capital_gains(rng):
+        sale = random_sale(rng)
+        # Trade prices are whole paise; the scalar path would otherwise round the difference, not each price
+        sale.update(asset_type='equity', purchase_price=round(sale['purchase_price'], 2),
+                    sale_price=round(sale['sale_price'], 2))
+        scalar = service.calculate_capital_gains(sale)
+        stream = capital_gains_engine.process(trade_csv([sale]))['financial_years'][0]
+        gain = stream['long_term_capital_gain'] if scalar['is_long_term'] else stream['short_term_capital_gain']
+        if to_paise(gain) != to_paise(scalar['capital_gain']):
+            return {'transaction': {**sale, 'purchase_date': str(sale['purchase_date']), 'sale_date': str(sale['sale_date'])},
+                    'scalar': scalar['capital_gain'], 'stream': gain}
+        return None
+
+    def capital_gains_json(rng):
+        # The HTTP route receives dates as ISO strings
+        sale = random_sale(rng)
+        sent = json.loads(json.dumps(sale, default=str))
+        expected = service.calculate_capital_gains(sale)
+        received = service.calculate_capital_gains(sent)
+        if received != expected:
+            return {'transaction': sent, 'dates': expected, 'json': received}
+        return None
+
+    def depreciation(rng):
+        year = rng.choice(financial_years)
+        start_year = fy_code_start_year(year)
+        asset = random_assets(rng, 1)[0]
+        asset['additions'] = 0
+        scalar = service.calculate_depreciation([asset], financial_year=year)
+        ledger = depreciation_ledger_service.project([{
+            'asset_type': asset['type'],
+            'cost_paise': to_paise(asset['opening_wdv']),
+            'put_to_use_date': datetime(start_year, 4, 1).isoformat(),
+            'is_opening_balance': True
+        }], start_year, start_year)
+        # Both round half-up in paise, so they agree exactly
+        if to_paise(ledger[0]['total_depreciation']) != to_paise(scalar['total_depreciation']):
+            return {'asset': asset, 'financial_year': year,
+                    'scalar': scalar['total_depreciation'], 'ledger': ledger[0]['total_depreciation']}
+        return None
+
+    def tds(rng):
+        # A deductee's payments over a year, recorded in runs as single payments and imports would be.
+        # After each payment the TDS deducted so far must equal the scalar TDS on the cumulative total.
+        payment_type = rng.choice(TDS_TYPES)
+        year = rng.choice(financial_years)
+        rules = tax_rule_registry.get(year)
+        rate = rules.tds_rates.get(payment_type, 0.10)
+        threshold = to_paise(rules.tds_thresholds.get(payment_type, 0))
+        # Sized so the sequence usually crosses the threshold part way
+        high = max(threshold / 100 / 3, 10_000)
+        amounts = [to_paise(_amount(rng, high)) for _ in range(rng.randint(1, 15))]
+
+        opening = 0
+        deducted = 0
+        position = 0
+        while position < len(amounts):
+            run = np.array(amounts[position:position + rng.randint(1, 4)], dtype=np.int64)
+            cumulative, deductions, _ = tds_ledger_service._deductions(opening, run, rate, threshold)
+            for total, tds_paise in zip(cumulative.tolist(), deductions.tolist()):
+                deducted += tds_paise
+                scalar = service.calculate_tds({'type': payment_type, 'amount': total / 100}, year)
+                if to_paise(scalar['tds_amount']) != deducted or tds_paise < 0:
+                    return {'type': payment_type, 'financial_year': year,
+                            'payments': [amount / 100 for amount in amounts], 'cumulative': total / 100,
+                            'scalar': scalar['tds_amount'], 'ledger': deducted / 100}
+            opening = int(cumulative[-1])
+            position += len(run)
+        return None
+
+    return [
+        _check('income_tax_scalar_vs_batch', trials, income_tax, seed),
+        _check('compare_regimes_scalar_vs_batch', trials, regimes, seed),
+        _check('gst_liability_scalar_vs_register_engine', trials, gst, seed),
+        _check('capital_gains_scalar_vs_fifo_engine', trials, capital_gains, seed),
+        _check('capital_gains_dates_vs_json_dates', trials, capital_gains_json, seed),
+        _check('depreciation_schedule_vs_ledger', trials, depreciation, seed),
+        _check('tds_scalar_vs_accumulator', trials, tds, seed)
+    ]
+
+
+def compare_with_baseline(results: List[Dict[str, Any]], baseline_path: str) -> None:
+    """Add baseline ops/sec and the ratio to it to each matching measurement."""
+    baseline = json.loads(Path(baseline_path).read_text())
+    previous = {
+        (entry['method'], entry['path'], entry['size']): entry['ops_per_second']
+        for entry in baseline.get('results', [])
+    }
+    for entry in results:
+        before = previous.get((entry['method'], entry['path'], entry['size']))
+        if before:
+            entry['baseline_ops_per_second'] = before
+            entry['speedup'] = round(entry['ops_per_second'] / before, 3)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def main(argv: List[str] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark tax_computation_service and check path equivalence.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 1000000])
+    parser.add_argument('--scalar-sample', type=int, default=20000,
+                        help="Inputs timed on per-input scalar paths at larger sizes")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds to repeat each measurement for")
+    parser.add_argument('--trials', type=int, default=200, help="Randomized trials per equivalence check")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-benchmark', action='store_true')
+    parser.add_argument('--baseline', help="Earlier JSON report to compute speedups against")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    equivalence = equivalence_checks(args.trials, args.seed)
+    results = [] if args.skip_benchmark else benchmark(args.sizes, args.scalar_sample, args.min_time, args.seed)
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+    report = {
+        'benchmark': 'tax_computation_service',
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'sizes': args.sizes,
+            'scalar_sample': args.scalar_sample,
+            'min_time': args.min_time,
+            'trials': args.trials,
+            'seed': args.seed
+        },
+        'rule_sets': {
+            year: tax_rule_registry.get(year).version for year in tax_rule_registry.financial_years()
+        },
+        'equivalence': equivalence,
+        'equivalence_passed': all(check['passed'] for check in equivalence),
+        'results': results
+    }
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main()['equivalence_passed'] else 1)
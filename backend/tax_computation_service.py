@@ -1,99 +1,117 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
 import logging
-from datetime import datetime
+from datetime import datetime, date
+import numpy as np
+import pandas as pd
+from tax_rule_registry import tax_rule_registry
+from money import (
+    to_paise, to_paise_array, from_paise, from_paise_array, apply_rate,
+    apply_rate_array, prorate, round_to_rupee, round_to_rupee_array
+)
 
 logger = logging.getLogger(__name__)
 
+# Income components and deductions read by calculate_income_tax
+INCOME_COLUMNS = [
+    'gross_salary', 'business_income', 'house_property_income',
+    'capital_gains_short_term', 'capital_gains_long_term', 'other_income'
+]
+DEDUCTION_COLUMNS = ['deductions_80c', 'deductions_80d', 'deductions_80g', 'other_deductions']
+# Sections searched by optimize_deductions, keyed as in the rule sets' deduction_limits
+DEDUCTION_SECTIONS = ['80c', '80d', '80ccd_1b']
+MAX_OPTIMIZER_PLANS = 250000
+
+# Holding period (days) beyond which a capital gain is long-term
+LONG_TERM_HOLDING_DAYS = {
+    'equity': 365,  # > 1 year for equity
+    'property': 730,  # > 2 years for property
+    'other': 1095  # > 3 years for other assets
+}
+
+
+def _as_date(value) -> Optional[date]:
+    """A date from a date, datetime or ISO string, as sent in a JSON body."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.fromisoformat(str(value)).date()
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    """Round to 2 decimals exactly like Python's round(), element-wise.
+
+    np.round scales by 100 first, which can tip values lying next to a
+    half-cent; those few are re-rounded with round().
+    """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for index in np.flatnonzero(near_tie):
+        rounded[index] = round(float(values[index]), 2)
+    return rounded
+
 class TaxComputationService:
     """Service for tax computation as per Income Tax Act."""
     
     def __init__(self):
-        # Tax slabs for FY 2024-25 (AY 2025-26)
-        self.old_regime_slabs = [
-            {'min': 0, 'max': 250000, 'rate': 0},
-            {'min': 250000, 'max': 500000, 'rate': 0.05},
-            {'min': 500000, 'max': 1000000, 'rate': 0.20},
-            {'min': 1000000, 'max': float('inf'), 'rate': 0.30}
-        ]
-        
-        self.new_regime_slabs = [
-            {'min': 0, 'max': 300000, 'rate': 0},
-            {'min': 300000, 'max': 600000, 'rate': 0.05},
-            {'min': 600000, 'max': 900000, 'rate': 0.10},
-            {'min': 900000, 'max': 1200000, 'rate': 0.15},
-            {'min': 1200000, 'max': 1500000, 'rate': 0.20},
-            {'min': 1500000, 'max': float('inf'), 'rate': 0.30}
-        ]
-        
-        # Standard deduction (applicable in both regimes)
-        self.standard_deduction = 50000
-        
-        # Depreciation rates as per IT Act
-        self.depreciation_rates = {
-            'building': 0.05,  # 5% for building
-            'furniture': 0.10,  # 10% for furniture
-            'plant_machinery': 0.15,  # 15% for plant & machinery
-            'computers': 0.40,  # 40% for computers
-            'vehicles': 0.15,  # 15% for vehicles
-            'intangible': 0.25  # 25% for intangible assets
-        }
+        # Slabs, deductions, depreciation and TDS rates come from the rule set of
+        # the requested financial year; FY 2024-25 when none is given
+        self.rules = tax_rule_registry
     
     def calculate_income_tax(
         self,
         income_data: Dict[str, Any],
-        regime: str = 'new'
+        regime: str = 'new',
+        financial_year: Optional[str] = None
     ) -> Dict[str, Any]:
         """Calculate income tax in specified regime."""
         try:
-            # Extract income components
-            gross_salary = income_data.get('gross_salary', 0)
-            business_income = income_data.get('business_income', 0)
-            house_property_income = income_data.get('house_property_income', 0)
-            capital_gains_short = income_data.get('capital_gains_short_term', 0)
-            capital_gains_long = income_data.get('capital_gains_long_term', 0)
-            other_income = income_data.get('other_income', 0)
+            rules = self.rules.get(financial_year)
+            standard_deduction = rules.standard_deduction(regime)
             
-            # Calculate total income
-            gross_total_income = (
-                gross_salary + business_income + house_property_income +
-                capital_gains_short + capital_gains_long + other_income
-            )
+            # Income components, in paise
+            income = {column: to_paise(income_data.get(column, 0)) for column in INCOME_COLUMNS}
+            gross_total_income = sum(income.values())
             
             # Deductions (only in old regime)
-            deductions_80c = income_data.get('deductions_80c', 0) if regime == 'old' else 0
-            deductions_80d = income_data.get('deductions_80d', 0) if regime == 'old' else 0
-            deductions_80g = income_data.get('deductions_80g', 0) if regime == 'old' else 0
-            other_deductions = income_data.get('other_deductions', 0) if regime == 'old' else 0
-            
-            total_deductions = deductions_80c + deductions_80d + deductions_80g + other_deductions
+            deductions = {
+                column: to_paise(income_data.get(column, 0)) if regime == 'old' else 0
+                for column in DEDUCTION_COLUMNS
+            }
+            total_deductions = sum(deductions.values())
             
             # Apply standard deduction
-            taxable_income = gross_total_income - self.standard_deduction - total_deductions
+            taxable_income = gross_total_income - to_paise(standard_deduction) - total_deductions
             taxable_income = max(0, taxable_income)
             
             # Calculate tax based on regime
-            slabs = self.new_regime_slabs if regime == 'new' else self.old_regime_slabs
-            tax_on_income = self._calculate_tax_from_slabs(taxable_income, slabs)
+            slabs = rules.slabs(regime)
+            tax_on_income = slabs.tax(taxable_income)
             
-            # Add 4% cess
-            cess = tax_on_income * 0.04
-            total_tax = tax_on_income + cess
+            # Add health and education cess
+            cess = apply_rate(tax_on_income, rules.cess_rate)
             
             # Round to nearest rupee
-            total_tax = round(total_tax)
+            total_tax = round_to_rupee(tax_on_income + cess)
             
+            gross_rupees = from_paise(gross_total_income)
             return {
                 'success': True,
                 'regime': regime,
-                'gross_total_income': gross_total_income,
-                'standard_deduction': self.standard_deduction,
-                'total_deductions': total_deductions,
-                'taxable_income': taxable_income,
-                'tax_on_income': tax_on_income,
-                'cess': cess,
+                'financial_year': rules.financial_year,
+                'rule_set_version': rules.version,
+                'gross_total_income': gross_rupees,
+                'standard_deduction': standard_deduction,
+                'total_deductions': from_paise(total_deductions),
+                'taxable_income': from_paise(taxable_income),
+                'tax_on_income': from_paise(tax_on_income),
+                'cess': from_paise(cess),
                 'total_tax_liability': total_tax,
-                'effective_tax_rate': round((total_tax / gross_total_income * 100), 2) if gross_total_income > 0 else 0,
-                'tax_breakdown': self._get_tax_breakdown(taxable_income, slabs)
+                'effective_tax_rate': round((total_tax / gross_rupees * 100), 2) if gross_rupees > 0 else 0,
+                'tax_breakdown': self._get_tax_breakdown(from_paise(taxable_income), slabs.as_slabs())
             }
         except Exception as e:
             logger.error(f"Error calculating income tax: {str(e)}")
@@ -101,11 +119,12 @@ class TaxComputationService:
     
     def compare_regimes(
         self,
-        income_data: Dict[str, Any]
+        income_data: Dict[str, Any],
+        financial_year: Optional[str] = None
     ) -> Dict[str, Any]:
         """Compare tax liability in both regimes and recommend."""
-        old_regime_result = self.calculate_income_tax(income_data, 'old')
-        new_regime_result = self.calculate_income_tax(income_data, 'new')
+        old_regime_result = self.calculate_income_tax(income_data, 'old', financial_year)
+        new_regime_result = self.calculate_income_tax(income_data, 'new', financial_year)
         
         if old_regime_result['success'] and new_regime_result['success']:
             old_tax = old_regime_result['total_tax_liability']
@@ -126,31 +145,239 @@ class TaxComputationService:
         else:
             return {'success': False, 'error': 'Failed to compare regimes'}
     
+    def calculate_income_tax_batch(
+        self,
+        income_data: Union[pd.DataFrame, Dict[str, Any]],
+        regime: str = 'new',
+        financial_year: Optional[str] = None
+    ) -> Dict[str, np.ndarray]:
+        """Vectorized calculate_income_tax for many taxpayers.
+
+        income_data holds one column (array-like) per income_data key of the
+        scalar method; missing columns count as zero. An optional
+        'financial_year' column picks the rule set row by row. Returns a column
+        per numeric result field, element-wise identical to calculate_income_tax.
+        """
+        columns = self._batch_columns(income_data)
+        size = len(next(iter(columns.values()))) if columns else 0
+        zeros = np.zeros(size, dtype=np.int64)
+        groups = self._rule_groups(columns, financial_year)
+        
+        # Integer paise throughout, so every step is exact and matches the scalar path
+        gross_total_income = zeros.copy()
+        for column in INCOME_COLUMNS:
+            gross_total_income += columns.get(column, zeros)
+        
+        total_deductions = zeros.copy()
+        if regime == 'old':
+            for column in DEDUCTION_COLUMNS:
+                total_deductions += columns.get(column, zeros)
+        
+        standard_deduction = zeros.copy()
+        cess_rate = np.zeros(size)
+        for rules, rows in groups:
+            standard_deduction[rows] = to_paise(rules.standard_deduction(regime))
+            cess_rate[rows] = rules.cess_rate
+        
+        taxable_income = np.maximum(0, gross_total_income - standard_deduction - total_deductions)
+        
+        tax_on_income = zeros.copy()
+        for rules, rows in groups:
+            tax_on_income[rows] = rules.slabs(regime).tax_array(taxable_income[rows])
+        
+        cess = apply_rate_array(tax_on_income, cess_rate)
+        total_tax = round_to_rupee_array(tax_on_income + cess).astype(np.float64)
+        
+        gross_rupees = from_paise_array(gross_total_income)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            effective_rate = np.where(
+                gross_rupees > 0, _round2(total_tax / gross_rupees * 100), 0
+            )
+        
+        return {
+            'gross_total_income': gross_rupees,
+            'standard_deduction': from_paise_array(standard_deduction),
+            'total_deductions': from_paise_array(total_deductions),
+            'taxable_income': from_paise_array(taxable_income),
+            'tax_on_income': from_paise_array(tax_on_income),
+            'cess': from_paise_array(cess),
+            'total_tax_liability': total_tax,
+            'effective_tax_rate': effective_rate
+        }
+    
+    def compare_regimes_batch(
+        self,
+        income_data: Union[pd.DataFrame, Dict[str, Any]],
+        financial_year: Optional[str] = None
+    ) -> pd.DataFrame:
+        """Vectorized compare_regimes: one row per taxpayer with both regimes and the recommendation."""
+        old = self.calculate_income_tax_batch(income_data, 'old', financial_year)
+        new = self.calculate_income_tax_batch(income_data, 'new', financial_year)
+        
+        old_tax = old['total_tax_liability']
+        new_tax = new['total_tax_liability']
+        savings = np.abs(old_tax - new_tax)
+        higher_tax = np.maximum(old_tax, new_tax)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            savings_percentage = np.where(higher_tax > 0, _round2(savings / higher_tax * 100), 0)
+        
+        result = pd.DataFrame({
+            'old_taxable_income': old['taxable_income'],
+            'old_total_tax_liability': old_tax,
+            'old_effective_tax_rate': old['effective_tax_rate'],
+            'new_taxable_income': new['taxable_income'],
+            'new_total_tax_liability': new_tax,
+            'new_effective_tax_rate': new['effective_tax_rate'],
+            'recommended_regime': np.where(new_tax < old_tax, 'new', 'old'),
+            'tax_savings': savings,
+            'savings_percentage': savings_percentage
+        })
+        if isinstance(income_data, pd.DataFrame):
+            result.index = income_data.index
+        return result
+    
+    def optimize_deductions(
+        self,
+        income_data: Dict[str, Any],
+        budget: float,
+        step: float = 5000,
+        financial_year: Optional[str] = None,
+        limits: Optional[Dict[str, float]] = None
+    ) -> Dict[str, Any]:
+        """Search 80C / 80D / 80CCD(1B) allocations of an investment budget for the lowest tax.
+
+        Every allocation on a grid of `step` rupees is priced in one batch call.
+        Amounts already claimed in income_data count towards each section's limit;
+        NPS under 80CCD(1B) is read from 'deductions_80ccd_1b' and taxed as part
+        of other_deductions. The current position is taxed on the claims as
+        given, as compare_regimes does, even where they exceed the limits.
+        Raises ValueError for a negative budget or a step that is not positive.
+        """
+        if budget < 0:
+            raise ValueError("budget must not be negative")
+        if step <= 0:
+            raise ValueError("step must be positive")
+        try:
+            rules = self.rules.get(financial_year)
+            limits = {**rules.deduction_limits, **(limits or {})}
+            existing = {
+                '80c': income_data.get('deductions_80c', 0),
+                '80d': income_data.get('deductions_80d', 0),
+                '80ccd_1b': income_data.get('deductions_80ccd_1b', 0)
+            }
+            
+            # Additional investment options per section, capped by its remaining limit and the budget
+            axes = []
+            for section in DEDUCTION_SECTIONS:
+                headroom = max(0, min(limits[section] - existing[section], budget))
+                axes.append(np.unique(np.append(np.arange(0, headroom, step), headroom)))
+            if np.prod([len(axis) for axis in axes]) > MAX_OPTIMIZER_PLANS:
+                raise ValueError("Step too small for the budget; use a larger step")
+            grid = [axis.ravel() for axis in np.meshgrid(*axes, indexing='ij')]
+            investment = grid[0] + grid[1] + grid[2]
+            within_budget = investment <= budget
+            add_80c, add_80d, add_nps = (axis[within_budget] for axis in grid)
+            investment = investment[within_budget]
+            
+            size = len(investment)
+            frame = {
+                column: np.full(size, income_data.get(column, 0))
+                for column in INCOME_COLUMNS + ['deductions_80g']
+            }
+            frame['deductions_80c'] = np.minimum(existing['80c'] + add_80c, limits['80c'])
+            frame['deductions_80d'] = np.minimum(existing['80d'] + add_80d, limits['80d'])
+            frame['other_deductions'] = income_data.get('other_deductions', 0) + np.minimum(
+                existing['80ccd_1b'] + add_nps, limits['80ccd_1b']
+            )
+            old_tax = self.calculate_income_tax_batch(frame, 'old', financial_year)['total_tax_liability']
+            new_tax = self.calculate_income_tax(self._with_nps(income_data), 'new', financial_year)['total_tax_liability']
+            # Grid row 0 caps existing claims at the limits; the current position does not
+            current_old_tax = float(
+                self.calculate_income_tax(self._with_nps(income_data), 'old', financial_year)['total_tax_liability']
+            )
+            
+            # Lowest tax first, then the smallest investment achieving it
+            best = int(np.lexsort((investment, old_tax))[0])
+            current_tax = min(current_old_tax, new_tax)
+            
+            if old_tax[best] < new_tax:
+                best_plan = {
+                    'regime': 'old',
+                    'invest_80c': float(add_80c[best]),
+                    'invest_80d': float(add_80d[best]),
+                    'invest_80ccd_1b': float(add_nps[best]),
+                    'total_investment': float(investment[best]),
+                    'total_tax_liability': float(old_tax[best])
+                }
+            else:
+                best_plan = {
+                    'regime': 'new',
+                    'invest_80c': 0.0,
+                    'invest_80d': 0.0,
+                    'invest_80ccd_1b': 0.0,
+                    'total_investment': 0.0,
+                    'total_tax_liability': float(new_tax)
+                }
+            best_plan['tax_saved'] = current_tax - best_plan['total_tax_liability']
+            
+            # Lowest old-regime tax reachable at each investment level
+            curve = pd.Series(old_tax).groupby(investment).min()
+            break_even = self._regime_break_even(income_data, new_tax, financial_year)
+            max_investable = float(investment.max())
+            
+            return {
+                'success': True,
+                'financial_year': rules.financial_year,
+                'rule_set_version': rules.version,
+                'plans_evaluated': size,
+                'deduction_limits': limits,
+                'current': {
+                    'old_regime_tax': current_old_tax,
+                    'new_regime_tax': float(new_tax)
+                },
+                'best_plan': best_plan,
+                'break_even': {
+                    'additional_deductions': break_even,
+                    'reachable': break_even is not None and break_even <= max_investable
+                },
+                'savings_curve': [
+                    {'total_investment': float(level), 'old_regime_tax': float(tax)}
+                    for level, tax in curve.items()
+                ]
+            }
+        except Exception as e:
+            logger.error(f"Error optimizing deductions: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
     def calculate_depreciation(
         self,
         assets: List[Dict[str, Any]],
-        method: str = 'wdv'  # Written Down Value
+        method: str = 'wdv',  # Written Down Value
+        financial_year: Optional[str] = None
     ) -> Dict[str, Any]:
         """Calculate depreciation as per Income Tax Act."""
         try:
+            depreciation_rates = self.rules.get(financial_year).depreciation_rates
             depreciation_schedule = []
-            total_depreciation = 0
+            total_depreciation = 0  # in paise
             
             for asset in assets:
                 asset_type = asset.get('type', 'plant_machinery')
                 opening_wdv = asset.get('opening_wdv', 0)
                 additions = asset.get('additions', 0)
+                block = to_paise(opening_wdv) + to_paise(additions)
                 
                 # Get depreciation rate
-                rate = self.depreciation_rates.get(asset_type, 0.15)
+                rate = depreciation_rates.get(asset_type, 0.15)
                 
-                # Calculate depreciation
+                # Calculate depreciation, in paise
                 if method == 'wdv':  # Written Down Value method
-                    depreciation = (opening_wdv + additions) * rate
+                    depreciation = apply_rate(block, rate)
                 else:  # Straight Line Method (rarely used in IT Act)
-                    depreciation = (opening_wdv / asset.get('useful_life', 10))
+                    # Useful life to a thousandth of a year, so fractional lives divide exactly
+                    depreciation = prorate(to_paise(opening_wdv), 1000, round(asset.get('useful_life', 10) * 1000))
                 
-                closing_wdv = opening_wdv + additions - depreciation
+                closing_wdv = block - depreciation
                 
                 depreciation_schedule.append({
                     'asset_name': asset.get('name', 'Unnamed Asset'),
@@ -158,8 +385,8 @@ class TaxComputationService:
                     'opening_wdv': opening_wdv,
                     'additions': additions,
                     'depreciation_rate': rate * 100,
-                    'depreciation': round(depreciation, 2),
-                    'closing_wdv': round(closing_wdv, 2)
+                    'depreciation': from_paise(depreciation),
+                    'closing_wdv': from_paise(closing_wdv)
                 })
                 
                 total_depreciation += depreciation
@@ -168,7 +395,7 @@ class TaxComputationService:
                 'success': True,
                 'method': method,
                 'depreciation_schedule': depreciation_schedule,
-                'total_depreciation': round(total_depreciation, 2)
+                'total_depreciation': from_paise(total_depreciation)
             }
         except Exception as e:
             logger.error(f"Error calculating depreciation: {str(e)}")
@@ -183,8 +410,8 @@ class TaxComputationService:
             asset_type = transaction.get('asset_type', 'equity')  # equity, property, etc.
             purchase_price = transaction.get('purchase_price', 0)
             sale_price = transaction.get('sale_price', 0)
-            purchase_date = transaction.get('purchase_date')
-            sale_date = transaction.get('sale_date')
+            purchase_date = _as_date(transaction.get('purchase_date'))
+            sale_date = _as_date(transaction.get('sale_date'))
             
             # Calculate holding period
             if purchase_date and sale_date:
@@ -193,40 +420,36 @@ class TaxComputationService:
                 holding_days = transaction.get('holding_days', 0)
             
             # Determine if short-term or long-term
-            if asset_type == 'equity':
-                is_long_term = holding_days > 365  # > 1 year for equity
-            elif asset_type == 'property':
-                is_long_term = holding_days > 730  # > 2 years for property
-            else:
-                is_long_term = holding_days > 1095  # > 3 years for other assets
+            is_long_term = self.is_long_term(asset_type, holding_days)
             
-            # Calculate indexed cost for long-term property
-            indexed_cost = purchase_price
+            # Calculate indexed cost for long-term property, in paise
+            indexed_cost = to_paise(purchase_price)
             if is_long_term and asset_type == 'property':
                 cii_purchase = transaction.get('cost_inflation_index_purchase', 100)
                 cii_sale = transaction.get('cost_inflation_index_sale', 110)
-                indexed_cost = purchase_price * (cii_sale / cii_purchase)
+                # Cost inflation indices are whole numbers
+                indexed_cost = prorate(indexed_cost, round(cii_sale), round(cii_purchase))
             
             # Calculate capital gain
-            capital_gain = sale_price - indexed_cost
+            capital_gain = to_paise(sale_price) - indexed_cost
             
             # Calculate tax
             if is_long_term:
                 if asset_type == 'equity':
                     # LTCG on equity: 10% above 1 lakh
-                    exempt_amount = 100000
+                    exempt_amount = to_paise(100000)
                     taxable_gain = max(0, capital_gain - exempt_amount)
-                    tax = taxable_gain * 0.10
+                    tax = apply_rate(taxable_gain, 0.10)
                 elif asset_type == 'property':
                     # LTCG on property: 20% with indexation
-                    tax = capital_gain * 0.20
+                    tax = apply_rate(capital_gain, 0.20)
                 else:
-                    tax = capital_gain * 0.20
+                    tax = apply_rate(capital_gain, 0.20)
             else:
                 # STCG: Added to income and taxed at slab rates
                 # Or 15% for equity (if listed)
                 if asset_type == 'equity':
-                    tax = capital_gain * 0.15
+                    tax = apply_rate(capital_gain, 0.15)
                 else:
                     tax = 0  # Will be added to total income
             
@@ -237,30 +460,34 @@ class TaxComputationService:
                 'is_long_term': is_long_term,
                 'purchase_price': purchase_price,
                 'sale_price': sale_price,
-                'indexed_cost': round(indexed_cost, 2),
-                'capital_gain': round(capital_gain, 2),
-                'tax_on_capital_gain': round(tax, 2),
+                'indexed_cost': from_paise(indexed_cost),
+                'capital_gain': from_paise(capital_gain),
+                'tax_on_capital_gain': from_paise(tax),
                 'type': 'Long-term' if is_long_term else 'Short-term'
             }
         except Exception as e:
             logger.error(f"Error calculating capital gains: {str(e)}")
             return {'success': False, 'error': str(e)}
     
+    def is_long_term(self, asset_type: str, holding_days: int) -> bool:
+        """Whether a holding period makes the gain long-term for the asset type."""
+        return holding_days > LONG_TERM_HOLDING_DAYS.get(asset_type, LONG_TERM_HOLDING_DAYS['other'])
+    
     def calculate_gst_liability(
         self,
         transactions: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """Calculate GST liability for a period."""
         try:
-            output_gst = 0  # GST collected on sales
-            input_gst = 0   # GST paid on purchases
+            output_gst = 0  # GST collected on sales, in paise
+            input_gst = 0   # GST paid on purchases, in paise
             
             for txn in transactions:
                 txn_type = txn.get('type', 'sale')  # sale or purchase
-                amount = txn.get('amount', 0)
+                amount = to_paise(txn.get('amount', 0))
                 gst_rate = txn.get('gst_rate', 0.18)  # 18% default
                 
-                gst_amount = amount * gst_rate
+                gst_amount = apply_rate(amount, gst_rate)
                 
                 if txn_type == 'sale':
                     output_gst += gst_amount
@@ -270,21 +497,21 @@ class TaxComputationService:
             # GST liability = Output GST - Input Tax Credit
             gst_liability = output_gst - input_gst
             
-            # Split into CGST and SGST (50-50)
-            cgst = gst_liability / 2
-            sgst = gst_liability / 2
+            # Split into CGST and SGST (50-50); any odd paisa goes to CGST
+            cgst = prorate(gst_liability, 1, 2)
+            sgst = gst_liability - cgst
             
             return {
                 'success': True,
-                'output_gst': round(output_gst, 2),
-                'input_gst': round(input_gst, 2),
-                'input_tax_credit': round(input_gst, 2),
-                'net_gst_liability': round(gst_liability, 2),
-                'cgst': round(cgst, 2),
-                'sgst': round(sgst, 2),
+                'output_gst': from_paise(output_gst),
+                'input_gst': from_paise(input_gst),
+                'input_tax_credit': from_paise(input_gst),
+                'net_gst_liability': from_paise(gst_liability),
+                'cgst': from_paise(cgst),
+                'sgst': from_paise(sgst),
                 'payment_required': gst_liability > 0,
                 'refund_due': gst_liability < 0,
-                'refund_amount': round(abs(gst_liability), 2) if gst_liability < 0 else 0
+                'refund_amount': from_paise(abs(gst_liability)) if gst_liability < 0 else 0
             }
         except Exception as e:
             logger.error(f"Error calculating GST: {str(e)}")
@@ -292,37 +519,21 @@ class TaxComputationService:
     
     def calculate_tds(
         self,
-        payment_data: Dict[str, Any]
+        payment_data: Dict[str, Any],
+        financial_year: Optional[str] = None
     ) -> Dict[str, Any]:
         """Calculate TDS to be deducted."""
         try:
             payment_type = payment_data.get('type', 'professional_fees')  # salary, professional_fees, rent, etc.
             amount = payment_data.get('amount', 0)
+            rules = self.rules.get(financial_year)
             
-            # TDS rates
-            tds_rates = {
-                'salary': 0,  # As per slab
-                'professional_fees': 0.10,  # 10% (Section 194J)
-                'contract': 0.02,  # 2% (Section 194C) - Individual/HUF
-                'contract_company': 0.01,  # 1% (Section 194C) - Company
-                'rent': 0.10,  # 10% (Section 194I)
-                'commission': 0.05,  # 5% (Section 194H)
-                'interest': 0.10,  # 10% (Section 194A)
-                'dividend': 0.10  # 10% (Section 194)
-            }
-            
-            tds_rate = tds_rates.get(payment_type, 0.10)
-            tds_amount = amount * tds_rate
+            # TDS rates (salary is taxed at slab rates, so 0 here)
+            tds_rate = rules.tds_rates.get(payment_type, 0.10)
+            tds_amount = apply_rate(to_paise(amount), tds_rate)
             
             # Check threshold limits
-            thresholds = {
-                'professional_fees': 30000,
-                'rent': 240000,  # Per year
-                'commission': 15000,
-                'interest': 40000  # For bank interest
-            }
-            
-            threshold = thresholds.get(payment_type, 0)
+            threshold = rules.tds_thresholds.get(payment_type, 0)
             tds_applicable = amount >= threshold
             
             return {
@@ -330,24 +541,38 @@ class TaxComputationService:
                 'payment_type': payment_type,
                 'amount': amount,
                 'tds_rate': tds_rate * 100,
-                'tds_amount': round(tds_amount, 2) if tds_applicable else 0,
+                'tds_amount': from_paise(tds_amount) if tds_applicable else 0,
                 'tds_applicable': tds_applicable,
                 'threshold': threshold,
-                'net_payment': round(amount - (tds_amount if tds_applicable else 0), 2)
+                'net_payment': from_paise(to_paise(amount) - (tds_amount if tds_applicable else 0))
             }
         except Exception as e:
             logger.error(f"Error calculating TDS: {str(e)}")
             return {'success': False, 'error': str(e)}
     
     # Helper methods
-    def _calculate_tax_from_slabs(self, income: float, slabs: List[Dict]) -> float:
-        """Calculate tax based on slab rates."""
-        tax = 0
-        for slab in slabs:
-            if income > slab['min']:
-                taxable_in_slab = min(income, slab['max']) - slab['min']
-                tax += taxable_in_slab * slab['rate']
-        return tax
+    def _batch_columns(self, income_data: Union[pd.DataFrame, Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        """Int64 paise arrays for the income and deduction columns present in the input."""
+        columns = {}
+        for column in INCOME_COLUMNS + DEDUCTION_COLUMNS:
+            if column in income_data:
+                values = np.asarray(income_data[column])
+                if not np.issubdtype(values.dtype, np.integer):
+                    values = np.nan_to_num(values.astype(np.float64), nan=0.0)
+                columns[column] = to_paise_array(values)
+        if 'financial_year' in income_data:
+            columns['financial_year'] = np.asarray(income_data['financial_year'], dtype=object)
+        return columns
+    
+    def _rule_groups(self, columns: Dict[str, np.ndarray], financial_year: Optional[str]) -> List[tuple]:
+        """(rule set, row selector) pairs covering every row of a batch."""
+        years = columns.get('financial_year')
+        if years is None:
+            return [(self.rules.get(financial_year), slice(None))]
+        return [
+            (self.rules.get(year), np.flatnonzero(years == year))
+            for year in pd.unique(years)
+        ]
     
     def _get_tax_breakdown(self, income: float, slabs: List[Dict]) -> List[Dict]:
         """Get detailed tax breakdown by slabs."""
@@ -365,6 +590,38 @@ class TaxComputationService:
                     })
         return breakdown
     
+    def _with_nps(self, income_data: Dict[str, Any]) -> Dict[str, Any]:
+        """income_data with any 80CCD(1B) amount folded into other_deductions."""
+        nps = income_data.get('deductions_80ccd_1b', 0)
+        return {**income_data, 'other_deductions': income_data.get('other_deductions', 0) + nps}
+    
+    def _regime_break_even(
+        self,
+        income_data: Dict[str, Any],
+        new_tax: float,
+        financial_year: Optional[str]
+    ) -> Optional[float]:
+        """Smallest extra old-regime deduction (whole rupees) at which the old regime costs no more than the new."""
+        base = self._with_nps(income_data)
+        
+        def old_tax(extra: int) -> float:
+            data = {**base, 'other_deductions': base['other_deductions'] + extra}
+            return self.calculate_income_tax(data, 'old', financial_year)['total_tax_liability']
+        
+        if old_tax(0) <= new_tax:
+            return 0.0
+        # Old-regime tax never rises as deductions grow, so bisect on the extra amount
+        low, high = 0, int(sum(income_data.get(column, 0) for column in INCOME_COLUMNS)) + 1
+        if old_tax(high) > new_tax:
+            return None
+        while high - low > 1:
+            middle = (low + high) // 2
+            if old_tax(middle) <= new_tax:
+                high = middle
+            else:
+                low = middle
+        return float(high)
+    
     def _get_recommendation_reason(self, old_tax: float, new_tax: float, income_data: Dict) -> str:
         """Get reason for regime recommendation."""
         deductions = income_data.get('deductions_80c', 0) + income_data.get('deductions_80d', 0)
@@ -0,0 +1,117 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional
+
+from tax_computation_service import tax_computation_service
+from tax_rule_registry import tax_rule_registry
+
+logger = logging.getLogger(__name__)
+
+# Service methods callable through the pool
+TAX_METHODS = {
+    "calculate_income_tax", "compare_regimes", "optimize_deductions", "calculate_depreciation",
+    "calculate_capital_gains", "calculate_gst_liability", "calculate_tds"
+}
+
+
+def _run_method(method: str, kwargs: Dict[str, Any], rules_version: str) -> Dict[str, Any]:
+    """Call a tax computation method. Executed inside the worker processes.
+
+    A worker whose rules are older than the version the result is cached
+    under reads the rule files again before computing.
+    """
+    if tax_rule_registry.get(kwargs.get("financial_year")).version != rules_version:
+        tax_rule_registry.reload()
+    return getattr(tax_computation_service, method)(**kwargs)
+
+
+class TaxExecutor:
+    """Runs tax computations on a process pool, memoizing results in an LRU.
+
+    The cache key is a hash of the method, its canonical JSON arguments and
+    the version of the rule set they are computed under. The registry picks
+    up edited rule files within TAX_RULES_CHECK_INTERVAL seconds, and the
+    workers are handed the version to compute under, so bumping a rule
+    file's version stops its cached results being served from then on.
+    Identical requests arriving together share one computation.
+    """
+
+    def __init__(self):
+        self.max_workers = int(os.environ.get('TAX_WORKERS', os.cpu_count() or 2))
+        self.cache_size = int(os.environ.get('TAX_CACHE_SIZE', 2048))
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Create the worker pool on first use."""
+        if self._pool is None:
+            # spawn keeps the workers free of the parent's Mongo/scheduler threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    def cache_key(self, method: str, kwargs: Dict[str, Any], rules_version: Optional[str] = None) -> str:
+        rules = tax_rule_registry.get(kwargs.get("financial_year"))
+        payload = json.dumps(
+            {"method": method, "args": kwargs, "rules": [rules.financial_year, rules_version or rules.version]},
+            sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def run(self, method: str, **kwargs) -> Dict[str, Any]:
+        """Result of tax_computation_service.<method>(**kwargs), from cache when possible."""
+        if method not in TAX_METHODS:
+            raise ValueError(f"Unknown tax computation: {method}")
+        rules_version = tax_rule_registry.get(kwargs.get("financial_year")).version
+        key = self.cache_key(method, kwargs, rules_version)
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(self._cache[key])
+        if key in self._pending:
+            self.hits += 1
+            return copy.deepcopy(await asyncio.shield(self._pending[key]))
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_pool(), _run_method, method, kwargs, rules_version)
+        self._pending[key] = future
+        try:
+            result = await future
+        finally:
+            del self._pending[key]
+
+        # Errors are not cached; a retry recomputes
+        if result.get("success"):
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return copy.deepcopy(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        self._cache.clear()
+
+    def shutdown(self):
+        """Stop the worker pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+# Global tax executor
+tax_executor = TaxExecutor()
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from money import to_paise, apply_rate, apply_rate_array
+
+logger = logging.getLogger(__name__)
+
+# Rule set used when no financial year is given
+DEFAULT_FINANCIAL_YEAR = "FY2024-25"
+# Seconds between checks of the rule files for edits
+RULES_CHECK_INTERVAL = float(os.environ.get('TAX_RULES_CHECK_INTERVAL', 5))
+
+
+def normalize_financial_year(financial_year: Optional[str]) -> str:
+    """Accept "FY2024-25", "2024-25" or "2024-2025" and return "FY2024-25"."""
+    if not financial_year:
+        return DEFAULT_FINANCIAL_YEAR
+    code = financial_year.strip().upper()
+    if code.startswith("FY"):
+        code = code[2:]
+    start, _, end = code.partition("-")
+    return f"FY{start}-{end[-2:]}"
+
+
+def fy_start_year(date) -> int:
+    """Starting calendar year of the financial year containing a date."""
+    return date.year if date.month >= 4 else date.year - 1
+
+
+def fy_code(start_year: int) -> str:
+    return f"FY{start_year}-{str(start_year + 1)[2:]}"
+
+
+def fy_code_start_year(code: str) -> int:
+    return int(code[2:6])
+
+
+class SlabTable:
+    """Slabs compiled into cumulative tax (in paise) at each slab start.
+
+    Tax on an income is one bisect for its slab plus one rate application for
+    the part above the slab start.
+    """
+
+    def __init__(self, slabs: List[Dict[str, Any]]):
+        self.definition = slabs
+        self.starts = [to_paise(slab["from"]) for slab in slabs]
+        self.rates = [float(slab["rate"]) for slab in slabs]
+        self.cumulative = [0]
+        for index in range(1, len(slabs)):
+            width = self.starts[index] - self.starts[index - 1]
+            self.cumulative.append(self.cumulative[-1] + apply_rate(width, self.rates[index - 1]))
+
+        self.starts_array = np.array(self.starts, dtype=np.int64)
+        self.rates_array = np.array(self.rates)
+        self.cumulative_array = np.array(self.cumulative, dtype=np.int64)
+
+    def tax(self, income: int) -> int:
+        """Slab tax in paise on an income in paise."""
+        if income <= 0:
+            return 0
+        index = bisect_right(self.starts, income) - 1
+        return self.cumulative[index] + apply_rate(income - self.starts[index], self.rates[index])
+
+    def tax_array(self, incomes: np.ndarray) -> np.ndarray:
+        """Slab tax on an int64 array of incomes in paise; element-wise identical to tax()."""
+        index = np.maximum(np.searchsorted(self.starts_array, incomes, side="right") - 1, 0)
+        tax = self.cumulative_array[index] + apply_rate_array(
+            incomes - self.starts_array[index], self.rates_array[index]
+        )
+        return np.where(incomes > 0, tax, 0)
+
+    def as_slabs(self) -> List[Dict[str, Any]]:
+        """Slabs as min/max/rate dicts."""
+        starts = [slab["from"] for slab in self.definition]
+        ends = starts[1:] + [float("inf")]
+        return [
+            {"min": start, "max": end, "rate": slab["rate"]}
+            for start, end, slab in zip(starts, ends, self.definition)
+        ]
+
+
+class TaxRuleSet:
+    """Tax rules of one financial year, compiled for computation."""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.financial_year = normalize_financial_year(data["financial_year"])
+        self.assessment_year = data.get("assessment_year")
+        self.version = data["version"]
+        self.cess_rate = data["cess_rate"]
+        self.regimes = {
+            regime: {
+                "standard_deduction": rules["standard_deduction"],
+                "slabs": SlabTable(rules["slabs"])
+            }
+            for regime, rules in data["regimes"].items()
+        }
+        # Caps on Chapter VI-A deductions (old regime only), e.g. 80C, 80D, 80CCD(1B)
+        self.deduction_limits: Dict[str, float] = data.get("deduction_limits", {})
+        self.depreciation_rates: Dict[str, float] = data.get("depreciation_rates", {})
+        self.tds_rates: Dict[str, float] = data.get("tds_rates", {})
+        self.tds_thresholds: Dict[str, float] = data.get("tds_thresholds", {})
+
+    def slabs(self, regime: str) -> SlabTable:
+        return self.regimes[regime]["slabs"]
+
+    def standard_deduction(self, regime: str) -> float:
+        return self.regimes[regime]["standard_deduction"]
+
+
+class TaxRuleRegistry:
+    """Rule sets keyed by financial year, read from JSON files and kept compiled.
+
+    The files' modification times are checked every RULES_CHECK_INTERVAL
+    seconds and the rule sets are read again when one changed, so an edited
+    file takes effect without a restart. An edit that does not load keeps
+    the previous rule sets in use.
+    """
+
+    def __init__(self):
+        self.rules_dir = Path(os.environ.get(
+            'TAX_RULES_DIR', Path(__file__).parent / 'tax_rules'
+        ))
+        self._rule_sets: Optional[Dict[str, TaxRuleSet]] = None
+        self._signature: Optional[tuple] = None
+        self._next_check = 0.0
+
+    def _file_signature(self) -> tuple:
+        return tuple((path.name, path.stat().st_mtime_ns) for path in sorted(self.rules_dir.glob("*.json")))
+
+    def _read(self, signature: tuple) -> Dict[str, TaxRuleSet]:
+        rule_sets = {}
+        for name, _ in signature:
+            with open(self.rules_dir / name) as handle:
+                rule_set = TaxRuleSet(json.load(handle))
+            rule_sets[rule_set.financial_year] = rule_set
+        logger.info(f"Loaded tax rules for {', '.join(rule_sets) or 'no years'}")
+        return rule_sets
+
+    def _load(self) -> Dict[str, TaxRuleSet]:
+        now = time.monotonic()
+        if self._rule_sets is None:
+            signature = self._file_signature()
+            self._rule_sets = self._read(signature)
+            self._signature, self._next_check = signature, now + RULES_CHECK_INTERVAL
+        elif now >= self._next_check:
+            self._next_check = now + RULES_CHECK_INTERVAL
+            signature = self._file_signature()
+            if signature != self._signature:
+                try:
+                    self._rule_sets = self._read(signature)
+                    self._signature = signature
+                except Exception as e:
+                    logger.error(f"Keeping previous tax rules, edited files did not load: {str(e)}")
+        return self._rule_sets
+
+    def get(self, financial_year: Optional[str] = None) -> TaxRuleSet:
+        """Rule set of a financial year; the default year when none is given."""
+        code = normalize_financial_year(financial_year)
+        rule_sets = self._load()
+        if code not in rule_sets:
+            raise ValueError(f"No tax rules for {code}")
+        return rule_sets[code]
+
+    def financial_years(self) -> List[str]:
+        return sorted(self._load())
+
+    def reload(self):
+        """Drop compiled rule sets so the files are read again on next use."""
+        self._rule_sets = None
+
+# Global tax rule registry
+tax_rule_registry = TaxRuleRegistry()
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, date, timezone
+from io import BytesIO
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import pandas as pd
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from money import to_paise, to_paise_array, from_paise, apply_rate, apply_rate_array
+from tax_rule_registry import tax_rule_registry, fy_start_year, fy_code
+
+logger = logging.getLogger(__name__)
+
+# Accumulator updates in flight at once during an import
+IMPORT_CONCURRENCY = 20
+# Ledger date formats, day first as Indian ledgers are written; ISO is tried last
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%d-%b-%Y", "%d %b %Y"]
+
+
+def _parse_date(value) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    text = str(value).strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return datetime.fromisoformat(text)
+
+
+def _import_id(content) -> str:
+    """Fingerprint of a ledger, so a retried import is recognized."""
+    if not isinstance(content, bytes):
+        content = json.dumps(content, sort_keys=True, default=str).encode()
+    return hashlib.sha256(content).hexdigest()[:24]
+
+
+class TDSLedgerService:
+    """Running totals paid per (deductor, deductee PAN, section, FY).
+
+    Thresholds such as rent at 2,40,000 apply to the year's cumulative
+    payments. TDS owed is a function of the cumulative total alone, so each
+    payment is one atomic $inc of the total; the payment's TDS is the owed
+    amount after it minus the owed amount before it. Concurrent payments
+    get disjoint slices of the running total, so their deductions add up
+    to exactly the TDS on the year's total.
+
+    An imported ledger is applied to each accumulator at most once: the
+    accumulator records the ledger's fingerprint with the opening total it
+    was applied on, so a retry after a partial failure only applies the
+    accumulators it had not reached, and reports the same TDS for the rest.
+    """
+
+    async def ensure_indexes(self, db):
+        """Create the unique accumulator key."""
+        await db.tds_ledgers.create_index(
+            [("deductor_id", 1), ("deductee_pan", 1), ("section", 1), ("financial_year", 1)],
+            unique=True
+        )
+
+    def _owed(self, totals: np.ndarray, rate: float, threshold: int) -> np.ndarray:
+        """Cumulative TDS in paise owed on cumulative payments in paise."""
+        return np.where(totals >= threshold, apply_rate_array(totals, rate), 0)
+
+    def _deductions(self, opening: int, amounts: np.ndarray, rate: float, threshold: int) -> tuple:
+        """Cumulative totals, TDS and threshold crossings of a run of payments after an opening total."""
+        cumulative = opening + np.cumsum(amounts)
+        owed = self._owed(cumulative, rate, threshold)
+        owed_before = np.concatenate(([int(self._owed(np.array([opening]), rate, threshold)[0])], owed[:-1]))
+        crossed = (cumulative - amounts < threshold) & (cumulative >= threshold)
+        return cumulative, owed - owed_before, crossed
+
+    async def _accumulate(
+        self,
+        db,
+        deductor_id: str,
+        deductee_pan: str,
+        section: str,
+        financial_year: str,
+        amounts: np.ndarray,
+        import_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Add a run of payments to one accumulator and work out TDS for each, in order."""
+        rules = tax_rule_registry.get(financial_year)
+        rate = rules.tds_rates.get(section, 0.10)
+        threshold = to_paise(rules.tds_thresholds.get(section, 0))
+        scope = {
+            "deductor_id": deductor_id,
+            "deductee_pan": deductee_pan,
+            "section": section,
+            "financial_year": financial_year
+        }
+
+        already_recorded = False
+        if import_id is None:
+            batch_total = int(amounts.sum())
+            ledger = await db.tds_ledgers.find_one_and_update(
+                scope,
+                {
+                    "$inc": {"total_paid_paise": batch_total, "payments": len(amounts)},
+                    "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection={"_id": 0, "total_paid_paise": 1}
+            )
+            opening = ledger["total_paid_paise"] - batch_total
+        else:
+            opening, already_recorded = await self._apply_import(db, scope, amounts, import_id)
+        cumulative, deductions, crossed = self._deductions(opening, amounts, rate, threshold)
+
+        results = []
+        for index, amount in enumerate(amounts.tolist()):
+            tds = int(deductions[index])
+            # On the payment that crosses the threshold, TDS on the earlier payments is deducted too
+            catch_up = tds - apply_rate(amount, rate) if crossed[index] and threshold > 0 else 0
+            results.append({
+                "deductee_pan": deductee_pan,
+                "section": section,
+                "financial_year": financial_year,
+                "amount": from_paise(amount),
+                "tds_rate": rate * 100,
+                "threshold": from_paise(threshold),
+                "cumulative_paid": from_paise(int(cumulative[index])),
+                "tds_applicable": bool(cumulative[index] >= threshold),
+                "tds_amount": from_paise(tds),
+                "catch_up_amount": from_paise(max(catch_up, 0)),
+                "net_payment": from_paise(amount - tds),
+                "already_recorded": already_recorded
+            })
+        return results
+
+    async def _apply_import(self, db, scope: Dict[str, Any], amounts: np.ndarray, import_id: str) -> tuple:
+        """Add an imported run to an accumulator once; (opening total, whether it was already applied).
+
+        The total is compared and swapped together with the import's marker,
+        so a concurrent record_payment makes this retry rather than lose either update.
+        """
+        marker = f"imports.{import_id}"
+        batch_total = int(amounts.sum())
+        while True:
+            ledger = await db.tds_ledgers.find_one(scope, {"_id": 0, "total_paid_paise": 1, marker: 1})
+            if ledger is None:
+                try:
+                    await db.tds_ledgers.insert_one({
+                        **scope,
+                        "total_paid_paise": batch_total,
+                        "payments": len(amounts),
+                        "imports": {import_id: 0},
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    })
+                    return 0, False
+                except DuplicateKeyError:
+                    continue
+            if import_id in ledger.get("imports", {}):
+                return ledger["imports"][import_id], True
+
+            opening = ledger["total_paid_paise"]
+            result = await db.tds_ledgers.update_one(
+                {**scope, "total_paid_paise": opening, marker: {"$exists": False}},
+                {
+                    "$inc": {"total_paid_paise": batch_total, "payments": len(amounts)},
+                    "$set": {marker: opening, "updated_at": datetime.now(timezone.utc).isoformat()}
+                }
+            )
+            if result.modified_count:
+                return opening, False
+
+    def _payment_date(self, payment: Dict[str, Any]) -> Optional[datetime]:
+        return _parse_date(payment["payment_date"]) if payment.get("payment_date") else None
+
+    def _key(self, payment: Dict[str, Any], payment_date: Optional[datetime] = None) -> tuple:
+        pan = str(payment["deductee_pan"]).strip().upper()
+        section = payment.get("section") or payment.get("type") or "professional_fees"
+        if payment.get("financial_year"):
+            financial_year = payment["financial_year"]
+        else:
+            payment_date = payment_date or self._payment_date(payment) or datetime.now(timezone.utc)
+            financial_year = fy_code(fy_start_year(payment_date))
+        return pan, section, tax_rule_registry.get(financial_year).financial_year
+
+    async def record_payment(self, db, deductor_id: str, payment: Dict[str, Any]) -> Dict[str, Any]:
+        """Record one payment and return the TDS to deduct from it."""
+        try:
+            pan, section, financial_year = self._key(payment)
+            results = await self._accumulate(
+                db, deductor_id, pan, section, financial_year,
+                np.array([to_paise(payment["amount"])], dtype=np.int64)
+            )
+            return {"success": True, **results[0]}
+        except Exception as e:
+            logger.error(f"Error recording TDS payment: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def import_payments(
+        self,
+        db,
+        deductor_id: str,
+        payments: List[Dict[str, Any]],
+        import_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Record a ledger of payments, e.g. a quarter, with one update per accumulator.
+
+        Payments are taken in date order within each deductee and section.
+        Importing the same ledger again does not add its payments twice.
+        """
+        try:
+            import_id = import_id or _import_id(payments)
+            groups: Dict[tuple, List[int]] = {}
+            dates = [self._payment_date(payment) for payment in payments]
+            keys = [self._key(payment, payment_date) for payment, payment_date in zip(payments, dates)]
+            # Undated payments first, as they sorted before; dates compared without time zone
+            order = sorted(
+                range(len(payments)),
+                key=lambda index: dates[index].replace(tzinfo=None) if dates[index] else datetime.min
+            )
+            for index in order:
+                groups.setdefault(keys[index], []).append(index)
+            amounts = to_paise_array(np.array([float(payment["amount"]) for payment in payments]))
+
+            semaphore = asyncio.Semaphore(IMPORT_CONCURRENCY)
+
+            async def accumulate(key, indices):
+                async with semaphore:
+                    return indices, await self._accumulate(db, deductor_id, *key, amounts[indices], import_id)
+
+            results: List[Optional[Dict[str, Any]]] = [None] * len(payments)
+            for indices, group_results in await asyncio.gather(
+                *(accumulate(key, indices) for key, indices in groups.items())
+            ):
+                for index, result in zip(indices, group_results):
+                    results[index] = {**result, "payment_date": payments[index].get("payment_date")}
+
+            return {
+                "success": True,
+                "import_id": import_id,
+                "payments": len(payments),
+                "already_recorded": sum(result["already_recorded"] for result in results),
+                "accumulators_updated": len(groups),
+                "total_tds": from_paise(sum(to_paise(result["tds_amount"]) for result in results)),
+                "total_catch_up": from_paise(sum(to_paise(result["catch_up_amount"]) for result in results)),
+                "results": results
+            }
+        except Exception as e:
+            logger.error(f"Error importing TDS payments: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    async def import_payments_from_csv(self, db, deductor_id: str, file_content: bytes) -> Dict[str, Any]:
+        """Import a payment ledger CSV with deductee_pan, section, amount and payment_date columns."""
+        try:
+            df = pd.read_csv(BytesIO(file_content), dtype={"deductee_pan": str, "section": str})
+            df.columns = [column.strip().lower() for column in df.columns]
+            payments = df.astype(object).where(df.notna(), None).to_dict("records")
+        except Exception as e:
+            logger.error(f"Error reading TDS payment ledger: {str(e)}")
+            return {"success": False, "error": str(e)}
+        return await self.import_payments(db, deductor_id, payments, _import_id(file_content))
+
+    async def get_ledger(self, db, deductor_id: str, financial_year: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Accumulators of a deductor for a financial year, with TDS owed to date."""
+        rules = tax_rule_registry.get(financial_year)
+        ledgers = await db.tds_ledgers.find(
+            {"deductor_id": deductor_id, "financial_year": rules.financial_year}, {"_id": 0}
+        ).sort([("deductee_pan", 1), ("section", 1)]).to_list(None)
+        for ledger in ledgers:
+            rate = rules.tds_rates.get(ledger["section"], 0.10)
+            threshold = to_paise(rules.tds_thresholds.get(ledger["section"], 0))
+            total = ledger["total_paid_paise"]
+            ledger["total_paid"] = from_paise(total)
+            ledger["threshold"] = from_paise(threshold)
+            ledger["tds_applicable"] = total >= threshold
+            ledger["tds_owed"] = from_paise(int(self._owed(np.array([total]), rate, threshold)[0]))
+        return ledgers
+
+# Global TDS ledger service
+tds_ledger_service = TDSLedgerService()
@@ -3,6 +3,8 @@ from datetime import datetime, timedelta, timezone
 import uuid
 import logging
 
+from penalty_exposure_service import penalty_exposure_service
+
 logger = logging.getLogger(__name__)
 
 class TemplateService:
@@ -161,6 +163,7 @@ class TemplateService:
             }
             
             await db.tasks.insert_one(task)
+            await penalty_exposure_service.refresh_task(db, task["id"])
             
             return {
                 "success": True,
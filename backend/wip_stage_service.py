@@ -0,0 +1,243 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from pymongo import UpdateOne, ReturnDocument
+
+from ca_workflow_models import WIPStage
+from tax_rule_registry import fy_start_year, fy_code
+
+logger = logging.getLogger(__name__)
+
+# Rollup dimensions -> event field they group by
+DIMENSIONS = {"task_type": "task_type", "staff": "assigned_to", "firm": None}
+UNASSIGNED = "unassigned"
+# Stage a task is in before its first recorded transition
+INITIAL_STAGE = WIPStage.DATA_COLLECTION.value
+
+
+def _rollup_key(event: Dict[str, Any], dimension: str) -> str:
+    field = DIMENSIONS[dimension]
+    if field is None:
+        return "all"
+    value = event.get(field)
+    return value if value is not None else (UNASSIGNED if dimension == "staff" else "GENERAL")
+
+
+class WIPStageService:
+    """Stage transitions of tasks, kept as events with time-in-stage rollups.
+
+    A transition is one compare-and-swap on the task: the stage is changed
+    only if it is still the one the event was computed from, and the event
+    is pushed onto the task's wip_pending_events in the same update, so the
+    stage never changes without its history. The event is then copied to
+    wip_stage_events and its duration $inc'ed into rollups per task type,
+    staff member and the whole firm for the financial year, and taken off
+    the task. Events left pending by a failure are delivered by
+    deliver_pending at startup, and a logged event records whether its
+    rollups were applied, so redelivery never counts it twice. Bottleneck
+    reports read a few hundred rollup rows however many events accumulate.
+    """
+
+    async def ensure_indexes(self, db):
+        """Create indexes for task history and rollup lookups."""
+        await db.wip_stage_events.create_index("id", unique=True)
+        await db.wip_stage_events.create_index([("task_id", 1), ("at", 1)])
+        await db.wip_stage_events.create_index("at")
+        await db.wip_stage_rollups.create_index(
+            [("dimension", 1), ("key", 1), ("financial_year", 1), ("stage", 1)], unique=True
+        )
+        # Sparse, as only tasks with undelivered events carry it
+        await db.tasks.create_index("wip_pending_events.id", sparse=True)
+
+    async def transition(self, db, task_id: str, stage: WIPStage, actor: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Move a task to a stage and log the transition; None if the task does not exist."""
+        while True:
+            previous = await db.tasks.find_one(
+                {"id": task_id},
+                {"_id": 0, "client_id": 1, "task_type": 1, "assigned_to": 1,
+                 "wip_stage": 1, "wip_stage_since": 1, "created_at": 1}
+            )
+            if previous is None:
+                return None
+
+            now = datetime.now(timezone.utc)
+            event = self._event(task_id, previous, stage, actor, now)
+            update = {"wip_stage": stage.value, "wip_stage_since": now.isoformat(), "updated_at": now.isoformat()}
+            if stage == WIPStage.COMPLETED:
+                update["status"] = "COMPLETED"
+            # A concurrent transition changes wip_stage_since, so this retries on the new stage
+            result = await db.tasks.update_one(
+                {"id": task_id, "wip_stage": previous.get("wip_stage"), "wip_stage_since": previous.get("wip_stage_since")},
+                {"$set": update, "$push": {"wip_pending_events": event}}
+            )
+            if result.modified_count:
+                break
+
+        try:
+            await self._deliver(db, task_id, event)
+        except Exception as e:
+            # The event stays on the task and is delivered later
+            logger.warning(f"WIP stage event {event['id']} left pending: {str(e)}")
+        return event
+
+    def _event(self, task_id: str, previous: Dict[str, Any], stage: WIPStage, actor: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+        from_stage = previous.get("wip_stage") or INITIAL_STAGE
+        entered = previous.get("wip_stage_since") or previous.get("created_at")
+        entered_at = datetime.fromisoformat(entered) if isinstance(entered, str) else entered
+        if entered_at is not None and entered_at.tzinfo is None:
+            entered_at = entered_at.replace(tzinfo=timezone.utc)
+        duration = max((now - entered_at).total_seconds(), 0) if entered_at else 0
+
+        return {
+            "id": str(uuid.uuid4()),
+            "task_id": task_id,
+            "client_id": previous.get("client_id"),
+            "task_type": previous.get("task_type"),
+            "assigned_to": previous.get("assigned_to"),
+            "financial_year": fy_code(fy_start_year(now)),
+            "from_stage": from_stage,
+            "to_stage": stage.value,
+            "entered_at": entered_at.isoformat() if entered_at else None,
+            "at": now.isoformat(),
+            "duration_seconds": duration,
+            "actor_id": actor.get("id"),
+            "actor_name": actor.get("name")
+        }
+
+    async def _deliver(self, db, task_id: str, event: Dict[str, Any]):
+        """Copy a pending event to the log, add it to the rollups once and take it off the task."""
+        await db.wip_stage_events.update_one(
+            {"id": event["id"]}, {"$setOnInsert": {**event, "rollups_applied": False}}, upsert=True
+        )
+        # Only the delivery that claims the event adds it to the rollups
+        claimed = await db.wip_stage_events.update_one(
+            {"id": event["id"], "rollups_applied": False}, {"$set": {"rollups_applied": True}}
+        )
+        if claimed.modified_count:
+            try:
+                await self._apply(db, event)
+            except Exception:
+                await db.wip_stage_events.update_one({"id": event["id"]}, {"$set": {"rollups_applied": False}})
+                raise
+        await db.tasks.update_one({"id": task_id}, {"$pull": {"wip_pending_events": {"id": event["id"]}}})
+
+    async def deliver_pending(self, db) -> int:
+        """Deliver events left on tasks by transitions that failed part way."""
+        delivered = 0
+        try:
+            cursor = db.tasks.find(
+                {"wip_pending_events.id": {"$exists": True}}, {"_id": 0, "id": 1, "wip_pending_events": 1}
+            )
+            async for task in cursor:
+                for event in task["wip_pending_events"]:
+                    await self._deliver(db, task["id"], event)
+                    delivered += 1
+            if delivered:
+                logger.info(f"Delivered {delivered} pending WIP stage events")
+        except Exception as e:
+            logger.error(f"Error delivering pending WIP stage events: {str(e)}")
+        return delivered
+
+    async def _apply(self, db, event: Dict[str, Any]):
+        """Add one event to the rollups of each dimension."""
+        updated_at = event["at"]
+        updates = []
+        for dimension in DIMENSIONS:
+            scope = {"dimension": dimension, "key": _rollup_key(event, dimension), "financial_year": event["financial_year"]}
+            updates.append(UpdateOne(
+                {**scope, "stage": event["from_stage"]},
+                {"$inc": {"exits": 1, "total_seconds": event["duration_seconds"]},
+                 "$max": {"max_seconds": event["duration_seconds"]},
+                 "$set": {"updated_at": updated_at}},
+                upsert=True
+            ))
+            updates.append(UpdateOne(
+                {**scope, "stage": event["to_stage"]},
+                {"$inc": {"entries": 1}, "$set": {"updated_at": updated_at}},
+                upsert=True
+            ))
+        await db.wip_stage_rollups.bulk_write(updates, ordered=False)
+
+    async def task_history(self, db, task_id: str) -> List[Dict[str, Any]]:
+        """Transitions of a task, oldest first, including any not yet delivered to the log."""
+        events = await db.wip_stage_events.find(
+            {"task_id": task_id}, {"_id": 0, "rollups_applied": 0}
+        ).sort("at", 1).to_list(None)
+        task = await db.tasks.find_one({"id": task_id}, {"_id": 0, "wip_pending_events": 1}) or {}
+        logged = {event["id"] for event in events}
+        pending = [event for event in task.get("wip_pending_events", []) if event["id"] not in logged]
+        return sorted(events + pending, key=lambda event: event["at"])
+
+    async def bottlenecks(
+        self,
+        db,
+        dimension: str = "firm",
+        financial_year: Optional[str] = None,
+        key: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Average and longest time in each stage, slowest first."""
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"dimension must be one of {', '.join(DIMENSIONS)}")
+        query = {"dimension": dimension, "financial_year": financial_year or fy_code(fy_start_year(datetime.now(timezone.utc)))}
+        if key:
+            query["key"] = key
+        rollups = await db.wip_stage_rollups.find(query, {"_id": 0}).to_list(None)
+
+        rows = []
+        for rollup in rollups:
+            exits = rollup.get("exits", 0)
+            rows.append({
+                "key": rollup["key"],
+                "stage": rollup["stage"],
+                "financial_year": rollup["financial_year"],
+                "transitions": exits,
+                # Tasks that entered and have not left yet
+                "in_stage": max(rollup.get("entries", 0) - exits, 0),
+                "avg_hours": round(rollup.get("total_seconds", 0) / exits / 3600, 2) if exits else None,
+                "max_hours": round(rollup.get("max_seconds", 0) / 3600, 2) if exits else None
+            })
+        rows.sort(key=lambda row: (row["avg_hours"] is None, -(row["avg_hours"] or 0)))
+        return rows
+
+    async def rebuild_rollups(self, db) -> Dict[str, Any]:
+        """Recompute every rollup from the event log."""
+        try:
+            rollups = {}
+            for dimension, field in DIMENSIONS.items():
+                key = {"$ifNull": [f"${field}", UNASSIGNED if dimension == "staff" else "GENERAL"]} if field else "all"
+                exits = await db.wip_stage_events.aggregate([
+                    {"$group": {
+                        "_id": {"key": key, "financial_year": "$financial_year", "stage": "$from_stage"},
+                        "exits": {"$sum": 1},
+                        "total_seconds": {"$sum": "$duration_seconds"},
+                        "max_seconds": {"$max": "$duration_seconds"}
+                    }}
+                ]).to_list(None)
+                entries = await db.wip_stage_events.aggregate([
+                    {"$group": {
+                        "_id": {"key": key, "financial_year": "$financial_year", "stage": "$to_stage"},
+                        "entries": {"$sum": 1}
+                    }}
+                ]).to_list(None)
+                for row in exits + entries:
+                    scope = (dimension, row["_id"]["key"], row["_id"]["financial_year"], row["_id"]["stage"])
+                    rollup = rollups.setdefault(scope, {"exits": 0, "entries": 0, "total_seconds": 0, "max_seconds": 0})
+                    rollup.update({field: value for field, value in row.items() if field != "_id"})
+
+            rebuilt_at = datetime.now(timezone.utc).isoformat()
+            await db.wip_stage_rollups.delete_many({})
+            if rollups:
+                await db.wip_stage_rollups.insert_many([
+                    {"dimension": dimension, "key": key, "financial_year": financial_year, "stage": stage,
+                     **values, "updated_at": rebuilt_at}
+                    for (dimension, key, financial_year, stage), values in rollups.items()
+                ])
+            return {"success": True, "rollups": len(rollups)}
+        except Exception as e:
+            logger.error(f"Error rebuilding WIP stage rollups: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+# Global WIP stage service
+wip_stage_service = WIPStageService()